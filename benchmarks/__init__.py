@@ -0,0 +1,5 @@
+"""
+Benchmarks of the pieuvre transition engine.
+
+Run them from the repository root with ``python -m benchmarks``.
+"""
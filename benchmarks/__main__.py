@@ -0,0 +1,282 @@
+"""
+__main__.py
+=================================================
+Run the benchmarks:
+
+.. code-block::
+
+   python -m benchmarks                      # run and print results
+   python -m benchmarks --save-baseline      # store results as baseline
+   python -m benchmarks --compare            # compare with the baseline
+   python -m benchmarks -k available         # run matching cases only
+
+The baseline, ``benchmarks/baseline.json``, is committed with the commit
+of the measured ``pieuvre`` package, the Python and Django versions and the
+platform it was measured on. Save it again on your machine before
+comparing. To measure another version of the package, run these
+benchmarks from a checkout of it, cases it does not support are skipped:
+
+.. code-block::
+
+   git worktree add /tmp/pieuvre-baseline <commit>
+   cd /tmp/pieuvre-baseline
+   PYTHONPATH=/path/to/repository python -m benchmarks --save-baseline
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def setup_django():
+    """
+    Configure Django with an in-memory sqlite database if it is installed.
+
+    Returns:
+        bool: True if Django is available
+    """
+    try:
+        import django
+        from django.conf import settings
+    except ImportError:
+        return False
+
+    if not settings.configured:
+        settings.configure(
+            DATABASES={"default": {
+                "ENGINE": "django.db.backends.sqlite3",
+                "NAME": ":memory:",
+            }},
+            INSTALLED_APPS=[],
+            USE_TZ=True,
+        )
+        django.setup()
+    return True
+
+
+def get_environment():
+    """
+    Return the description of what the results are measured on: the git
+    commit of the ``pieuvre`` package, None if it is not in a git checkout,
+    the Python and Django versions and the platform.
+    """
+    import pieuvre
+
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(pieuvre.__file__)),
+            stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    try:
+        import django
+        django_version = django.get_version()
+    except ImportError:
+        django_version = None
+
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "django": django_version,
+        "platform": platform.platform(),
+    }
+
+
+def measure_time(run, per, min_time, repeat):
+    """
+    Return the timings of ``run`` in microseconds per unit.
+    """
+    # Calibrate the number of loops to run for at least ``min_time``
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            run()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops *= 10 if elapsed < min_time / 10 else 2
+
+    timings = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(loops):
+                run()
+            timings.append(
+                (time.perf_counter() - start) / loops / per * 1e6)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    return {
+        "loops": loops,
+        "min_us": min(timings),
+        "median_us": statistics.median(timings),
+    }
+
+
+def measure_allocations(run, per, loops=20):
+    """
+    Return the memory allocated by ``run`` in bytes per unit: ``peak_bytes``
+    is the transient peak during an operation, ``retained_bytes`` the memory
+    still allocated after it.
+    """
+    run()
+    tracemalloc.start()
+    try:
+        peaks = []
+        start = tracemalloc.get_traced_memory()[0]
+        for _ in range(loops):
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            run()
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+        retained = tracemalloc.get_traced_memory()[0] - start
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "peak_bytes": statistics.median(peaks) / per,
+        "retained_bytes": retained / loops / per,
+    }
+
+
+def run_benchmarks(pattern=None, min_time=0.2, repeat=5):
+    from .cases import BENCHMARKS
+
+    has_django = setup_django()
+    results = {}
+    for benchmark in BENCHMARKS:
+        if pattern and pattern not in benchmark.name:
+            continue
+        if benchmark.requires_django and not has_django:
+            print("{:<32} skipped: Django is not installed".format(
+                benchmark.name))
+            continue
+        if not benchmark.is_supported():
+            print("{:<32} skipped: not supported by this pieuvre".format(
+                benchmark.name))
+            continue
+
+        run = benchmark.setup()
+        result = measure_time(run, benchmark.per, min_time, repeat)
+        if hasattr(tracemalloc, "reset_peak"):
+            result.update(measure_allocations(run, benchmark.per))
+        results[benchmark.name] = result
+        print_result(benchmark.name, result)
+
+    return results
+
+
+def print_result(name, result):
+    line = "{:<32} {:>12.3f} us  (min {:.3f} us)".format(
+        name, result["median_us"], result["min_us"])
+    if "peak_bytes" in result:
+        line += "  peak {:>9.0f} B  retained {:>7.0f} B".format(
+            result["peak_bytes"], result["retained_bytes"])
+    print(line)
+
+
+def compare(baseline, results, threshold):
+    """
+    Print a comparison of ``results`` with ``baseline``.
+
+    Returns:
+        list: names of the benchmarks slower than the baseline by more than
+            ``threshold``
+    """
+    regressions = []
+    print()
+    print("{:<32} {:>12} {:>12} {:>8} {:>12} {:>12}".format(
+        "benchmark", "baseline us", "current us", "ratio",
+        "baseline B", "current B"))
+
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            print("{:<32} {:>12} {:>12.3f}".format(
+                name, "-", result["median_us"]))
+            continue
+
+        ratio = result["median_us"] / reference["median_us"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  SLOWER"
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            flag = "  faster"
+
+        print("{:<32} {:>12.3f} {:>12.3f} {:>7.2f}x {:>12} {:>12}{}".format(
+            name, reference["median_us"], result["median_us"], ratio,
+            format_bytes(reference.get("peak_bytes")),
+            format_bytes(result.get("peak_bytes")), flag))
+
+    return regressions
+
+
+def format_bytes(value):
+    return "-" if value is None else "{:.0f}".format(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Benchmark the pieuvre transition engine.")
+    parser.add_argument(
+        "-k", dest="pattern", help="only run benchmarks matching PATTERN")
+    parser.add_argument(
+        "--min-time", type=float, default=0.2,
+        help="minimum duration of a measure in seconds")
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="number of measures")
+    parser.add_argument(
+        "--baseline", default=DEFAULT_BASELINE, help="baseline file")
+    parser.add_argument(
+        "--save-baseline", action="store_true",
+        help="store the results in the baseline file")
+    parser.add_argument(
+        "--compare", action="store_true",
+        help="compare the results with the baseline file")
+    parser.add_argument(
+        "--threshold", type=float, default=0.1,
+        help="relative slowdown reported as a regression")
+    parser.add_argument(
+        "--fail-on-regression", action="store_true",
+        help="exit with an error status if a benchmark regressed")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.pattern, args.min_time, args.repeat)
+
+    if args.compare:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+        regressions = compare(baseline, results, args.threshold)
+        if regressions and args.fail_on_regression:
+            return 1
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(dict(get_environment(), results=results),
+                      baseline_file, indent=2, sort_keys=True)
+        print("Baseline saved to {}".format(args.baseline))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
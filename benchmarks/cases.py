@@ -0,0 +1,152 @@
+"""
+cases.py
+=================================================
+Benchmark definitions.
+"""
+
+from .workflows import (
+    Model,
+    TouchWorkflow,
+    make_graph_workflow,
+    make_hooked_workflow,
+)
+
+
+class Benchmark:
+    """
+    A benchmark case.
+
+    Attributes:
+        name (str): unique name of the case
+        setup (callable): returns the operation to time, a callable without
+            argument
+        per (int): number of transitions or queries performed by one
+            operation, results are reported per unit
+        requires_django (bool): the case is skipped if Django is not
+            available
+        requires (tuple): dotted names of the ``pieuvre`` attributes the
+            case uses, it is skipped if one is missing, e.g. when measuring
+            an older version
+    """
+
+    def __init__(self, name, setup, per=1, requires_django=False,
+                 requires=()):
+        self.name = name
+        self.setup = setup
+        self.per = per
+        self.requires_django = requires_django
+        self.requires = requires
+
+    def is_supported(self):
+        """
+        Return True if the installed ``pieuvre`` has the attributes of
+        ``requires``.
+        """
+        import pieuvre
+
+        for name in self.requires:
+            obj = pieuvre
+            for attribute in name.split("."):
+                obj = getattr(obj, attribute, None)
+            if obj is None:
+                return False
+        return True
+
+
+def instantiate_hooked_workflow():
+    workflow_class = make_hooked_workflow(hooks=100)
+    model = Model()
+
+    def run():
+        workflow_class(model=model)
+    return run
+
+
+def run_decorated_transition():
+    workflow = TouchWorkflow(model=Model())
+
+    def run():
+        workflow.run_transition("touch")
+    return run
+
+
+def run_default_transition():
+    workflow = TouchWorkflow(model=Model())
+
+    def run():
+        workflow.run_transition("poke")
+    return run
+
+
+def run_shared_transition():
+    from pieuvre import BoundWorkflow
+
+    workflow = BoundWorkflow(TouchWorkflow.shared(), Model())
+
+    def run():
+        workflow.poke()
+    return run
+
+
+def get_available_transitions(states):
+    def setup():
+        workflow_class = make_graph_workflow(states)
+        workflow = workflow_class(model=Model(
+            state="state_{}".format(states // 2)))
+
+        def run():
+            workflow.get_available_transitions()
+        return run
+    return setup
+
+
+def bulk_run_transition(size):
+    def setup():
+        models = [Model() for _ in range(size)]
+
+        def run():
+            TouchWorkflow.bulk_run_transition("poke", models, chunk_size=500)
+        return run
+    return setup
+
+
+def django_transition():
+    from .django_models import DjangoTouchWorkflow, create_orders
+
+    workflow = DjangoTouchWorkflow(model=create_orders(1)[0])
+
+    def run():
+        workflow.run_transition("touch")
+    return run
+
+
+def django_bulk_run_transition(size):
+    def setup():
+        from .django_models import DjangoTouchWorkflow, create_orders
+
+        models = create_orders(size)
+
+        def run():
+            DjangoTouchWorkflow.bulk_run_transition(
+                "poke", models, chunk_size=500)
+        return run
+    return setup
+
+
+BENCHMARKS = [
+    Benchmark("instantiate_100_hooks", instantiate_hooked_workflow),
+    Benchmark("run_transition_decorated", run_decorated_transition),
+    Benchmark("run_transition_default", run_default_transition),
+    Benchmark("run_transition_shared", run_shared_transition,
+              requires=("BoundWorkflow", )),
+    Benchmark("available_transitions_10", get_available_transitions(10)),
+    Benchmark("available_transitions_100", get_available_transitions(100)),
+    Benchmark("available_transitions_1000", get_available_transitions(1000)),
+    Benchmark("bulk_run_transition_1000", bulk_run_transition(1000), per=1000,
+              requires=("Workflow.bulk_run_transition", )),
+    Benchmark("django_sqlite_transition", django_transition,
+              requires_django=True),
+    Benchmark("django_sqlite_bulk_1000", django_bulk_run_transition(1000),
+              per=1000, requires_django=True,
+              requires=("Workflow.bulk_run_transition", )),
+]
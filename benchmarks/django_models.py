@@ -0,0 +1,40 @@
+"""
+django_models.py
+=================================================
+Django models of the benchmarks, backed by an in-memory sqlite database.
+
+Django must be configured with ``setup_django`` before importing this
+module.
+"""
+
+from django.db import connection, models
+
+from pieuvre import WorkflowEnabled
+
+from .workflows import TouchWorkflow
+
+
+class DjangoTouchWorkflow(TouchWorkflow):
+    db_logging = False
+
+
+class Order(WorkflowEnabled, models.Model):
+    workflow_class = DjangoTouchWorkflow
+
+    state = models.CharField(max_length=20, default="draft")
+    value = models.IntegerField(default=0)
+
+    class Meta:
+        app_label = "benchmarks"
+
+
+with connection.schema_editor() as editor:
+    editor.create_model(Order)
+
+
+def create_orders(count):
+    """
+    Create ``count`` orders and return them.
+    """
+    Order.objects.bulk_create([Order() for _ in range(count)])
+    return list(Order.objects.order_by("-pk")[:count])
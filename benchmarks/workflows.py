@@ -0,0 +1,108 @@
+"""
+workflows.py
+=================================================
+Synthetic workflows and models used by the benchmarks.
+"""
+
+from pieuvre import Workflow, on_enter_state, on_enter_state_check, transition
+
+
+class Model(object):
+    """
+    In-memory model with a no-op ``save``.
+    """
+
+    def __init__(self, state="draft"):
+        self.state = state
+        self.value = 0
+
+    def save(self, update_fields=None):
+        pass
+
+
+class LoggingModel(object):
+
+    @classmethod
+    def log(cls, **kwargs):
+        pass
+
+
+def make_hooked_workflow(hooks=100):
+    """
+    Build a workflow class with ``hooks`` decorated state checks and
+    ``hooks`` decorated state hooks.
+    """
+    namespace = {
+        "states": ["draft", "submitted"],
+        "transitions": [
+            {"name": "submit", "source": "draft", "destination": "submitted"},
+        ],
+    }
+    for index in range(hooks):
+        namespace["check_{}".format(index)] = on_enter_state_check(
+            "submitted")(lambda self: True)
+        namespace["hook_{}".format(index)] = on_enter_state(
+            "submitted")(lambda self, transition: None)
+
+    return type("HookedWorkflow", (Workflow, ), namespace)
+
+
+class TouchWorkflow(Workflow):
+    """
+    Workflow whose transitions are always valid, so that they can be ran
+    repeatedly on the same model.
+    """
+
+    db_logging = True
+    db_logging_class = LoggingModel
+
+    states = ["draft", "touched", "poked"]
+    transitions = [
+        {"name": "touch", "source": "*", "destination": "touched"},
+        {"name": "poke", "source": "*", "destination": "poked"},
+    ]
+
+    def check_touch(self):
+        return True
+
+    def before_touch(self):
+        self.model.value += 1
+
+    @transition()
+    def touch(self):
+        return self.model.value
+
+    def after_touch(self, result):
+        pass
+
+    def on_enter_touched(self, transition):
+        pass
+
+    def on_exit_touched(self, transition):
+        pass
+
+    def on_enter_poked(self, transition):
+        pass
+
+
+def make_graph_workflow(states, fanout=3):
+    """
+    Build a workflow class with ``states`` states, ``fanout`` transitions
+    leaving each state and a wildcard transition.
+    """
+    names = ["state_{}".format(index) for index in range(states)]
+    transitions = [
+        {"name": "cancel", "source": "*", "destination": names[0]},
+    ]
+    for index, name in enumerate(names):
+        for step in range(1, fanout + 1):
+            transitions.append({
+                "name": "{}_to_{}".format(name, step),
+                "source": name,
+                "destination": names[(index + step) % states],
+            })
+
+    return type("GraphWorkflow{}".format(states), (Workflow, ), {
+        "states": names,
+        "transitions": transitions,
+    })
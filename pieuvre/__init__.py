@@ -1,9 +1,14 @@
 from .core import Workflow
-from .core import Transition as transition
-from .core import OnEnterStateCheck as on_enter_state_check
-from .core import OnExitStateCheck as on_exit_state_check
-from .core import OnEnterState as on_enter_state
-from .core import OnExitState as on_exit_state
-from .exceptions import InvalidTransition, ForbiddenTransition, TransitionDoesNotExist, TransitionNotFound
+from .shared import BoundWorkflow
+from .decorators import Transition as transition
+from .decorators import OnEnterStateCheck as on_enter_state_check
+from .decorators import OnExitStateCheck as on_exit_state_check
+from .decorators import OnEnterState as on_enter_state
+from .decorators import OnExitState as on_exit_state
+from .exceptions import (
+    InvalidTransition, ForbiddenTransition, TransitionDoesNotExist,
+    TransitionNotFound, ConcurrentTransition, LockOrderError
+)
 from .events import WorkflowEventManager
-from .mixins import WorkflowEnabled
+from .mixins import WorkflowEnabled, WorkflowQuerySetMixin
+from .aio import AsyncWorkflow
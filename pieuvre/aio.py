@@ -0,0 +1,666 @@
+"""
+aio.py
+=================================================
+Asyncio workflow implementation
+"""
+
+import asyncio
+import inspect
+import logging
+
+from functools import partial
+
+try:
+    from contextvars import copy_context
+except ImportError:
+    # Python < 3.7, see ``check_context_vars``
+    copy_context = None
+
+try:
+    from asgiref.sync import async_to_sync, sync_to_async
+except ImportError:
+    # asgiref is installed with Django
+    async_to_sync = sync_to_async = None
+
+try:
+    from django.db import transaction
+except ImportError:
+    # Without Django, the writes are not ran in a transaction
+    transaction = None
+
+from .allowed import AllowedTransitions
+from .bulk import BulkTransitionResult
+from .compiler import compiled_stage
+from .core import Workflow, _unsaved_transition
+from .exceptions import TransitionDoesNotExist
+from .unit_of_work import UnitOfWork, _unit_of_work
+from .utils import ContextVar
+
+
+logger = logging.getLogger(__name__)
+
+# Options of ``Workflow`` that ``AsyncWorkflow`` does not implement
+UNSUPPORTED_OPTIONS = ("lock_manager", "cas_writes", "coalesce_saves")
+
+
+def check_options(workflow_class):
+    """
+    Raise ``ValueError`` if an asynchronous workflow class sets an option
+    of ``UNSUPPORTED_OPTIONS``.
+    """
+    for option in UNSUPPORTED_OPTIONS:
+        if getattr(workflow_class, option):
+            raise ValueError(
+                "{} sets {}, which AsyncWorkflow does not support".format(
+                    workflow_class.__name__, option))
+
+
+async def maybe_await(value):
+    """
+    Await ``value`` if it is awaitable, return it otherwise.
+    """
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+async def run_sync(func, *args):
+    """
+    Call ``func`` in a thread and await its result. Django forbids database
+    access, ``transaction.on_commit`` included, from the event loop: Django
+    code is ran with ``sync_to_async``, in the thread Django reserves for it.
+    ``func`` is called in a copy of the current context.
+
+    Args:
+        func (callable): synchronous function
+        args: arguments of ``func``
+
+    Returns:
+        Any: the output of ``func``
+    """
+    if sync_to_async is not None:
+        return await sync_to_async(func)(*args)
+
+    return await asyncio.get_event_loop().run_in_executor(
+        None, partial(copy_context().run, func, *args))
+
+
+def check_context_vars():
+    """
+    Raise ``ImportError`` if ``contextvars`` is not available: the state of
+    the transitions, stored per thread instead, would be shared by the
+    tasks of the event loop.
+    """
+    if ContextVar is None:
+        raise ImportError("AsyncWorkflow requires contextvars (Python 3.7+)")
+
+
+class AsyncIterator:
+    """
+    Asynchronous iterator over an iterable.
+    """
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+async def gather_chunks(func, models, chunk_size):
+    """
+    Await ``func(model)`` for every model, concurrently for the models of
+    each chunk of ``chunk_size``.
+
+    Args:
+        func (callable): coroutine function
+        models: models, Django queryset or asynchronous iterable of models
+        chunk_size (int): number of models per chunk
+
+    Returns:
+        list: the results, in order
+    """
+    if hasattr(models, "aiterator"):
+        # Django queryset: do not cache the whole result in memory
+        models = models.aiterator(chunk_size=chunk_size)
+    elif not hasattr(models, "__aiter__"):
+        models = AsyncIterator(models)
+
+    results = []
+    chunk = []
+    async for model in models:
+        chunk.append(model)
+        if len(chunk) >= chunk_size:
+            results.extend(await asyncio.gather(*map(func, chunk)))
+            chunk = []
+    results.extend(await asyncio.gather(*map(func, chunk)))
+    return results
+
+
+class AsyncWorkflow(Workflow):
+    """
+    Workflow running transitions natively with asyncio.
+
+    Transitions, defined and decorated exactly as in ``Workflow``, return
+    coroutines:
+
+    .. code-block::
+
+       class OrderWorkflow(AsyncWorkflow):
+           transitions = [
+               {"name": "submit", "source": "draft", "destination": "submitted"}
+           ]
+
+           async def before_submit(self):
+               await self.model.items.acount()
+
+           @transition()
+           async def submit(self):
+               ...
+
+       await order.workflow.submit()
+
+    Hooks (``check_``, ``before_``, ``after_``, ``on_enter_``, ``on_exit_``
+    and the state hook decorators) may be coroutine functions or plain
+    functions. Models are saved with ``asave`` if they implement it (Django
+    4.2+), transitions logged with ``db_logging_class.alog`` if it exists
+    and events pushed with ``WorkflowEventManager.apush_event``.
+
+    With Django, the save of the model, the log, the ``state_counter`` and
+    the events of a transition are instead written synchronously in a
+    thread, see ``run_sync``, in one ``transaction.atomic`` block as with
+    ``Workflow``: ``asave``, ``alog`` and ``apush_event`` are not used.
+    The hooks are not ran in the transaction, which Django does not support
+    in asynchronous code.
+
+    Otherwise the synchronous steps which may access the database are ran
+    in a thread: ``db_logging_class.log`` when there is no ``alog``, the
+    ``event_dispatcher`` and the ``state_counter``.
+
+    In both cases the events of the managers with ``batch_events`` and the
+    logs of a ``db_logging_class`` with ``batch_logs`` are written together
+    in a thread at the end of the outermost transition.
+
+    Concurrent tasks are isolated with ``contextvars``: asynchronous
+    workflows require Python 3.7+.
+
+    ``lock_manager``, ``cas_writes`` and ``coalesce_saves`` are not
+    supported: ``ValueError`` is raised when a class setting them is
+    defined, or when a workflow is created if they are set afterwards.
+    """
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        check_options(cls)
+
+    def __init__(self, model):
+        self._check_support()
+        super().__init__(model)
+
+    @classmethod
+    def shared(cls):
+        cls._check_support()
+        return super().shared()
+
+    @classmethod
+    def _check_support(cls):
+        check_context_vars()
+        check_options(cls)
+
+    async def execute_transition(self, name, body, args, kwargs):
+        if _unsaved_transition.get() is not None:
+            unsaved = self._pop_unsaved(name)
+            if unsaved is not None:
+                return await self._execute_unsaved(
+                    *unsaved, body, args, kwargs)
+
+        return await self._batching_events(
+            self._execute_transition, name, body, args, kwargs)
+
+    async def _batching_events(self, func, *args):
+        """
+        Await ``func``, running transitions, in a unit of work pushing the
+        events of the managers with ``batch_events``, and writing the logs
+        of a ``db_logging_class`` with ``batch_logs``, together at the end
+        of the outermost transition, as ``Workflow._execute_atomic``.
+        """
+        unit = _unit_of_work.get()
+        if unit is not None:
+            # Nested transition: forget its events if it fails
+            mark = unit.mark()
+            try:
+                return await func(*args)
+            except Exception:
+                unit.rollback(mark)
+                raise
+
+        if not self._has_batched_writes():
+            return await func(*args)
+
+        unit = UnitOfWork(defer_saves=False)
+        token = _unit_of_work.set(unit)
+        try:
+            result = await func(*args)
+        finally:
+            _unit_of_work.reset(token)
+        await run_sync(unit.flush if transaction is None
+                       else transaction.atomic(unit.flush))
+        return result
+
+    async def _execute_transition(self, name, body, args, kwargs):
+        compiled = self._compiled_transitions[name]
+        snapshots = len(self._change_snapshots or ())
+        try:
+            return await self._stage(
+                compiled, "transition", self._execute_stages,
+                compiled, body, args, kwargs)
+        finally:
+            # Drop the snapshot of a transition that failed before saving
+            if self._change_snapshots:
+                del self._change_snapshots[snapshots:]
+
+    async def _execute_stages(self, compiled, body, args, kwargs):
+        await self.pre_transition(compiled.name, *args, **kwargs)
+        result = None
+        if body:
+            result = await self._stage(
+                compiled, "body", partial(body, self, *args, **kwargs))
+        await self.post_transition(compiled.name, result, *args, **kwargs)
+        return result
+
+    async def _stage(self, compiled, stage, func, *args):
+        """
+        Await ``func`` in a span of the tracer and report its duration to the
+        metrics collector, depending on the instruments of the workflow.
+        """
+        if self.metrics_collector is None and self.tracer is None:
+            return await maybe_await(func(*args))
+
+        with self._measure(compiled, stage):
+            return await maybe_await(func(*args))
+
+    async def default_transition(self, name, *args, **kwargs):
+        await self.execute_transition(name, None, args, kwargs)
+
+    async def run_transition(self, name, *args, **kwargs):
+        compiled = self._compiled_transitions.get(name)
+        if compiled is not None and compiled.method:
+            return await maybe_await(compiled.method(self, *args, **kwargs))
+
+        # Raises TransitionDoesNotExist if needed
+        return await super().run_transition(name, *args, **kwargs)
+
+    async def _run_unsaved(self, compiled, source, args, kwargs):
+        with self._unsaved(compiled, source):
+            return await self.run_transition(compiled.name, *args, **kwargs)
+
+    async def _execute_unsaved(self, compiled, source, body, args, kwargs):
+        await self._leave_source(compiled, source, args, kwargs)
+        result = None
+        if body:
+            result = await maybe_await(body(self, *args, **kwargs))
+        await self._enter_destination(compiled, result)
+        self.update_transition_date(compiled.transition)
+        return result
+
+    @classmethod
+    async def bulk_run_transition(cls, name, models, *args, chunk_size=500,
+                                  **kwargs):
+        """
+        Run a transition on many models, awaiting ``run_transition`` for
+        the models of each chunk concurrently.
+
+        There is no transaction per chunk: every model is saved, logged
+        and its events pushed by its own transition. A model whose transition fails
+        is put back in its source state with ``rollback`` and reported with
+        the exception, the other models are not affected.
+
+        Args:
+            name (str): transition name
+            models: models, Django queryset or asynchronous iterable of
+                models
+            chunk_size (int): number of models ran concurrently, and
+                fetched at once from a queryset
+
+        Returns:
+            list: a ``BulkTransitionResult`` per model, in order
+
+        Raises:
+            TransitionDoesNotExist
+        """
+        compiled = cls._compiled_transitions.get(name)
+        if compiled is None:
+            raise TransitionDoesNotExist(transition=name)
+
+        return await gather_chunks(
+            partial(cls._bulk_run_model, compiled, args, kwargs),
+            models, chunk_size)
+
+    @classmethod
+    async def _bulk_run_model(cls, compiled, args, kwargs, model):
+        workflow = cls(model=model)
+        source = workflow._get_model_state()
+        try:
+            result = await workflow.run_transition(
+                compiled.name, *args, **kwargs)
+        except Exception as exc:
+            workflow.rollback(source, compiled.destination, exc)
+            return BulkTransitionResult(model, error=exc)
+        return BulkTransitionResult(model, result)
+
+    async def get_allowed_transitions(self, state=None):
+        evaluation = self._evaluate_checks(state or self._get_model_state())
+        value = next(evaluation)
+        while not isinstance(value, AllowedTransitions):
+            value = evaluation.send(await maybe_await(value(self)))
+        return value
+
+    @classmethod
+    async def bulk_get_allowed_transitions(cls, models, chunk_size=500):
+        """
+        Evaluate the transitions allowed for many models, see
+        ``get_allowed_transitions``. The models of each chunk are evaluated
+        concurrently.
+
+        Args:
+            models: models, Django queryset or asynchronous iterable of
+                models
+            chunk_size (int): number of models evaluated concurrently, and
+                fetched at once from a queryset
+
+        Returns:
+            list: an ``AllowedTransitions`` per model, in order
+        """
+        return await gather_chunks(
+            lambda model: cls(model=model).get_allowed_transitions(),
+            models, chunk_size)
+
+    async def advance_to(self, target_state):
+        return await self._batching_events(self._advance_to, target_state)
+
+    async def _advance_to(self, target_state):
+        path = self.path_to(target_state)
+        if not path:
+            return []
+
+        done = []
+        with self._restoring_state(target_state):
+            for trans in path:
+                compiled, source = self._check_path_step(trans)
+                await self._run_unsaved(compiled, source, (), {})
+                done.append(dict(trans, source=source))
+
+        if transaction is not None:
+            await run_sync(self._write_path, done)
+            return done
+
+        await self._save_model(self._pop_path_changed_fields(done))
+
+        for trans in done:
+            await self._log_db(trans)
+            await self._count_transition(trans)
+            await self.create_events(trans)
+        return done
+
+    def _write_path(self, done):
+        """
+        Save the model, log and push the events of the transitions of a
+        path in a transaction, as ``Workflow.advance_to``.
+        """
+        with transaction.atomic():
+            Workflow._save_model(self, self._pop_path_changed_fields(done))
+            for trans in done:
+                self._log_in_thread(trans, (), {})
+                Workflow._count_transition(self, trans)
+                Workflow.create_events(self, trans)
+
+    async def pre_transition(self, name, *args, **kwargs):
+        compiled = self._compiled_transitions[name]
+        source = self._get_model_state()
+
+        #  Check if transition is valid
+        self._pre_transition_check(compiled.transition, source)
+
+        await self._leave_source(compiled, source, args, kwargs)
+
+    async def _leave_source(self, compiled, source, args, kwargs):
+        stage = self._stage
+        await stage(compiled, "check", self._run_checks,
+                    compiled, source, args, kwargs)
+
+        self._snapshot_fields()
+
+        await stage(compiled, "before", self._run_before_hook,
+                    compiled, args, kwargs)
+
+        await stage(compiled, "exit_hooks", self._run_exit_hooks,
+                    source, compiled.transition)
+
+    async def post_transition(self, name, result, *args, **kwargs):
+        compiled = self._compiled_transitions[name]
+        transition = compiled.transition
+        source = self._get_model_state()
+        stage = self._stage
+
+        await self._enter_destination(compiled, result)
+
+        _transition = dict(transition, source=source)
+        if transaction is not None:
+            await run_sync(self._write_transition, compiled, _transition,
+                           args, kwargs)
+            return
+
+        await stage(compiled, "save", self.finalize_transition, transition)
+
+        await stage(compiled, "log", partial(self._log_db, *args, **kwargs),
+                    _transition)
+        await self._count_transition(_transition)
+
+        await stage(compiled, "events", self.create_events, _transition)
+
+    def _write_transition(self, compiled, transition, args, kwargs):
+        """
+        Save the model, log the transition and push its events in a
+        transaction, as ``Workflow.post_transition``.
+        """
+        instrument = self._get_instrument()
+        with transaction.atomic():
+            self.update_transition_date(transition)
+            instrument(compiled, "save", Workflow._save_model, self,
+                       self._pop_changed_fields(transition))
+            instrument(compiled, "log", self._log_in_thread,
+                       transition, args, kwargs)
+            Workflow._count_transition(self, transition)
+            instrument(compiled, "events", Workflow.create_events, self,
+                       transition)
+
+    def _log_in_thread(self, transition, args, kwargs):
+        """
+        Log a transition from the thread of ``run_sync``, awaiting ``alog``
+        or an asynchronous ``log`` with ``async_to_sync``.
+        """
+        log_class = self.db_logging_class
+        if hasattr(log_class, "alog") \
+                or inspect.iscoroutinefunction(getattr(log_class, "log", None)):
+            async_to_sync(self._log_db)(transition, *args, **kwargs)
+            return
+        Workflow._log_db(self, transition, *args, **kwargs)
+
+    async def _enter_destination(self, compiled, result):
+        self.update_model_state(compiled.destination)
+
+        await self._stage(compiled, "enter_hooks", self._run_enter_hooks,
+                          compiled, compiled.transition)
+
+        await self._stage(compiled, "after", self._run_after_hook,
+                          compiled, result)
+
+    async def finalize_transition(self, transition):
+        """
+        Update the model state and save it, with ``asave`` if the model
+        implements it.
+        """
+        self.update_transition_date(transition)
+        await self._save_model(self._pop_changed_fields(transition))
+
+    async def _save_model(self, update_fields=None):
+        kwargs = {} if update_fields is None else {
+            "update_fields": update_fields}
+
+        asave = getattr(self.model, "asave", None)
+        if asave is not None:
+            await asave(**kwargs)
+        else:
+            await maybe_await(self.model.save(**kwargs))
+
+    async def _log_db(self, transition, *args, **kwargs):
+        if not self.db_logging:
+            return
+
+        record = self._get_log_record(transition, args, kwargs)
+        unit = _unit_of_work.get()
+        if unit is not None and unit.defers_log(self.db_logging_class):
+            # Written by ``_batching_events``
+            unit.log(self.db_logging_class, record)
+            return
+
+        alog = getattr(self.db_logging_class, "alog", None)
+        if alog is not None:
+            await alog(**record)
+            return
+
+        log = self.db_logging_class.log
+        if inspect.iscoroutinefunction(log):
+            await log(**record)
+        else:
+            await run_sync(partial(log, **record))
+
+    async def _count_transition(self, transition):
+        if self.state_counter is not None:
+            await run_sync(self.state_counter.record, self, transition)
+
+    async def create_events(self, transition):
+        if not self.event_managers:
+            return
+
+        unit = _unit_of_work.get()
+        for manager in self.event_managers:
+            if unit is not None and manager.batch_events:
+                # Pushed by ``_batching_events``
+                event = manager.build_event(transition)
+                if event is not None:
+                    unit.push_event(manager, event)
+            elif self.event_dispatcher is None:
+                await manager.apush_event(transition)
+            else:
+                event = manager.build_event(transition)
+                if event is not None:
+                    await run_sync(
+                        self.event_dispatcher.dispatch, manager, event)
+
+    @compiled_stage
+    async def _on_enter_state(self, transition):
+        await self._call_enter_hooks(
+            self._get_compiled_transition(transition), transition)
+
+    async def _run_enter_hooks(self, compiled, transition):
+        if "_on_enter_state" in self._overridden_stages:
+            await maybe_await(self._on_enter_state(transition))
+            return
+        await self._call_enter_hooks(compiled, transition)
+
+    async def _call_enter_hooks(self, compiled, transition):
+        logger.debug("Entering %s %s", self.state_field_name, compiled.destination)
+        for func in compiled.enter_hooks:
+            await maybe_await(func(self, transition))
+
+    @compiled_stage
+    async def _on_exit_state(self, transition):
+        await self._call_exit_hooks(self._get_model_state(), transition)
+
+    async def _run_exit_hooks(self, state, transition):
+        if "_on_exit_state" in self._overridden_stages:
+            await maybe_await(self._on_exit_state(transition))
+            return
+        await self._call_exit_hooks(state, transition)
+
+    async def _call_exit_hooks(self, state, transition):
+        logger.debug("Leaving %s %s", self.state_field_name, state)
+        for func in self._exit_hooks.get(state, ()):
+            await maybe_await(func(self, transition))
+
+    @compiled_stage
+    async def _before_transition(self, transition, *args, **kwargs):
+        await self._call_before_hook(
+            self._get_compiled_transition(transition), args, kwargs)
+
+    async def _run_before_hook(self, compiled, args, kwargs):
+        if "_before_transition" in self._overridden_stages:
+            await maybe_await(self._before_transition(
+                compiled.transition, *args, **kwargs))
+            return
+        await self._call_before_hook(compiled, args, kwargs)
+
+    async def _call_before_hook(self, compiled, args, kwargs):
+        if compiled.before:
+            await maybe_await(compiled.before(self, *args, **kwargs))
+
+    @compiled_stage
+    async def _after_transition(self, transition, result):
+        await self._call_after_hook(
+            self._get_compiled_transition(transition), result)
+
+    async def _run_after_hook(self, compiled, result):
+        if "_after_transition" in self._overridden_stages:
+            await maybe_await(self._after_transition(
+                compiled.transition, result))
+            return
+        await self._call_after_hook(compiled, result)
+
+    async def _call_after_hook(self, compiled, result):
+        if compiled.after:
+            await maybe_await(compiled.after(self, result))
+
+    async def _check_on_enter_state(self, state):
+        return await self._all(self._enter_checks.get(state, ()))
+
+    async def _check_on_exit_state(self, state):
+        return await self._all(self._exit_checks.get(state, ()))
+
+    async def _all(self, functions):
+        # Like ``Workflow``, all checks are called
+        results = []
+        for func in functions:
+            results.append(await maybe_await(func(self)))
+        return all(results)
+
+    @compiled_stage
+    async def check_transition_condition(self, transition, *args, **kwargs):
+        await self._call_checks(
+            self._get_compiled_transition(transition),
+            self._get_model_state(), args, kwargs)
+
+    async def _run_checks(self, compiled, state, args, kwargs):
+        if "check_transition_condition" in self._overridden_stages:
+            await maybe_await(self.check_transition_condition(
+                compiled.transition, *args, **kwargs))
+            return
+        await self._call_checks(compiled, state, args, kwargs)
+
+    async def _call_checks(self, compiled, state, args, kwargs):
+        valid_transition = not compiled.check or await maybe_await(
+            compiled.check(self, *args, **kwargs))
+
+        if valid_transition \
+                and await maybe_await(
+                    self._check_on_enter_state(compiled.destination)) \
+                and await maybe_await(self._check_on_exit_state(state)):
+            return
+
+        self._raise_forbidden(compiled, state)
@@ -0,0 +1,175 @@
+"""
+allowed.py
+=================================================
+Transitions allowed by their checks.
+"""
+
+import inspect
+
+from itertools import chain
+
+from .exceptions import ForbiddenTransition
+
+
+class AllowedTransitions:
+    """
+    Transitions of a model evaluated by
+    ``Workflow.get_allowed_transitions``.
+
+    Attributes:
+        model: the model
+        state (str): the source state
+        allowed (tuple): transitions whose checks passed, in declaration
+            order
+        forbidden (dict): name of the failed check of each forbidden
+            transition, by transition name
+    """
+
+    __slots__ = ("model", "state", "allowed", "forbidden")
+
+    def __init__(self, model, state, allowed, forbidden):
+        self.model = model
+        self.state = state
+        self.allowed = allowed
+        self.forbidden = forbidden
+
+    @property
+    def names(self):
+        """
+        Names of the allowed transitions.
+        """
+        return [trans["name"] for trans in self.allowed]
+
+    def is_allowed(self, name):
+        return any(trans["name"] == name for trans in self.allowed)
+
+    def __repr__(self):
+        return "<AllowedTransitions {} {}>".format(self.state, self.names)
+
+
+class ConditionCheck:
+    """
+    Overridden ``check_transition_condition`` of a workflow, called for a
+    transition as a check: it passes unless ``ForbiddenTransition`` is
+    raised.
+    """
+
+    __slots__ = ("transition", "__name__")
+
+    def __init__(self, transition):
+        self.transition = transition
+        self.__name__ = "check_transition_condition"
+
+    def __call__(self, workflow):
+        try:
+            result = workflow.check_transition_condition(self.transition)
+        except ForbiddenTransition:
+            return False
+
+        if inspect.isawaitable(result):
+            return self._await(result)
+        return True
+
+    async def _await(self, result):
+        try:
+            await result
+        except ForbiddenTransition:
+            return False
+        return True
+
+
+class AllowedTransitionsMixin:
+    """
+    ``Workflow.get_allowed_transitions``.
+    """
+
+    def get_allowed_transitions(self, state=None):
+        """
+        Evaluate the transitions available from a given state, or from the
+        current state, with their conditions: ``check_<name>`` and the
+        ``@on_enter_state_check`` and ``@on_exit_state_check`` functions.
+        Checks are called without arguments. If ``check_transition_condition``
+        is overridden, it is called instead for each transition, which is
+        forbidden if it raises ``ForbiddenTransition``.
+
+        Checks are evaluated lazily and each check function is called at
+        most once: the exit checks of the source state are shared by all
+        the transitions and evaluated first, then the enter checks of each
+        destination state, then ``check_<name>``. The first failed check of
+        a transition is its reason.
+
+        Args:
+            state (str): optional: source state
+
+        Returns:
+            AllowedTransitions: the allowed and forbidden transitions
+        """
+        evaluation = self._evaluate_checks(state or self._get_model_state())
+        value = next(evaluation)
+        while not isinstance(value, AllowedTransitions):
+            value = evaluation.send(value(self))
+        return value
+
+    def _evaluate_checks(self, state):
+        """
+        Yield the check functions to call, in evaluation order, receiving
+        their results, then the ``AllowedTransitions``.
+        """
+        memo = {}
+        reasons = {}
+        for name, checks in self._get_transition_checks(state):
+            for func in checks:
+                if func not in memo:
+                    result = yield func
+                    memo[func] = bool(result)
+                if not memo[func]:
+                    reasons[name] = func.__name__
+                    break
+
+        yield self._get_allowed_transitions(state, reasons)
+
+    def _get_transition_checks(self, state):
+        """
+        Yield the name and the checks of each transition available from
+        ``state``, in evaluation order.
+        """
+        exit_checks = self._exit_checks.get(state, ())
+        for trans in self.get_available_transitions(state):
+            if "check_transition_condition" in self._overridden_stages:
+                yield trans["name"], (ConditionCheck(trans), )
+                continue
+
+            compiled = self._compiled_transitions[trans["name"]]
+            yield compiled.name, chain(
+                exit_checks, compiled.enter_checks,
+                (compiled.check, ) if compiled.check else ())
+
+    def _get_allowed_transitions(self, state, reasons):
+        return AllowedTransitions(
+            self.model, state,
+            tuple(
+                trans for trans in self.get_available_transitions(state)
+                if trans["name"] not in reasons),
+            reasons)
+
+    @classmethod
+    def bulk_get_allowed_transitions(cls, models, chunk_size=500):
+        """
+        Evaluate the transitions allowed for many models, see
+        ``get_allowed_transitions``. Each model is evaluated in turn by its
+        own workflow: checks are memoised per model, not batched across
+        models.
+
+        Args:
+            models (iterable): models or Django queryset
+            chunk_size (int): number of models fetched at once from a
+                queryset
+
+        Returns:
+            list: an ``AllowedTransitions`` per model, in order
+        """
+        if hasattr(models, "iterator"):
+            # Django queryset: do not cache the whole result in memory
+            models = models.iterator(chunk_size=chunk_size)
+
+        return [cls(model=model).get_allowed_transitions() for model in models]
@@ -0,0 +1,512 @@
+"""
+analytics.py
+=================================================
+Streaming analytics of the transition log.
+
+Log records are consumed one by one, from any iterator, so that memory does
+not depend on the size of the log. Statistics computed by several workers
+on shards of the log, split by model, are combined with ``merge``:
+
+.. code-block::
+
+   python -m pieuvre.analytics transitions.jsonl --funnel draft,submitted,paid
+"""
+
+import argparse
+import collections
+import datetime
+import json
+import math
+import sys
+
+from functools import partial
+
+
+# Fields of the records, named after the arguments of
+# ``db_logging_class.log``
+RECORD_FIELDS = ("transition", "from_state", "to_state", "model", "timestamp")
+
+
+# Formats of the ISO 8601 dates parsed by ``strptime_iso``
+ISO_FORMATS = (
+    "%Y-%m-%d %H:%M:%S.%f%z",
+    "%Y-%m-%d %H:%M:%S%z",
+    "%Y-%m-%d %H:%M:%S.%f",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%d",
+)
+
+
+def strptime_iso(value):
+    """
+    Parse the ISO 8601 dates written by ``datetime.isoformat``, for Python
+    versions without ``datetime.fromisoformat``.
+    """
+    if len(value) > 10 and value[10] == "T":
+        value = value[:10] + " " + value[11:]
+    if len(value) > 6 and value[-3] == ":" and value[-6] in "+-":
+        # ``%z`` does not accept a colon in the offset before Python 3.7
+        value = value[:-3] + value[-2:]
+
+    for date_format in ISO_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+    raise ValueError("Invalid ISO 8601 date: {}".format(value))
+
+
+def parse_datetime(value):
+    """
+    Parse an ISO 8601 date.
+    """
+    fromisoformat = getattr(datetime.datetime, "fromisoformat", None)
+    if fromisoformat is None:
+        # Python < 3.7
+        return strptime_iso(value)
+    return fromisoformat(value)
+
+
+def to_seconds(value):
+    """
+    Convert a timestamp to seconds: numbers are returned as is, datetimes
+    and ISO 8601 strings are converted to POSIX timestamps.
+    """
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return parse_datetime(value).timestamp()
+    return value
+
+
+def get_model_key(model):
+    """
+    Return the identity of the model of a record: its primary key if it
+    has one, the value itself otherwise.
+    """
+    pk = getattr(model, "pk", None)
+    return model if pk is None else pk
+
+
+def read_records(path):
+    """
+    Iterate over the records of a JSON lines file, one record per line
+    with the ``RECORD_FIELDS`` keys.
+    """
+    with open(path) as records_file:
+        for line in records_file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_queryset(queryset, timestamp_field="created", model_field="model_id",
+                  chunk_size=2000, by_model=False):
+    """
+    Iterate over the records of a Django log model, fetched by chunks of
+    ``chunk_size`` in chronological order.
+
+    Args:
+        queryset: queryset of the log model
+        timestamp_field (str): field holding the date of the transition
+        model_field (str): field holding the identity of the model
+        chunk_size (int): number of records fetched at once
+        by_model (bool): order the records by model first
+
+    Yields:
+        dict: the records
+    """
+    ordering = (timestamp_field, "pk")
+    if by_model:
+        ordering = (model_field, ) + ordering
+    rows = queryset.order_by(*ordering).values_list(
+        "transition", "from_state", "to_state", model_field, timestamp_field,
+    ).iterator(chunk_size=chunk_size)
+    for row in rows:
+        yield dict(zip(RECORD_FIELDS, row))
+
+
+class QuantileSketch:
+    """
+    Mergeable sketch of a distribution of positive values, answering
+    quantile queries with a bounded relative error.
+
+    Values are counted in logarithmic buckets: a value ``x`` falls in
+    bucket ``ceil(log(x, gamma))`` with ``gamma = (1 + a) / (1 - a)``, so
+    that the quantiles are returned within a relative error ``a``. Memory
+    depends on the range of the values, not on their number. Sketches with
+    the same accuracy are merged by adding their buckets.
+
+    Attributes:
+        relative_accuracy (float): relative error of the quantiles
+        count (int): number of values
+        total (float): sum of the values
+        min (float): smallest value
+        max (float): largest value
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._buckets = collections.Counter()
+        self._zeros = 0
+
+        self.count = 0
+        self.total = 0.
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        if value <= 0:
+            self._zeros += 1
+        else:
+            self._buckets[math.ceil(math.log(value) / self._log_gamma)] += 1
+
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        """
+        Add the values of another sketch, with the same accuracy.
+        """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Sketches have different accuracies")
+
+        self._buckets.update(other._buckets)
+        self._zeros += other._zeros
+        self.count += other.count
+        self.total += other.total
+        for bound, func in (("min", min), ("max", max)):
+            values = [
+                value for value in (getattr(self, bound), getattr(other, bound))
+                if value is not None
+            ]
+            setattr(self, bound, func(values) if values else None)
+        return self
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def quantile(self, q):
+        """
+        Return the value of quantile ``q``, between 0 and 1, or None if the
+        sketch is empty.
+        """
+        if not self.count:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+
+        rank = q * (self.count - 1)
+        if rank < self._zeros:
+            return 0.
+
+        seen = self._zeros
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen > rank:
+                value = 2 * self._gamma ** index / (self._gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+
+class TransitionStats:
+    """
+    Statistics of a transition log, computed in a single pass:
+
+    * the time spent in each state before leaving it (dwell time), as
+      ``QuantileSketch`` per state
+    * the number of each transition, in total and per ``rate_interval``,
+      for the ``max_rate_buckets`` most recent intervals
+    * conversion funnels: the number of models reaching each step of a
+      sequence of states, in order
+
+    Records are dicts or objects with the ``RECORD_FIELDS`` keys or
+    attributes. Dwell times and funnels follow each model: records of a
+    model must be consumed in chronological order, by the same instance.
+    Shard the log by model to compute statistics in parallel, then
+    ``merge`` them.
+
+    To bound memory, at most ``max_open_models`` models are followed,
+    the least recently seen models being dropped: their next dwell time is
+    not measured and their funnels restart.
+
+    .. code-block::
+
+       stats = TransitionStats(funnels={"checkout": ["cart", "paid"]})
+       stats.consume(iter_queryset(TransitionLog.objects.all()))
+       stats.dwell_percentiles()  # {"cart": {0.5: 42.0, ...}, ...}
+       stats.funnel("checkout")  # [("cart", 1000, 1.0), ("paid", 310, 0.31)]
+
+    Attributes:
+        funnels (dict): sequence of states of each funnel, by name
+        rate_interval (float): duration in seconds of the buckets of
+            ``transition_counts``, None to count transitions in total only
+        max_rate_buckets (int): number of buckets of ``transition_counts``
+            kept, the oldest buckets being dropped; None to keep them all
+        relative_accuracy (float): relative error of the dwell time
+            quantiles
+        max_open_models (int): maximum number of models followed
+    """
+
+    def __init__(self, funnels=None, rate_interval=None,
+                 relative_accuracy=0.01, max_open_models=100000,
+                 max_rate_buckets=1000):
+        self.funnels = {
+            name: tuple(steps) for name, steps in (funnels or {}).items()}
+        self.rate_interval = rate_interval
+        self.max_rate_buckets = max_rate_buckets
+        self.relative_accuracy = relative_accuracy
+        self.max_open_models = max_open_models
+
+        self.records = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.evicted = 0
+        self.dwell_times = {}
+        self.transitions = collections.Counter()
+        self.transition_counts = collections.defaultdict(collections.Counter)
+        self.funnel_counts = {
+            name: [0] * len(steps) for name, steps in self.funnels.items()}
+
+        # State, entry time and funnel progress of each followed model
+        self._models = collections.OrderedDict()
+
+    def add(self, record):
+        """
+        Add a log record.
+        """
+        if isinstance(record, dict):
+            get = record.get
+        else:
+            get = partial(getattr, record)
+
+        source = get("from_state")
+        destination = get("to_state")
+        timestamp = to_seconds(get("timestamp"))
+        key = get_model_key(get("model"))
+
+        self.records += 1
+        if self.first_timestamp is None or timestamp < self.first_timestamp:
+            self.first_timestamp = timestamp
+        if self.last_timestamp is None or timestamp > self.last_timestamp:
+            self.last_timestamp = timestamp
+
+        name = get("transition")
+        self.transitions[name] += 1
+        if self.rate_interval:
+            bucket = timestamp - timestamp % self.rate_interval
+            counts = self.transition_counts.get(bucket)
+            if counts is None:
+                counts = self.transition_counts[bucket] = collections.Counter()
+                self._drop_rate_buckets()
+            counts[name] += 1
+
+        entry = self._models.pop(key, None)
+        if entry is not None and entry[0] == source:
+            elapsed = timestamp - entry[1]
+            if elapsed >= 0:
+                self._get_sketch(source).add(elapsed)
+
+        progress = entry[2] if entry is not None \
+            else self._start_funnels(source)
+        self._models[key] = (
+            destination, timestamp, self._advance_funnels(progress, destination))
+        if len(self._models) > self.max_open_models:
+            self._models.popitem(last=False)
+            self.evicted += 1
+
+    def _drop_rate_buckets(self):
+        """
+        Drop the oldest buckets of ``transition_counts`` beyond
+        ``max_rate_buckets``.
+        """
+        if self.max_rate_buckets is None:
+            return
+        excess = len(self.transition_counts) - self.max_rate_buckets
+        if excess > 0:
+            for bucket in sorted(self.transition_counts)[:excess]:
+                del self.transition_counts[bucket]
+
+    def _get_sketch(self, state):
+        sketch = self.dwell_times.get(state)
+        if sketch is None:
+            sketch = self.dwell_times[state] = QuantileSketch(
+                self.relative_accuracy)
+        return sketch
+
+    def _start_funnels(self, state):
+        """
+        Return the funnel progress of a model first seen in ``state``.
+        """
+        progress = []
+        for name, steps in self.funnels.items():
+            if steps[0] == state:
+                self.funnel_counts[name][0] += 1
+                progress.append(1)
+            else:
+                progress.append(0)
+        return tuple(progress)
+
+    def _advance_funnels(self, progress, state):
+        """
+        Return the funnel progress of a model entering ``state``.
+        """
+        if not self.funnels:
+            return progress
+
+        advanced = []
+        for reached, (name, steps) in zip(progress, self.funnels.items()):
+            if reached < len(steps) and steps[reached] == state:
+                self.funnel_counts[name][reached] += 1
+                reached += 1
+            advanced.append(reached)
+        return tuple(advanced)
+
+    def consume(self, records):
+        """
+        Add the records of an iterator.
+
+        Returns:
+            TransitionStats: self
+        """
+        add = self.add
+        for record in records:
+            add(record)
+        return self
+
+    def merge(self, other):
+        """
+        Add the statistics of another instance, computed with the same
+        settings on other models.
+
+        Returns:
+            TransitionStats: self
+        """
+        if other.funnels != self.funnels \
+                or other.rate_interval != self.rate_interval:
+            raise ValueError("Statistics have different settings")
+
+        self.records += other.records
+        self.evicted += other.evicted
+        for bound, func in (
+                ("first_timestamp", min), ("last_timestamp", max)):
+            values = [
+                value for value in (getattr(self, bound), getattr(other, bound))
+                if value is not None
+            ]
+            setattr(self, bound, func(values) if values else None)
+
+        for state, sketch in other.dwell_times.items():
+            self._get_sketch(state).merge(sketch)
+        self.transitions.update(other.transitions)
+        for bucket, counts in other.transition_counts.items():
+            self.transition_counts[bucket].update(counts)
+        self._drop_rate_buckets()
+        for name, counts in other.funnel_counts.items():
+            self.funnel_counts[name] = [
+                count + other_count
+                for count, other_count in zip(self.funnel_counts[name], counts)
+            ]
+        return self
+
+    def dwell_percentiles(self, quantiles=(0.5, 0.9, 0.99)):
+        """
+        Return the quantiles of the dwell time of each state, in seconds.
+
+        Returns:
+            dict: value of each quantile, by state
+        """
+        return {
+            state: {q: sketch.quantile(q) for q in quantiles}
+            for state, sketch in self.dwell_times.items()
+        }
+
+    def transition_rates(self):
+        """
+        Return the average number of each transition per second, over the
+        period covered by the records.
+
+        Returns:
+            dict: rate by transition name
+        """
+        if self.first_timestamp is None:
+            return {}
+        duration = self.last_timestamp - self.first_timestamp
+        if not duration:
+            return {}
+        return {
+            name: count / duration for name, count in self.transitions.items()}
+
+    def funnel(self, name):
+        """
+        Return the steps of a funnel.
+
+        Returns:
+            list: ``(state, count, conversion)`` tuples, conversion being
+                the ratio of the models of the first step reaching the step
+        """
+        counts = self.funnel_counts[name]
+        return [
+            (state, count, count / counts[0] if counts[0] else 0.)
+            for state, count in zip(self.funnels[name], counts)
+        ]
+
+    def to_dict(self, quantiles=(0.5, 0.9, 0.99)):
+        """
+        Return a JSON serializable summary.
+        """
+        return {
+            "records": self.records,
+            "dwell_times": {
+                state: {
+                    "count": self.dwell_times[state].count,
+                    "mean": self.dwell_times[state].mean,
+                    "quantiles": {str(q): value for q, value in values.items()},
+                }
+                for state, values in self.dwell_percentiles(quantiles).items()
+            },
+            "transitions": dict(self.transitions),
+            "transition_rates": self.transition_rates(),
+            "funnels": {name: self.funnel(name) for name in self.funnels},
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m pieuvre.analytics",
+        description="Summarize a transition log in JSON lines.")
+    parser.add_argument("paths", nargs="+", help="JSON lines files")
+    parser.add_argument(
+        "--funnel", action="append", default=[],
+        help="comma separated states of a funnel, may be repeated")
+    parser.add_argument(
+        "--quantile", type=float, action="append",
+        help="dwell time quantile, may be repeated")
+    parser.add_argument("--relative-accuracy", type=float, default=0.01)
+    args = parser.parse_args(argv)
+
+    stats = TransitionStats(
+        funnels={steps: steps.split(",") for steps in args.funnel},
+        relative_accuracy=args.relative_accuracy)
+    for path in args.paths:
+        stats.consume(read_records(path))
+
+    json.dump(
+        stats.to_dict(tuple(args.quantile or (0.5, 0.9, 0.99))), sys.stdout,
+        indent=2)
+    sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
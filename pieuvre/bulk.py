@@ -0,0 +1,270 @@
+"""
+bulk.py
+=================================================
+Transitions ran on many models at once.
+"""
+
+import logging
+
+from contextlib import ExitStack
+from functools import partial
+from itertools import islice
+
+from .exceptions import InvalidTransition, TransitionDoesNotExist, WorkflowBaseError
+from .unit_of_work import UnitOfWork, _unit_of_work
+
+try:
+    from django.db import transaction
+except ImportError:
+    # Fallback if Django is not installed
+    from .utils import transaction
+
+
+logger = logging.getLogger(__name__)
+
+
+class BulkTransitionResult:
+    """
+    Outcome of a transition ran by ``Workflow.bulk_run_transition`` on
+    a model.
+
+    Attributes:
+        model: the model
+        success (bool): True if the transition was performed
+        result: value returned by the transition
+        error (Exception): error raised by the transition if it failed
+    """
+
+    __slots__ = ("model", "result", "error")
+
+    def __init__(self, model, result=None, error=None):
+        self.model = model
+        self.result = result
+        self.error = error
+
+    @property
+    def success(self):
+        return self.error is None
+
+    def __repr__(self):
+        return "<BulkTransitionResult {} {}>".format(
+            self.model, "ok" if self.success else self.error)
+
+
+class BulkTransitionMixin:
+    """
+    ``Workflow.bulk_run_transition``.
+    """
+
+    @classmethod
+    def bulk_run_transition(cls, name, models, *args, chunk_size=500,
+                            savepoints=False, **kwargs):
+        """
+        Run a transition on many models.
+
+        Models are processed by chunks of ``chunk_size``, each chunk in its
+        own transaction. The source state of every model of the chunk is
+        checked first, then the checks, hooks and body of the transition
+        are run for the valid models, through the transition method. The
+        models are saved together: Django models with a single
+        ``bulk_update`` of the state field, the ``date_field`` of the
+        transition and ``bulk_update_fields``, other models with
+        ``save()``, with ``update_fields`` when ``track_changes`` is
+        enabled. Transitions are then logged, and events created once the
+        chunk is committed.
+
+        A model whose transition fails with a workflow error is put back in
+        its source state with ``rollback`` and reported as failed, it does
+        not abort the chunk. The hooks of each model are ran in a
+        savepoint if the transition has hooks, a body or a method, so that
+        the database writes of a failed model are rolled back with it.
+        Models failing with any other exception are reported the same way
+        when ``savepoints`` is enabled. Otherwise, other exceptions roll the
+        chunk back, and every model of the chunk is put back in its source
+        state and reported as failed with the exception. The next chunks
+        are run in both cases.
+
+        Note that ``finalize_transition`` is not called: hooks modifying
+        fields other than the state must list them in
+        ``bulk_update_fields``. ``lock_manager`` and ``cas_writes`` are not
+        used either: the models are not locked, and their state is not
+        compared to the source state when they are written.
+
+        Args:
+            name (str): transition name
+            models (iterable): models or Django queryset
+            chunk_size (int): number of models per transaction
+            savepoints (bool): run each model in a savepoint, even if the
+                transition has no hook, and report the models failing with
+                any exception without rolling the chunk back. Savepoints
+                cost two queries per model.
+
+        Returns:
+            list: a ``BulkTransitionResult`` per model, in order
+
+        Raises:
+            TransitionDoesNotExist
+        """
+        compiled = cls._compiled_transitions.get(name)
+        if compiled is None:
+            raise TransitionDoesNotExist(transition=name)
+
+        if hasattr(models, "iterator"):
+            # Django queryset: do not cache the whole result in memory
+            models = models.iterator(chunk_size=chunk_size)
+
+        models = iter(models)
+        results = []
+        while True:
+            chunk = list(islice(models, chunk_size))
+            if not chunk:
+                return results
+            results.extend(cls._bulk_run_chunk(
+                compiled, chunk, args, kwargs, savepoints))
+
+    @classmethod
+    def _bulk_run_chunk(cls, compiled, models, args, kwargs, savepoints):
+        transition = compiled.transition
+        workflows = []
+        results = []
+
+        # Check source states of the whole chunk first
+        for model in models:
+            workflow = cls(model=model)
+            source = workflow._get_model_state()
+            try:
+                workflow._pre_transition_check(transition, source)
+            except InvalidTransition as exc:
+                results.append(BulkTransitionResult(model, error=exc))
+                continue
+
+            results.append(BulkTransitionResult(model))
+            workflows.append((workflow, source, results[-1]))
+
+        try:
+            cls._bulk_run_workflows(
+                compiled, workflows, args, kwargs, savepoints)
+        except Exception as exc:
+            logger.exception(
+                "Bulk transition %s failed, rolled back a chunk of %s models",
+                compiled.name, len(models))
+            for workflow, source, outcome in workflows:
+                if outcome.success:
+                    workflow.rollback(source, compiled.destination, exc)
+                    outcome.result = None
+                    outcome.error = exc
+
+        return results
+
+    @classmethod
+    def _bulk_run_workflows(cls, compiled, workflows, args, kwargs, savepoints):
+        """
+        Run the transition on the valid models of a chunk, in a transaction.
+        """
+        transition = compiled.transition
+        done = []
+        with transaction.atomic():
+            for workflow, source, outcome in workflows:
+                try:
+                    if savepoints or cls._has_bulk_hooks(compiled, source):
+                        with transaction.atomic():
+                            outcome.result = workflow._run_unsaved(
+                                compiled, source, args, kwargs)
+                    else:
+                        outcome.result = workflow._run_unsaved(
+                            compiled, source, args, kwargs)
+                except Exception as exc:
+                    if not isinstance(exc, WorkflowBaseError):
+                        if not savepoints:
+                            raise
+                        logger.exception(
+                            "Bulk transition %s failed on %r",
+                            compiled.name, workflow.model)
+                    workflow.rollback(source, compiled.destination, exc)
+                    outcome.error = exc
+                    continue
+
+                done.append((workflow, dict(transition, source=source)))
+
+            cls._bulk_save([workflow for workflow, _ in done], transition)
+
+            with ExitStack() as stack:
+                if _unit_of_work.get() is None and cls.db_logging \
+                        and getattr(cls.db_logging_class, "batch_logs", False):
+                    # Write the logs of the chunk together, before commit
+                    stack.enter_context(UnitOfWork(defer_saves=False))
+
+                for workflow, _transition in done:
+                    workflow._log_db(_transition, *args, **kwargs)
+                    workflow._count_transition(_transition)
+
+            # A later failure rolls the whole chunk back: events are only
+            # created once it is committed
+            transaction.on_commit(partial(cls._bulk_create_events, done))
+
+    @classmethod
+    def _bulk_create_events(cls, done):
+        """
+        Create the events of the transitions of a committed chunk.
+
+        Args:
+            done (list): workflows and transitions, with their source state
+        """
+        with ExitStack() as stack:
+            if _unit_of_work.get() is None and any(
+                    workflow._has_batched_writes() for workflow, _ in done):
+                # Push the events of the chunk together
+                stack.enter_context(UnitOfWork(defer_saves=False))
+
+            for workflow, _transition in done:
+                workflow.create_events(_transition)
+
+    @classmethod
+    def _has_bulk_hooks(cls, compiled, source):
+        """
+        Return True if running the transition from ``source`` calls code
+        of the workflow, which may write to the database.
+        """
+        return bool(
+            compiled.method or compiled.check or compiled.before
+            or compiled.after or compiled.enter_checks or compiled.enter_hooks
+            or cls._exit_checks.get(source) or cls._exit_hooks.get(source)
+            or cls._overridden_stages)
+
+    @classmethod
+    def _bulk_save(cls, workflows, transition):
+        """
+        Save the models of a chunk.
+
+        Args:
+            workflows (list): workflows of the models to save
+            transition (dict): the transition ran on the models
+        """
+        fields = [cls.state_field_name]
+        if "date_field" in transition:
+            fields.append(transition["date_field"])
+        fields.extend(
+            field for field in cls.bulk_update_fields if field not in fields)
+
+        by_class = {}
+        tracked = False
+        for workflow in workflows:
+            changed_fields = workflow._pop_changed_fields(transition)
+            if changed_fields is not None:
+                tracked = True
+                fields.extend(
+                    field for field in changed_fields if field not in fields)
+            by_class.setdefault(type(workflow.model), []).append(workflow.model)
+
+        for model_class, models in by_class.items():
+            if hasattr(model_class, "_default_manager"):
+                model_class._default_manager.bulk_update(models, fields)
+                continue
+
+            for model in models:
+                # As ``Workflow._save_model``: fields are only given when
+                # changes are tracked
+                if tracked:
+                    model.save(update_fields=fields)
+                else:
+                    model.save()
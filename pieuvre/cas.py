@@ -0,0 +1,140 @@
+"""
+cas.py
+=================================================
+Optimistic compare-and-swap writes of the model state.
+"""
+
+import logging
+
+from .exceptions import ConcurrentTransition
+from .utils import context_var
+
+try:
+    from django.db import router, transaction
+    from django.db.models import Model
+    from django.db.models.signals import post_save, pre_save
+except ImportError:
+    # Fallback if Django is not installed
+    from .utils import transaction
+    Model = router = post_save = pre_save = None
+
+
+logger = logging.getLogger(__name__)
+
+# States of the models in the database, by model id, during the outermost
+# transition with ``cas_writes`` of the current context
+_persisted_states = context_var("pieuvre_persisted_states", default=None)
+
+
+def in_atomic_block(model):
+    """
+    Return True if the database connection of a Django model is in an
+    atomic block. Always False for other models, or without Django.
+    """
+    get_connection = getattr(transaction, "get_connection", None)
+    state = getattr(model, "_state", None)
+    if get_connection is None or not hasattr(state, "db"):
+        return False
+    return get_connection(state.db).in_atomic_block
+
+
+class CompareAndSwapMixin:
+    """
+    Compare-and-swap writes of ``Workflow``, enabled with ``cas_writes``.
+    """
+
+    def _compare_and_swap(self, func, *args):
+        """
+        Call ``func``, running a transition, with the state of the model in
+        the database recorded for ``_save_model``. The outermost transition
+        is retried ``cas_retries`` times on ``ConcurrentTransition``, after
+        reloading the model with ``refresh_from_db``.
+
+        It is not retried when called in an atomic block of the caller: the
+        reloaded model would be read in the snapshot of the outer
+        transaction (``REPEATABLE READ``), and fail the same way.
+        """
+        states = _persisted_states.get()
+        if states is not None:
+            # Nested transition
+            states.setdefault(id(self.model), self._get_model_state())
+            return func(*args)
+
+        retries = self.cas_retries
+        while True:
+            token = _persisted_states.set(
+                {id(self.model): self._get_model_state()})
+            try:
+                return func(*args)
+            except ConcurrentTransition:
+                if retries <= 0 or not hasattr(self.model, "refresh_from_db"):
+                    raise
+                if in_atomic_block(self.model):
+                    logger.debug(
+                        "Not retrying concurrent transition in an atomic block.")
+                    raise
+                retries -= 1
+                logger.debug("Retrying concurrent transition.")
+                self.model.refresh_from_db()
+            finally:
+                _persisted_states.reset(token)
+
+    def _save_model_if_unchanged(self, states, update_fields):
+        """
+        Save the model if its state in the database is still the state
+        recorded in ``states``, with a single ``UPDATE`` query. Model
+        ``save`` is not called, however the values are prepared and the
+        ``pre_save`` and ``post_save`` signals sent as ``save`` does.
+
+        Raises:
+            ConcurrentTransition
+        """
+        model = self.model
+        expected = states[id(model)]
+        state = self._get_model_state()
+        signal_kwargs = None
+        if Model is not None and isinstance(model, Model):
+            signal_kwargs = {
+                "sender": type(model),
+                "instance": model,
+                "raw": False,
+                "using": router.db_for_write(type(model), instance=model),
+                "update_fields": None if update_fields is None
+                else frozenset(update_fields),
+            }
+            pre_save.send(**signal_kwargs)
+
+        values = self._get_update_values(update_fields)
+        logger.debug("Saving model if %s is %s.", self.state_field_name, expected)
+        updated = type(model)._default_manager.filter(
+            pk=model.pk, **{self.state_field_name: expected}).update(**values)
+        if updated != 1:
+            raise ConcurrentTransition(
+                model=model.pk, current_state=expected, to_state=state)
+
+        states[id(model)] = state
+        if signal_kwargs is not None:
+            post_save.send(created=False, **signal_kwargs)
+
+    def _get_update_values(self, update_fields):
+        """
+        Return the values of the fields saved by the ``UPDATE`` query, by
+        attribute name. They are returned by the ``pre_save`` method of the
+        fields, which sets the ``auto_now`` dates on the model as ``save``
+        does. Deferred fields are not saved.
+
+        Args:
+            update_fields (list): names of the fields to save, None for all
+                the fields except the primary key
+        """
+        model = self.model
+        meta = model._meta
+        if update_fields is None:
+            fields = [
+                field for field in meta.concrete_fields
+                if not field.primary_key and field.attname in model.__dict__
+            ]
+        else:
+            fields = [meta.get_field(name) for name in update_fields]
+
+        return {field.attname: field.pre_save(model, False) for field in fields}
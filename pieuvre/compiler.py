@@ -0,0 +1,435 @@
+"""
+compiler.py
+=================================================
+Compilation of the class-level definitions of the workflows.
+"""
+
+import inspect
+
+from functools import partial
+from types import FunctionType, MappingProxyType
+
+
+ON_ENTER_STATE_PREFIX = "on_enter_"
+ON_EXIT_STATE_PREFIX = "on_exit_"
+AFTER_TRANSITION_PREFIX = "after_"
+BEFORE_TRANSITION_PREFIX = "before_"
+CHECK_TRANSITION_PREFIX = "check_"
+
+
+# Methods running the stages of the transitions that workflows may override.
+# The compiled pipeline calls them when they are overridden, and runs the
+# compiled hooks directly otherwise.
+OVERRIDABLE_STAGES = (
+    "check_transition_condition",
+    "_before_transition",
+    "_on_exit_state",
+    "_on_enter_state",
+    "_after_transition",
+)
+
+
+HOOK_PREFIXES = (
+    ON_ENTER_STATE_PREFIX,
+    ON_EXIT_STATE_PREFIX,
+    AFTER_TRANSITION_PREFIX,
+    BEFORE_TRANSITION_PREFIX,
+    CHECK_TRANSITION_PREFIX,
+)
+
+
+HOOK_REGISTRIES = (
+    "_on_enter_state_check",
+    "_on_exit_state_check",
+    "_on_enter_state_hook",
+    "_on_exit_state_hook",
+)
+
+
+def update_decorated_functions(obj, states, function):
+    for state in states:
+        if state in obj:
+            obj[state].append(function)
+        else:
+            obj[state] = [function, ]
+
+
+def compiled_stage(func):
+    """
+    Mark a method of ``OVERRIDABLE_STAGES`` as implemented by the compiled
+    pipeline: the workflows which inherit it are not reported as overriding
+    it.
+    """
+    func._compiled_stage = True
+    return func
+
+
+def get_transition_sources(transition):
+    """
+    Return the source states of a transition as a list.
+    """
+    sources = transition["source"]
+    return sources if isinstance(sources, list) else [sources]
+
+
+def get_unbound_method(cls, name):
+    """
+    Return a callable taking the workflow as first argument for the
+    attribute ``name`` of ``cls``.
+
+    Plain functions are returned as is, any other descriptor (classmethod,
+    staticmethod...) is resolved on the instance at call time.
+    """
+    func = inspect.getattr_static(cls, name)
+    if isinstance(func, FunctionType):
+        return func
+
+    def call(workflow, *args, **kwargs):
+        return getattr(workflow, name)(*args, **kwargs)
+
+    call.__name__ = name
+    return call
+
+
+def get_instance_hook(name, value):
+    """
+    Return a function calling the hook ``name`` set on a workflow instance,
+    to compile it on the class. Decorators of ``value`` are kept.
+    """
+    def hook(workflow, *args, **kwargs):
+        return workflow.__dict__[name](*args, **kwargs)
+
+    hook.__name__ = name
+    if inspect.isfunction(value) or inspect.ismethod(value):
+        for registry in HOOK_REGISTRIES:
+            if hasattr(value, registry):
+                setattr(hook, registry, getattr(value, registry))
+    return hook
+
+
+class InstanceHooksMixin:
+    """
+    Hooks set on a workflow instance, e.g. with ``mock.patch.object``.
+
+    Hooks are compiled per class: the instance is moved to a subclass of its
+    workflow class calling the hooks set on the instance, compiled as any
+    subclass. Deleting the hooks moves it back to its class.
+    """
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if callable(value) and not name.startswith("__") and (
+                name.startswith(HOOK_PREFIXES)
+                or name in self._transitions_by_name
+                or callable(getattr(type(self), name, None))):
+            hooks = dict(self.__dict__.get("_instance_hooks") or {})
+            hooks[name] = value
+            self._set_instance_hooks(hooks)
+
+    def __delattr__(self, name):
+        super().__delattr__(name)
+        hooks = self.__dict__.get("_instance_hooks")
+        if hooks and name in hooks:
+            hooks = dict(hooks)
+            del hooks[name]
+            self._set_instance_hooks(hooks)
+
+    def _set_instance_hooks(self, hooks):
+        workflow_class = self.__dict__.get("_workflow_class", type(self))
+        if not hooks:
+            self.__dict__.pop("_instance_hooks", None)
+            self.__dict__.pop("_workflow_class", None)
+            object.__setattr__(self, "__class__", workflow_class)
+            return
+
+        namespace = {
+            name: get_instance_hook(name, value)
+            for name, value in hooks.items()
+        }
+        namespace["__module__"] = workflow_class.__module__
+        namespace["__qualname__"] = workflow_class.__qualname__
+        self.__dict__["_instance_hooks"] = hooks
+        self.__dict__["_workflow_class"] = workflow_class
+        object.__setattr__(self, "__class__", type(workflow_class)(
+            workflow_class.__name__, (workflow_class, ), namespace))
+
+
+class DefaultTransition:
+    """
+    Method of a transition the workflow does not implement, running
+    ``default_transition``. Set on the workflow class when it is compiled.
+    The bound method is cached on the workflow instance on first access.
+    """
+
+    __slots__ = ("name", )
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, workflow, owner=None):
+        if workflow is None:
+            return self
+        if self.name not in workflow._transitions_by_name:
+            # Transition removed by a subclass
+            raise AttributeError(self.name)
+
+        method = partial(workflow.default_transition, self.name)
+        # Shadows the descriptor: next lookups do not reach ``__get__``.
+        # Bypasses ``__setattr__``, which shared workflows forbid.
+        workflow.__dict__[self.name] = method
+        return method
+
+
+class CompiledTransition:
+    """
+    Hooks of a transition, resolved once per workflow class.
+
+    Every hook is stored as a callable taking the workflow as first argument,
+    or ``None`` when the workflow does not implement it. The hooks of the
+    source state depend on the state the model is in when the transition
+    runs: they are looked up in the ``_exit_checks`` and ``_exit_hooks``
+    class indexes.
+
+    Attributes:
+        transition (dict): the transition as defined in the workflow
+        method: method named after the transition, if any
+        body: function wrapped by the ``@transition`` decorator, if any
+        check: ``check_<name>`` hook
+        before: ``before_<name>`` hook
+        after: ``after_<name>`` hook
+        enter_checks (tuple): ``@on_enter_state_check`` functions of the
+            destination state
+        enter_hooks (tuple): ``@on_enter_state`` functions and
+            ``on_enter_<destination>`` hook
+    """
+
+    __slots__ = (
+        "name", "transition", "destination", "method", "body",
+        "check", "before", "after", "enter_checks", "enter_hooks",
+    )
+
+    def __init__(self, workflow_class, transition):
+        self.name = transition["name"]
+        self.transition = transition
+        self.destination = transition["destination"]
+
+        self.method = workflow_class._get_hook(self.name)
+        self.body = getattr(
+            getattr(workflow_class, self.name, None), "_transition_body", None)
+        self.check = workflow_class._get_hook(
+            CHECK_TRANSITION_PREFIX + self.name)
+        self.before = workflow_class._get_hook(
+            BEFORE_TRANSITION_PREFIX + self.name)
+        self.after = workflow_class._get_hook(
+            AFTER_TRANSITION_PREFIX + self.name)
+
+        self.enter_checks = workflow_class._enter_checks.get(
+            self.destination, ())
+        self.enter_hooks = workflow_class._enter_hooks.get(
+            self.destination, ())
+
+
+class WorkflowMeta(type):
+    """
+    Metaclass compiling the class-level definitions of each workflow once,
+    when the class is created.
+
+    Lookups that used to scan ``transitions`` or resolve hooks by name are
+    served from the immutable indexes built here. Assigning or deleting
+    ``transitions`` or a method on a workflow class rebuilds the indexes of
+    the class and of its subclasses. ``transitions`` is left as declared:
+    assign it again after changing it in place.
+    """
+
+    def __init__(cls, name, bases, namespace):
+        super().__init__(name, bases, namespace)
+        cls._compile()
+
+    def __setattr__(cls, name, value):
+        super().__setattr__(name, value)
+        if name == "transitions" or callable(value):
+            cls._recompile()
+
+    def __delattr__(cls, name):
+        value = cls.__dict__.get(name)
+        super().__delattr__(name)
+        if name == "transitions" or callable(value):
+            cls._recompile()
+
+    def _recompile(cls):
+        """
+        Rebuild the indexes of the class and of its subclasses, which may
+        inherit the changed attribute.
+        """
+        cls._compile()
+        for subclass in cls.__subclasses__():
+            subclass._recompile()
+
+    def _compile(cls):
+        """
+        Build the class indexes.
+        """
+        cls._compile_transitions_by_name()
+        cls._compile_state_indexes()
+        cls._compile_hook_registry()
+        cls._compile_state_hooks()
+        cls._compile_default_transitions()
+        cls._compile_overridden_stages()
+
+        type.__setattr__(cls, "_compiled_transitions", MappingProxyType({
+            name: CompiledTransition(cls, trans)
+            for name, trans in cls._transitions_by_name.items()
+        }))
+
+        # Shortest paths from each source state, computed on first use by
+        # ``_get_next_transitions``
+        type.__setattr__(cls, "_next_transitions", {})
+
+    def _compile_transitions_by_name(cls):
+        transitions_by_name = {}
+        for trans in cls.transitions:
+            # Keep the first definition, as the former linear scan did
+            transitions_by_name.setdefault(trans["name"], trans)
+
+        type.__setattr__(
+            cls, "_transitions_by_name",
+            MappingProxyType(transitions_by_name))
+
+    def _compile_default_transitions(cls):
+        """
+        Set a ``DefaultTransition`` for each transition the class does not
+        implement, and remove those of the transitions removed from the
+        class.
+        """
+        for name, value in list(cls.__dict__.items()):
+            if isinstance(value, DefaultTransition) \
+                    and name not in cls._transitions_by_name:
+                type.__delattr__(cls, name)
+
+        for name in cls._transitions_by_name:
+            if not hasattr(cls, name):
+                type.__setattr__(cls, name, DefaultTransition(name))
+
+    def _compile_overridden_stages(cls):
+        """
+        Record the methods of ``OVERRIDABLE_STAGES`` the class overrides.
+        """
+        type.__setattr__(cls, "_overridden_stages", frozenset(
+            name for name in OVERRIDABLE_STAGES
+            if not getattr(getattr(cls, name, None), "_compiled_stage", False)
+        ))
+
+    def _compile_state_indexes(cls):
+        """
+        Index transitions by source and destination states. Transitions
+        from the wildcard state are merged in the transitions of every
+        source state, in declaration order.
+        """
+        states = [state for state in cls.states if isinstance(state, str)]
+        by_destination = {}
+        for trans in cls.transitions:
+            by_destination.setdefault(trans["destination"], []).append(trans)
+            states.append(trans["destination"])
+            if trans["source"] != cls.wildcard_state:
+                states.extend(get_transition_sources(trans))
+
+        # Known states, deduplicated but kept in order
+        states = list(dict.fromkeys(states))
+
+        wildcard_transitions = tuple(
+            trans for trans in cls.transitions
+            if trans["source"] == cls.wildcard_state)
+        by_source = {
+            state: tuple(
+                trans for trans in cls.transitions
+                if cls._check_state(trans["source"], state))
+            for state in states
+        }
+
+        def get_destinations(transitions):
+            destinations = {}
+            for trans in transitions:
+                destinations.setdefault(trans["destination"], trans)
+            return MappingProxyType(destinations)
+
+        type.__setattr__(cls, "_wildcard_transitions", wildcard_transitions)
+        type.__setattr__(
+            cls, "_transitions_by_source", MappingProxyType(by_source))
+        type.__setattr__(cls, "_transitions_by_destination", MappingProxyType({
+            state: tuple(transitions)
+            for state, transitions in by_destination.items()
+        }))
+        type.__setattr__(
+            cls, "_wildcard_destinations",
+            get_destinations(wildcard_transitions))
+        type.__setattr__(cls, "_destinations_by_source", MappingProxyType({
+            state: get_destinations(transitions)
+            for state, transitions in by_source.items()
+        }))
+
+    def _compile_hook_registry(cls):
+        hook_registry = {registry: {} for registry in HOOK_REGISTRIES}
+        for attr in dir(cls):
+            if attr.startswith("__") or attr in HOOK_REGISTRIES:
+                continue
+
+            # Properties and other non callable attributes are not evaluated
+            func = getattr(cls, attr, None)
+            if not callable(func):
+                continue
+
+            for registry in HOOK_REGISTRIES:
+                if hasattr(func, registry):
+                    update_decorated_functions(
+                        hook_registry[registry],
+                        getattr(func, registry),
+                        get_unbound_method(cls, attr))
+
+        type.__setattr__(cls, "_hook_registry", MappingProxyType({
+            registry: MappingProxyType({
+                state: tuple(functions)
+                for state, functions in hooks.items()
+            })
+            for registry, hooks in hook_registry.items()
+        }))
+        for registry, hooks in cls._hook_registry.items():
+            type.__setattr__(cls, registry, hooks)
+
+    def _compile_state_hooks(cls):
+        """
+        Merge decorated state hooks with ``on_enter_<state>`` and
+        ``on_exit_<state>`` methods, which are called last.
+        """
+        for name, registry, prefix in (
+                ("_enter_hooks", "_on_enter_state_hook", ON_ENTER_STATE_PREFIX),
+                ("_exit_hooks", "_on_exit_state_hook", ON_EXIT_STATE_PREFIX)):
+            hooks = {
+                state: list(functions)
+                for state, functions in cls._hook_registry[registry].items()
+            }
+            for attr in dir(cls):
+                if not attr.startswith(prefix):
+                    continue
+                func = cls._get_hook(attr)
+                if func:
+                    hooks.setdefault(attr[len(prefix):], []).append(func)
+
+            type.__setattr__(cls, name, MappingProxyType({
+                state: tuple(functions) for state, functions in hooks.items()
+            }))
+
+        type.__setattr__(
+            cls, "_enter_checks",
+            cls._hook_registry["_on_enter_state_check"])
+        type.__setattr__(
+            cls, "_exit_checks",
+            cls._hook_registry["_on_exit_state_check"])
+
+    def _get_hook(cls, name):
+        """
+        Return the method ``name`` as a callable taking the workflow as
+        first argument, or ``None`` if the workflow does not implement it.
+        """
+        if not callable(getattr(cls, name, None)):
+            return None
+        return get_unbound_method(cls, name)
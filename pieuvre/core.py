@@ -6,7 +6,7 @@ Base workflow implementation
 
 import logging
 
-from functools import partial
+from contextlib import contextmanager
 
 from .exceptions import (
     ForbiddenTransition,
@@ -22,25 +22,46 @@ except ImportError:
     # Fallback if Django is not installed
     from .utils import transaction, now
 
+from .allowed import AllowedTransitionsMixin
+from .bulk import BulkTransitionMixin
+from .cas import CompareAndSwapMixin, _persisted_states
+from .compiler import CompiledTransition, InstanceHooksMixin, WorkflowMeta, compiled_stage
+from .instruments import InstrumentsMixin
+from .paths import PathsMixin
+from .shared import SharedWorkflowMixin
+from .unit_of_work import UnitOfWork, _unit_of_work
+from .utils import context_var, get_field_values
+
+# Defined in ``pieuvre.core`` before the decorators and the hook compilation
+# moved to their own modules, still importable from here
+from .compiler import (  # noqa: F401 pylint: disable=unused-import
+    AFTER_TRANSITION_PREFIX,
+    BEFORE_TRANSITION_PREFIX,
+    CHECK_TRANSITION_PREFIX,
+    ON_ENTER_STATE_PREFIX,
+    ON_EXIT_STATE_PREFIX,
+    update_decorated_functions
+)
+from .decorators import (  # noqa: F401 pylint: disable=unused-import
+    BaseDecorator,
+    OnEnterState,
+    OnEnterStateCheck,
+    OnExitState,
+    OnExitStateCheck,
+    Transition
+)
 
-logger = logging.getLogger(__name__)
-
-ON_ENTER_STATE_PREFIX = "on_enter_"
-ON_EXIT_STATE_PREFIX = "on_exit_"
-AFTER_TRANSITION_PREFIX = "after_"
-BEFORE_TRANSITION_PREFIX = "before_"
-CHECK_TRANSITION_PREFIX = "check_"
 
+logger = logging.getLogger(__name__)
 
-def update_decorated_functions(obj, states, function):
-    for state in states:
-        if state in obj:
-            obj[state].append(function)
-        else:
-            obj[state] = [function, ]
+# Workflow, compiled transition and source state of the transition run
+# without saving by ``_run_unsaved`` in the current context
+_unsaved_transition = context_var("pieuvre_unsaved_transition", default=None)
 
 
-class Workflow:
+class Workflow(AllowedTransitionsMixin, BulkTransitionMixin,
+               CompareAndSwapMixin, InstanceHooksMixin, InstrumentsMixin, PathsMixin,
+               SharedWorkflowMixin, metaclass=WorkflowMeta):
     """
     Workflow base implementation.
 
@@ -76,49 +97,70 @@ class Workflow:
     db_logging = False
     db_logging_class = None
 
+    # Fields saved by ``bulk_run_transition`` besides the state and the
+    # ``date_field`` of the transition
+    bulk_update_fields = ()
+
+    # Save only the fields modified during transitions (Django models)
+    track_changes = False
+    _change_snapshots = None
+
     events = {
         # "name": "method name"
     }
 
     event_manager_classes = ()
 
-    def __init__(self, model):
+    # ``EventDispatcher`` publishing events after commit, events are pushed
+    # synchronously if None
+    event_dispatcher = None
 
-        self.model = model
-        self._check_initial_state()
-        self.event_managers = [
-            klass(model) for klass in self._get_event_manager_classes()]
+    # ``MetricsCollector`` receiving the duration of each transition stage
+    metrics_collector = None
 
-        super().__init__()
+    # ``Tracer`` emitting a span per transition stage
+    tracer = None
 
-        self._on_enter_state_check = {}
-        self._on_exit_state_check = {}
-        self._on_enter_state_hook = {}
-        self._on_exit_state_hook = {}
+    # Defer the saves and logs of the transitions ran during a transition,
+    # such as transitions triggered by hooks, to the end of the outermost
+    # transition. Each model is then saved once.
+    coalesce_saves = False
 
-        self._gather_decorated_functions()
+    # Write the model with ``UPDATE ... WHERE pk = ? AND state = <source>``
+    # (Django models) and raise ``ConcurrentTransition`` if the state was
+    # changed concurrently, instead of locking rows.
+    cas_writes = False
 
-    def _gather_decorated_functions(self):
-        """
-        Construct _on_enter_state_checks and _on_exit_state_checks.
-        """
+    # Number of times a transition is retried, after reloading the model,
+    # when it raises ``ConcurrentTransition``
+    cas_retries = 0
 
-        for attr in dir(self):
-            if attr.startswith("__"):
-                continue
+    # ``StripedLockManager`` serialising the transitions of each model
+    # across threads
+    lock_manager = None
 
-            func = getattr(self, attr)
-            if not callable(func):
-                continue
+    # ``StateCounter`` maintaining the number of models per state
+    state_counter = None
+
+    # Decorated hooks are gathered once per class by ``WorkflowMeta`` in the
+    # read-only ``_on_enter_state_check``, ``_on_exit_state_check``,
+    # ``_on_enter_state_hook`` and ``_on_exit_state_hook`` registries of
+    # unbound functions. Hooks set on an instance are compiled on a
+    # subclass, see ``InstanceHooksMixin``.
+    #
+    # ``check_transition_condition``, ``_before_transition``,
+    # ``_on_exit_state``, ``_on_enter_state`` and ``_after_transition`` are
+    # called by the transitions only if a subclass overrides them: the
+    # compiled hooks are ran directly otherwise.
 
-            for deco in ("_on_enter_state_check", "_on_exit_state_check",
-                         "_on_enter_state_hook", "_on_exit_state_hook"):
+    def __init__(self, model):
 
-                if hasattr(func, deco):
-                    update_decorated_functions(
-                        getattr(self, deco),
-                        getattr(func, deco),
-                        func)
+        self.model = model
+        self._check_initial_state()
+        self.event_managers = [
+            klass(model) for klass in self._get_event_manager_classes()]
+
+        super().__init__()
 
     def process_event(self, name, data):
         """
@@ -149,6 +191,15 @@ class Workflow:
         """
         return self.event_manager_classes
 
+    def _has_batched_writes(self):
+        """
+        Return True if the ``db_logging_class`` has ``batch_logs`` or an
+        event manager has ``batch_events``: their writes are batched at the
+        end of the outermost transition.
+        """
+        return self.db_logging and getattr(self.db_logging_class, "batch_logs", False) \
+            or any(getattr(manager, "batch_events", False) for manager in self.event_managers)
+
     def _get_model_state(self) -> str:
         """
         Get the state of the workflow using the state name defined
@@ -177,8 +228,7 @@ class Workflow:
         Args:
             value (str): new state value
         """
-        logger.debug("Updating model {} to {}".format(
-            self.state_field_name, value))
+        logger.debug("Updating model %s to %s", self.state_field_name, value)
 
         setattr(self.model, self.state_field_name, value)
 
@@ -214,24 +264,28 @@ class Workflow:
 
         return state in source if isinstance(source, list) else source == state
 
-    def _pre_transition_check(self, transition):
+    def _pre_transition_check(self, transition, state=None):
         """
         Check if transition can be performed from the current state.
 
         Args:
             transition (dict): desired transition
+            state (str): optional: state of the model, read from the model
+                if not given
         Returns:
             None
         Raises:
             InvalidTransition
         """
+        if state is None:
+            state = self._get_model_state()
 
-        if self._check_state(transition["source"], self._get_model_state()):
+        if self._check_state(transition["source"], state):
             return
 
         raise InvalidTransition(
             transition=transition["name"],
-            current_state=self._get_model_state(),
+            current_state=state,
             to_state=transition["destination"]
         )
 
@@ -248,11 +302,7 @@ class Workflow:
             dict: dictionary describing the transition, or empty dict if
                   the transition does not exist.
         """
-        try:
-            return next(trans for trans in cls.transitions
-                        if trans["name"] == name)
-        except StopIteration:
-            return {}
+        return cls._transitions_by_name.get(name, {})
 
     @classmethod
     def is_transition(cls, name):
@@ -265,18 +315,118 @@ class Workflow:
         Returns:
             bool: True if the name matches a transition, False otherwise
         """
-        return bool(cls._get_transition_by_name(name))
+        return name in cls._transitions_by_name
 
     def finalize_transition(self, transition):
         """
         Update the model state and save it.
+
+        If ``track_changes`` is enabled, only the fields modified since
+        the beginning of the transition are saved.
         """
         self.update_transition_date(transition)
+        self._save_model(self._pop_changed_fields(transition))
+
+    def _save_model(self, update_fields=None):
+        if self.cas_writes:
+            states = _persisted_states.get()
+            if states is not None and id(self.model) in states \
+                    and hasattr(type(self.model), "_default_manager"):
+                self._save_model_if_unchanged(states, update_fields)
+                return
+
+        unit = _unit_of_work.get()
+        if unit is not None and unit.defer_saves:
+            unit.save(self.model, update_fields)
+            return
+
         logger.debug("Saving model.")
-        # This could be optimized with ``update_fields`` however the
-        # library cannot know which fields were modified.
-        self.model.save()
+        if update_fields is None:
+            self.model.save()
+        else:
+            self.model.save(update_fields=update_fields)
+
+    def _snapshot_fields(self):
+        """
+        Record the field values of the model when ``track_changes`` is
+        enabled. Snapshots are stacked to support nested transitions.
+        """
+        if not self.track_changes:
+            return
+
+        values = get_field_values(self.model, copy_values=True)
+        if values is None:
+            return
+
+        if not self._change_snapshots:
+            self._change_snapshots = []
+        self._change_snapshots.append(values)
+
+    def _pop_changed_fields(self, transition):
+        """
+        Return the fields modified since the last snapshot, including the
+        state field and the ``date_field`` of the transition.
+
+        Args:
+            transition (dict): the current transition
+
+        Returns:
+            list: changed field names, or None if changes are not tracked
+        """
+        if not self._change_snapshots:
+            return None
+
+        snapshot = self._change_snapshots.pop()
+        update_fields = [self.state_field_name]
+        if "date_field" in transition:
+            update_fields.append(transition["date_field"])
 
+        for name, value in get_field_values(self.model).items():
+            if name not in update_fields and (
+                    name not in snapshot or snapshot[name] != value):
+                update_fields.append(name)
+        return update_fields
+
+    def _pop_path_changed_fields(self, transitions):
+        """
+        Return the fields modified by a chain of transitions, from the
+        snapshots taken at each step.
+
+        Args:
+            transitions (list): the transitions ran, in order
+
+        Returns:
+            list: changed field names, or None if changes are not tracked
+        """
+        update_fields = None
+        for transition in reversed(transitions):
+            fields = self._pop_changed_fields(transition)
+            if fields is None:
+                continue
+            if update_fields is None:
+                update_fields = fields
+            else:
+                update_fields.extend(
+                    field for field in fields if field not in update_fields)
+        return update_fields
+
+    def _get_compiled_transition(self, transition):
+        """
+        Return the compiled hooks of a transition.
+
+        Args:
+            transition (dict): the transition
+
+        Returns:
+            CompiledTransition: the transition hooks
+        """
+        compiled = self._compiled_transitions.get(transition["name"])
+        if compiled is None or compiled.destination != transition["destination"]:
+            # Transition built on the fly, not declared in ``transitions``
+            compiled = CompiledTransition(type(self), transition)
+        return compiled
+
+    @compiled_stage
     def _on_enter_state(self, transition):
         """
         Call hooks when entering a state.
@@ -284,18 +434,22 @@ class Workflow:
         Args:
             transition (dict): the transition to enter
         """
-        state = transition["destination"]
-        functions = self._on_enter_state_hook.get(state, [])
-        _on_enter_state = getattr(self, "{}{}".format(
-            ON_ENTER_STATE_PREFIX, state), None)
+        self._call_enter_hooks(
+            self._get_compiled_transition(transition), transition)
 
-        if _on_enter_state:
-            functions.append(_on_enter_state)
+    def _run_enter_hooks(self, compiled, transition):
+        if "_on_enter_state" in self._overridden_stages:
+            self._on_enter_state(transition)
+            return
+        self._call_enter_hooks(compiled, transition)
 
-        logger.debug("Entering {} {}".format(self.state_field_name, state))
-        for func in functions:
-            func(transition)
+    def _call_enter_hooks(self, compiled, transition):
+        logger.debug(
+            "Entering %s %s", self.state_field_name, compiled.destination)
+        for func in compiled.enter_hooks:
+            func(self, transition)
 
+    @compiled_stage
     def _on_exit_state(self, transition):
         """
         Call hooks when exiting a state.
@@ -303,17 +457,20 @@ class Workflow:
         Args:
             transition (dict): the transition to enter
         """
-        state = self._get_model_state()
-        functions = self._on_exit_state_hook.get(state, [])
-        _on_exit_state = getattr(self, "{}{}".format(
-            ON_EXIT_STATE_PREFIX, state), None)
-        if _on_exit_state:
-            functions.append(_on_exit_state)
+        self._call_exit_hooks(self._get_model_state(), transition)
 
-        logger.debug("Leaving {} {}".format(self.state_field_name, state))
-        for func in functions:
-            func(transition)
+    def _run_exit_hooks(self, state, transition):
+        if "_on_exit_state" in self._overridden_stages:
+            self._on_exit_state(transition)
+            return
+        self._call_exit_hooks(state, transition)
+
+    def _call_exit_hooks(self, state, transition):
+        logger.debug("Leaving %s %s", self.state_field_name, state)
+        for func in self._exit_hooks.get(state, ()):
+            func(self, transition)
 
+    @compiled_stage
     def _before_transition(self, transition, *args, **kwargs):
         """
         Call hooks before running a transition.
@@ -321,15 +478,23 @@ class Workflow:
         Args:
             transition (dict): the transition to enter
         """
+        self._call_before_hook(
+            self._get_compiled_transition(transition), args, kwargs)
+
+    def _run_before_hook(self, compiled, args, kwargs):
+        if "_before_transition" in self._overridden_stages:
+            self._before_transition(compiled.transition, *args, **kwargs)
+            return
+        self._call_before_hook(compiled, args, kwargs)
 
-        before_transition = getattr(self, "{}{}".format(
-            BEFORE_TRANSITION_PREFIX, transition["name"]), None)
-        if not before_transition:
+    def _call_before_hook(self, compiled, args, kwargs):
+        if not compiled.before:
             return
 
-        logger.debug("Before transition {}".format(transition["name"]))
-        before_transition(*args, **kwargs)
+        logger.debug("Before transition %s", compiled.name)
+        compiled.before(self, *args, **kwargs)
 
+    @compiled_stage
     def _after_transition(self, transition, result):
         """
         Call hooks after running a transition
@@ -337,22 +502,28 @@ class Workflow:
         Args:
             transition (dict): the transition to enter
         """
-        after_transition = getattr(self, "{}{}".format(
-            AFTER_TRANSITION_PREFIX, transition["name"]), None)
-        if not after_transition:
+        self._call_after_hook(self._get_compiled_transition(transition), result)
+
+    def _run_after_hook(self, compiled, result):
+        if "_after_transition" in self._overridden_stages:
+            self._after_transition(compiled.transition, result)
+            return
+        self._call_after_hook(compiled, result)
+
+    def _call_after_hook(self, compiled, result):
+        if not compiled.after:
             return
 
-        logger.debug("After transition {}".format(transition["name"]))
-        after_transition(result)
+        logger.debug("After transition %s", compiled.name)
+        compiled.after(self, result)
 
     def _check_on_enter_state(self, state):
-        return all([func() for func in self._on_enter_state_check.get(
-            state, [])])
+        return all([func(self) for func in self._enter_checks.get(state, ())])
 
     def _check_on_exit_state(self, state):
-        return all([func() for func in self._on_exit_state_check.get(
-            state, [])])
+        return all([func(self) for func in self._exit_checks.get(state, ())])
 
+    @compiled_stage
     def check_transition_condition(self, transition, *args, **kwargs):
         """
         Check that the transition is allowed:
@@ -366,63 +537,102 @@ class Workflow:
         Raises:
             ForbiddenTransition: if the transition is forbidden
         """
-        valid_transition = True
-        check_transition_function = getattr(self, "{}{}".format(
-            CHECK_TRANSITION_PREFIX, transition["name"]), None)
+        self._call_checks(
+            self._get_compiled_transition(transition),
+            self._get_model_state(), args, kwargs)
+
+    def _run_checks(self, compiled, state, args, kwargs):
+        if "check_transition_condition" in self._overridden_stages:
+            self.check_transition_condition(
+                compiled.transition, *args, **kwargs)
+            return
+        self._call_checks(compiled, state, args, kwargs)
 
-        if check_transition_function and not check_transition_function(*args, **kwargs):
-            valid_transition = False
+    def _call_checks(self, compiled, state, args, kwargs):
+        valid_transition = not compiled.check or compiled.check(
+            self, *args, **kwargs)
 
         if valid_transition \
-                and self._check_on_enter_state(transition["destination"]) \
-                and self._check_on_exit_state(self._get_model_state()):
+                and self._check_on_enter_state(compiled.destination) \
+                and self._check_on_exit_state(state):
             return
 
+        self._raise_forbidden(compiled, state)
+
+    def _raise_forbidden(self, compiled, state):
         raise ForbiddenTransition(
-            transition=transition["name"],
-            current_state=self._get_model_state(),
-            to_state=transition["destination"]
+            transition=compiled.name,
+            current_state=state,
+            to_state=compiled.destination
         )
 
     def pre_transition(self, name, *args, **kwargs):
-        transition = self._get_transition_by_name(name)
+        compiled = self._compiled_transitions[name]
+        source = self._get_model_state()
 
         #  Check if transition is valid
-        self._pre_transition_check(transition)
+        self._pre_transition_check(compiled.transition, source)
+
+        self._leave_source(compiled, source, args, kwargs)
+
+    def _leave_source(self, compiled, source, args, kwargs):
+        """
+        Check the transition conditions, call the before transition hook and
+        the hooks of the source state.
+        """
+        instrument = self._get_instrument()
 
         #  Check conditions if exist
-        self.check_transition_condition(transition, *args, **kwargs)
+        instrument(compiled, "check", self._run_checks,
+                   compiled, source, args, kwargs)
+
+        self._snapshot_fields()
 
         # Call before transition
-        self._before_transition(transition, *args, **kwargs)
+        instrument(compiled, "before", self._run_before_hook,
+                   compiled, args, kwargs)
 
         # Call on_exit of the current state
-        self._on_exit_state(transition)
+        instrument(compiled, "exit_hooks", self._run_exit_hooks,
+                   source, compiled.transition)
 
     def post_transition(self, name, result, *args, **kwargs):
-        transition = self._get_transition_by_name(name)
+        compiled = self._compiled_transitions[name]
+        transition = compiled.transition
         source = self._get_model_state()
+        instrument = self._get_instrument()
 
-        # Change state
-        self.update_model_state(transition["destination"])
-
-        self._on_enter_state(transition)
-
-        self._after_transition(transition, result)
+        self._enter_destination(compiled, result)
 
         # save model
-        self.finalize_transition(transition)
+        instrument(compiled, "save", self.finalize_transition, transition)
 
         # log in db
         # transition can be from a specific state or from a list of states or
         # from any state for logging we send the exact source state
         _transition = dict(transition, source=source)
-        self._log_db(_transition, *args, **kwargs)
+        instrument(compiled, "log", self._log_transition,
+                   _transition, args, kwargs)
+        self._count_transition(_transition)
 
         # Create events
-        self.create_events(_transition)
+        instrument(compiled, "events", self.create_events, _transition)
+
+    def _enter_destination(self, compiled, result):
+        """
+        Change the model state and call the hooks of the destination state
+        and the after transition hook.
+        """
+        instrument = self._get_instrument()
+
+        # Change state
+        self.update_model_state(compiled.destination)
+
+        instrument(compiled, "enter_hooks", self._run_enter_hooks,
+                   compiled, compiled.transition)
+
+        instrument(compiled, "after", self._run_after_hook, compiled, result)
 
-    @transaction.atomic
     def default_transition(self, name, *args, **kwargs):
         """
         Transition will be executed by following these steps:
@@ -439,28 +649,168 @@ class Workflow:
         Args:
             name (str): transition name
         """
+        self.execute_transition(name, None, args, kwargs)
+
+    def execute_transition(self, name, body, args, kwargs):
+        """
+        Run a transition and its hooks in a transaction.
+
+        Args:
+            name (str): transition name
+            body (callable): function implementing the transition, called
+                with the workflow and the transition arguments, or None
+            args (tuple): transition arguments
+            kwargs (dict): transition keyword arguments
+
+        Returns:
+            Any: the output of ``body``
+        """
+        if _unsaved_transition.get() is not None:
+            unsaved = self._pop_unsaved(name)
+            if unsaved is not None:
+                return self._execute_unsaved(*unsaved, body, args, kwargs)
+
+        if self.lock_manager is None and not self.cas_writes:
+            return self._execute_atomic(name, body, args, kwargs)
+        return self._guarded(self._execute_atomic, name, body, args, kwargs)
+
+    def _guarded(self, func, *args):
+        """
+        Call ``func``, running a transition, holding the lock of the model
+        if there is a lock manager, with compare-and-swap writes if
+        ``cas_writes`` is enabled.
+        """
+        if self.lock_manager is None:
+            return self._compare_and_swap(func, *args)
+
+        with self.lock_manager.lock(self.model):
+            if self.cas_writes:
+                return self._compare_and_swap(func, *args)
+            return func(*args)
+
+    @transaction.atomic
+    def _execute_atomic(self, name, body, args, kwargs):
+        unit = _unit_of_work.get()
+        if unit is None:
+            if not self.coalesce_saves and not self._has_batched_writes():
+                return self._execute_transition(name, body, args, kwargs)
+            with UnitOfWork(defer_saves=self.coalesce_saves):
+                return self._execute_transition(name, body, args, kwargs)
+
+        # Nested transition: forget its deferred writes if it fails, as its
+        # savepoint is rolled back
+        mark = unit.mark()
+        try:
+            return self._execute_transition(name, body, args, kwargs)
+        except Exception:
+            unit.rollback(mark)
+            raise
+
+    def _execute_transition(self, name, body, args, kwargs):
+        snapshots = len(self._change_snapshots or ())
+        try:
+            return self._get_instrument()(
+                self._compiled_transitions[name], "transition",
+                self._execute_stages, name, body, args, kwargs)
+        finally:
+            # Drop the snapshot of a transition that failed before saving
+            if self._change_snapshots:
+                del self._change_snapshots[snapshots:]
+
+    def _execute_stages(self, name, body, args, kwargs):
         self.pre_transition(name, *args, **kwargs)
-        self.post_transition(name, None, *args, **kwargs)
+        result = None
+        if body:
+            result = self._get_instrument()(
+                self._compiled_transitions[name], "body",
+                self._run_body, body, args, kwargs)
+        self.post_transition(name, result, *args, **kwargs)
+        return result
+
+    def _run_body(self, body, args, kwargs):
+        return body(self, *args, **kwargs)
 
     def run_transition(self, name, *args, **kwargs):
         """
         Private method: perform the transition.
         """
 
+        compiled = self._compiled_transitions.get(name)
+
         # Check transition
-        if not self.is_transition(name):
+        if compiled is None:
             raise TransitionDoesNotExist(
                 transition=name
             )
 
         # TODO: handle the case when the names of the transition and
         # the method are different
-        trans = getattr(self, name, None)
-        if trans:
-            return trans(*args, **kwargs)
+        if compiled.method:
+            return compiled.method(self, *args, **kwargs)
 
         return self.default_transition(name, *args, **kwargs)
 
+    def _run_unsaved(self, compiled, source, args, kwargs):
+        """
+        Run a transition on the model without saving it, logging it nor
+        creating its events, for ``bulk_run_transition`` and ``advance_to``.
+
+        The transition is dispatched through its method, so that overrides
+        of subclasses run, then ``execute_transition`` only runs the checks,
+        the hooks and the body. A method returning without running the
+        transition forbids it.
+
+        Args:
+            compiled (CompiledTransition): the transition
+            source (str): state of the model
+            args (tuple): transition arguments
+            kwargs (dict): transition keyword arguments
+
+        Returns:
+            Any: the output of the transition
+
+        Raises:
+            ForbiddenTransition
+        """
+        with self._unsaved(compiled, source):
+            return self.run_transition(compiled.name, *args, **kwargs)
+
+    @contextmanager
+    def _unsaved(self, compiled, source):
+        """
+        Record the transition the block runs without saving, see
+        ``_run_unsaved``.
+        """
+        token = _unsaved_transition.set((self, compiled, source))
+        try:
+            yield
+            if _unsaved_transition.get() is not None:
+                raise ForbiddenTransition(
+                    transition=compiled.name, current_state=source,
+                    to_state=compiled.destination)
+        finally:
+            _unsaved_transition.reset(token)
+
+    def _pop_unsaved(self, name):
+        """
+        Return the compiled transition and the source state of the
+        transition ``name`` if ``_run_unsaved`` runs it, and clear it so
+        that nested transitions run normally.
+        """
+        unsaved = _unsaved_transition.get()
+        if unsaved is None or unsaved[0] is not self \
+                or unsaved[1].name != name:
+            return None
+        _unsaved_transition.set(None)
+        return unsaved[1:]
+
+    def _execute_unsaved(self, compiled, source, body, args, kwargs):
+        self._leave_source(compiled, source, args, kwargs)
+        result = body(self, *args, **kwargs) if body else None
+        self._enter_destination(compiled, result)
+        self.update_transition_date(compiled.transition)
+        return result
+
     def rollback(self, current_state, target_state, exc):
         self.update_model_state(current_state)
 
@@ -482,13 +832,13 @@ class Workflow:
             state (str): optional: source state
 
         Returns:
-            list: list of transitions available from the given or current state
+            tuple: transitions available from the given or current state
         """
 
         state = state or self._get_model_state()
 
-        return [trans for trans in self.transitions if self._check_state(
-            trans["source"], state)]
+        return self._transitions_by_source.get(
+            state, self._wildcard_transitions)
 
     def get_next_available_states(self, state=None):
         """
@@ -522,14 +872,12 @@ class Workflow:
             reach the desired state.
         """
         state = self._get_model_state()
-        potential_transition = [
-            trans["name"] for trans in self.transitions if trans["destination"] == target_state and
-            self._check_state(trans["source"], state)
-            ]
+        destinations = self._destinations_by_source.get(
+            state, self._wildcard_destinations)
 
-        if potential_transition:
+        if target_state in destinations:
             # Return first transition
-            return getattr(self, potential_transition[0])
+            return getattr(self, destinations[target_state]["name"])
 
         raise TransitionNotFound(current_state=state, to_state=target_state)
 
@@ -543,34 +891,81 @@ class Workflow:
         if not self.db_logging:
             return
 
+        record = self._get_log_record(transition, args, kwargs)
+        unit = _unit_of_work.get()
+        if unit is not None and unit.defers_log(self.db_logging_class):
+            unit.log(self.db_logging_class, record)
+            return
+
+        self.db_logging_class.log(**record)
+
+    def _log_transition(self, transition, args, kwargs):
+        self._log_db(transition, *args, **kwargs)
+
+    def _count_transition(self, transition):
+        """
+        Report a transition to the ``state_counter``, if any.
+
+        Args:
+            transition (dict): the transition, with its exact source state
+        """
+        if self.state_counter is not None:
+            self.state_counter.record(self, transition)
+
+    def _get_log_record(self, transition, args, kwargs):
+        """
+        Return the arguments of ``db_logging_class.log`` for a transition.
+        """
         params = {
             "args": args,
             "kwargs": kwargs
         }
 
-        self.db_logging_class.log(
-            transition=transition["name"],
-            from_state=transition["source"],
-            to_state=transition["destination"],
-            model=self.model,
-            params=params
-        )
+        return {
+            "transition": transition["name"],
+            "from_state": transition["source"],
+            "to_state": transition["destination"],
+            "model": self.model,
+            "params": params
+        }
 
     def create_events(self, transition):
         if not self.event_managers:
             return
 
-        for manager in self.event_managers:
-            manager.push_event(transition)
+        if self._has_batched_writes():
+            self._create_batched_events(transition)
+            return
 
-    def __getattr__(self, item):
-        try:
-            return object.__getattribute__(self, item)
+        if self.event_dispatcher is None:
+            for manager in self.event_managers:
+                manager.push_event(transition)
+            return
 
-        except AttributeError:
-            if self.is_transition(item):
-                return partial(self.default_transition, item)
-            raise
+        self._dispatch_events(transition)
+
+    def _dispatch_events(self, transition):
+        # Events are generated now, and published after commit
+        for manager in self.event_managers:
+            event = manager.build_event(transition)
+            if event is not None:
+                self.event_dispatcher.dispatch(manager, event)
+
+    def _create_batched_events(self, transition):
+        # Events of the managers with ``batch_events`` are generated now,
+        # and pushed together at the end of the outermost transition
+        unit = _unit_of_work.get()
+        for manager in self.event_managers:
+            if unit is not None and manager.batch_events:
+                event = manager.build_event(transition)
+                if event is not None:
+                    unit.push_event(manager, event)
+            elif self.event_dispatcher is None:
+                manager.push_event(transition)
+            else:
+                event = manager.build_event(transition)
+                if event is not None:
+                    self.event_dispatcher.dispatch(manager, event)
 
     @classmethod
     def generate_graph(cls, dpi=150, edges_conf={}):
@@ -602,104 +997,3 @@ class Workflow:
 
         if not is_empty:
             return graph
-
-
-class Transition:
-    """
-    @transition decorator.
-    """
-    def __call__(self, func):
-        #  TODO: Check if it is a valid transition
-        @transaction.atomic
-        def wrapped_func(workflow, *args, **kwargs):
-            workflow.pre_transition(func.__name__, *args, **kwargs)
-            result = func(workflow, *args, **kwargs)
-            workflow.post_transition(func.__name__, result, *args, **kwargs)
-            return result
-
-        return wrapped_func
-
-
-class BaseDecorator:
-    """
-    Base class for hook decorators.
-    """
-    type = None
-
-    def __init__(self, state):
-        self.states = state if isinstance(state, list) else [state, ]
-        super().__init__()
-
-    def __call__(self, func):
-        setattr(func, self.type, self.states)
-        return func
-
-
-class OnEnterStateCheck(BaseDecorator):
-    """
-    Wrap a function with this decorator so that it is ran before a transition
-    that would enter the given state. This function must return True to carry
-    on with the transition.
-
-    Example:
-
-    .. code-block::
-
-       @on_enter_state_check(ROCKET_STATES.ON_LAUNCHPAD)
-       def has_enough_fuel(self, result):
-           if self.model.fuel > 10:
-               return True
-           # Transition is aborted if there is not enough fuel
-    """
-    type = "_on_enter_state_check"
-
-
-class OnExitStateCheck(BaseDecorator):
-    """
-    Wrap a function with this decorator so that it is ran before a transition
-    that would exit the given state. This function must return True to carry
-    on with the transition.
-
-    Example:
-
-    .. code-block::
-
-       @on_exit_state_check(ROCKET_STATES.ON_LAUNCHPAD)
-       def is_it_a_beautiful_day(self, result):
-           if datetime.today().day == 7:
-                return True
-           # Transition is aborted if the day is not the 7th
-    """
-    type = "_on_exit_state_check"
-
-
-class OnEnterState(BaseDecorator):
-    """
-    Wrap a function with this decorator to run it before
-    entering a state, after the transition is ran.
-
-    Example:
-
-    .. code-block::
-
-       @on_enter_state(ROCKET_STATES.ON_LAUNCHPAD)
-       def start_countdown(self, result):
-           print("Launch is imminent!")
-    """
-    type = "_on_enter_state_hook"
-
-
-class OnExitState(BaseDecorator):
-    """
-    Wrap a function with this decorator to run it after
-    exiting a state, before the transition is ran.
-
-    Example:
-
-    .. code-block::
-
-       @on_exit_state(ROCKET_STATES.ON_LAUNCHPAD)
-       def warn_aliens(self, result):
-           print("Beware aliens, a rocket has left the launchpad!")
-    """
-    type = "_on_exit_state_hook"
@@ -0,0 +1,440 @@
+"""
+counters.py
+=================================================
+Number of models per state, maintained by the transitions.
+
+Counters are updated with the deltas of the committed transitions and
+rebuilt from the models with a reconciliation command:
+
+.. code-block::
+
+   python -m pieuvre.counters --workflow myapp.workflows:OrderWorkflow \
+       --model orders.Order --counter-model orders.StateCount
+"""
+
+import abc
+import argparse
+import collections
+import sqlite3
+import sys
+import threading
+
+from functools import partial
+
+from .metrics import get_workflow_name
+from .utils import call_at_exit, load_object
+
+try:
+    from django.db import transaction
+    from django.db.models import Case, F, IntegerField, Q, Value, When
+except ImportError:
+    # Django is only needed by ``DjangoCounterStore``
+    Case = F = IntegerField = Q = Value = When = None
+    from .utils import transaction
+
+
+class CounterStore(abc.ABC):
+    """
+    Base class of the counter storages, holding a count per workflow and
+    state.
+    """
+
+    @abc.abstractmethod
+    def apply(self, deltas):
+        """
+        Add deltas to the counters, creating missing counters.
+
+        Args:
+            deltas (dict): delta by ``(workflow, state)``
+        """
+        pass
+
+    @abc.abstractmethod
+    def get_counts(self, workflow):
+        """
+        Return the counts of a workflow.
+
+        Args:
+            workflow (str): workflow name
+
+        Returns:
+            dict: count by state
+        """
+        pass
+
+    @abc.abstractmethod
+    def reset(self, workflow, counts):
+        """
+        Replace the counts of a workflow.
+
+        Args:
+            workflow (str): workflow name
+            counts (dict): count by state
+        """
+        pass
+
+
+class MemoryCounterStore(CounterStore):
+    """
+    Counters kept in process.
+    """
+
+    def __init__(self):
+        self.counts = collections.defaultdict(int)
+        self._lock = threading.Lock()
+
+    def apply(self, deltas):
+        with self._lock:
+            for key, delta in deltas.items():
+                self.counts[key] += delta
+
+    def get_counts(self, workflow):
+        with self._lock:
+            return {
+                state: count
+                for (name, state), count in self.counts.items()
+                if name == workflow
+            }
+
+    def reset(self, workflow, counts):
+        with self._lock:
+            for key in [key for key in self.counts if key[0] == workflow]:
+                del self.counts[key]
+            for state, count in counts.items():
+                self.counts[workflow, state] = count
+
+
+class SQLiteCounterStore(CounterStore):
+    """
+    Counters stored in a sqlite table.
+
+    Attributes:
+        connection (sqlite3.Connection): the connection, or a database path
+        table (str): table name
+    """
+
+    def __init__(self, connection, table="pieuvre_state_counter"):
+        if isinstance(connection, str):
+            connection = sqlite3.connect(connection, check_same_thread=False)
+        self.connection = connection
+        self.table = table
+        self._lock = threading.RLock()
+
+    def create_table(self):
+        with self._lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS {} ("
+                "workflow TEXT NOT NULL, "
+                "state TEXT NOT NULL, "
+                "count INTEGER NOT NULL, "
+                "PRIMARY KEY (workflow, state))".format(self.table))
+
+    def apply(self, deltas):
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO {} (workflow, state, count) "
+                "VALUES (?, ?, 0)".format(self.table), list(deltas))
+            self.connection.executemany(
+                "UPDATE {} SET count = count + ? "
+                "WHERE workflow = ? AND state = ?".format(self.table),
+                [(delta, ) + key for key, delta in deltas.items()])
+
+    def get_counts(self, workflow):
+        with self._lock:
+            return dict(self.connection.execute(
+                "SELECT state, count FROM {} WHERE workflow = ?".format(
+                    self.table), (workflow, )))
+
+    def reset(self, workflow, counts):
+        with self._lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM {} WHERE workflow = ?".format(self.table),
+                (workflow, ))
+            self.connection.executemany(
+                "INSERT INTO {} (workflow, state, count) "
+                "VALUES (?, ?, ?)".format(self.table),
+                [(workflow, state, count) for state, count in counts.items()])
+
+
+class DjangoCounterStore(CounterStore):
+    """
+    Counters stored with a Django model. The model must define these
+    fields:
+
+    .. code-block::
+
+       class StateCount(models.Model):
+           workflow = models.CharField(max_length=255)
+           state = models.CharField(max_length=255)
+           count = models.BigIntegerField(default=0)
+
+           class Meta:
+               unique_together = ("workflow", "state")
+
+    Deltas are applied with a single ``UPDATE`` per flush.
+
+    Attributes:
+        model: the counter model class
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    def apply(self, deltas):
+        manager = self.model._default_manager
+        with transaction.atomic():
+            manager.bulk_create([
+                self.model(workflow=workflow, state=state, count=0)
+                for workflow, state in deltas
+            ], ignore_conflicts=True)
+
+            condition = Q()
+            cases = []
+            for (workflow, state), delta in deltas.items():
+                lookup = Q(workflow=workflow, state=state)
+                condition |= lookup
+                cases.append(When(lookup, then=Value(delta)))
+            manager.filter(condition).update(count=F("count") + Case(
+                *cases, default=Value(0), output_field=IntegerField()))
+
+    def get_counts(self, workflow):
+        return dict(
+            self.model._default_manager.filter(workflow=workflow)
+            .values_list("state", "count"))
+
+    def reset(self, workflow, counts):
+        manager = self.model._default_manager
+        with transaction.atomic():
+            manager.filter(workflow=workflow).delete()
+            manager.bulk_create([
+                self.model(workflow=workflow, state=state, count=count)
+                for state, count in counts.items()
+            ])
+
+
+class StateCounter:
+    """
+    Maintain the number of models per state of workflows, from their
+    transitions. Set an instance as ``state_counter`` of the workflows:
+
+    .. code-block::
+
+       class OrderWorkflow(Workflow):
+           state_counter = StateCounter(DjangoCounterStore(StateCount))
+
+    Each committed transition is added to an in-memory aggregate by
+    ``(workflow, source, destination)``; transitions of rolled back
+    transactions are dropped. The aggregate is turned into -1/+1 deltas of
+    the source and destination states and written to the store when
+    ``flush_size`` transitions are pending, ``flush_interval`` seconds
+    after the oldest pending one, by ``flush`` and at exit. Time based
+    flushes run in a timer thread: the store must be usable from any
+    thread.
+
+    Models created or deleted outside of transitions are not counted: call
+    ``adjust`` for them, or rebuild the counters with ``reconcile``.
+
+    Attributes:
+        store (CounterStore): the counters storage
+        flush_size (int): maximum number of pending transitions
+        flush_interval (float): maximum age in seconds of pending
+            transitions, None to only flush by size
+    """
+
+    def __init__(self, store, flush_size=1000, flush_interval=5.0):
+        self.store = store
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+
+        self._transitions = collections.Counter()
+        self._pending = 0
+        self._timer = None
+        self._lock = threading.Lock()
+
+        call_at_exit(self)
+
+    def get_key(self, workflow_class):
+        """
+        Return the name of the counters of a workflow class, see
+        ``metrics.get_workflow_name``.
+        """
+        return get_workflow_name(workflow_class)
+
+    def record(self, workflow, transition):
+        """
+        Count a transition once its transaction is committed.
+
+        Args:
+            workflow (Workflow): the workflow
+            transition (dict): the transition, with its exact source state
+        """
+        key = (
+            self.get_key(type(workflow)),
+            transition["source"], transition["destination"])
+        transaction.on_commit(partial(self.adjust_transitions, {key: 1}))
+
+    def adjust(self, workflow_class, state, delta):
+        """
+        Add ``delta`` models to a state, for models created or deleted
+        outside of transitions.
+        """
+        self.adjust_transitions({
+            (self.get_key(workflow_class), None, state): delta})
+
+    def adjust_transitions(self, transitions):
+        """
+        Add transitions to the aggregate.
+
+        Args:
+            transitions (dict): number of transitions by
+                ``(workflow, source, destination)``, a None source
+                meaning a created model
+        """
+        with self._lock:
+            self._transitions.update(transitions)
+            self._pending += sum(abs(count) for count in transitions.values())
+            full = self._pending >= self.flush_size
+            if not full and self._timer is None \
+                    and self.flush_interval is not None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+        if full:
+            self.flush()
+
+    def _pop_deltas(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            transitions, self._transitions = \
+                self._transitions, collections.Counter()
+            self._pending = 0
+
+        deltas = collections.Counter()
+        for (workflow, source, destination), count in transitions.items():
+            if source is not None:
+                deltas[workflow, source] -= count
+            deltas[workflow, destination] += count
+        return {key: delta for key, delta in deltas.items() if delta}
+
+    def flush(self):
+        """
+        Write the pending deltas to the store.
+        """
+        deltas = self._pop_deltas()
+        if deltas:
+            self.store.apply(deltas)
+
+    def get_counts(self, workflow_class):
+        """
+        Return the number of models per state, pending deltas included.
+
+        Args:
+            workflow_class: class extending ``Workflow``
+
+        Returns:
+            dict: count by state
+        """
+        self.flush()
+        return self.store.get_counts(self.get_key(workflow_class))
+
+    def reconcile(self, workflow_class, states):
+        """
+        Rebuild the counters of a workflow from the states of all its
+        models, in one pass. Transitions committed during the scan may be
+        counted twice or missed.
+
+        Args:
+            workflow_class: class extending ``Workflow``
+            states (iterable): state of each model
+
+        Returns:
+            dict: count by state
+        """
+        counts = dict(collections.Counter(states))
+        key = self.get_key(workflow_class)
+        with self._lock:
+            # Pending transitions are included in the scan
+            for transition in [
+                    transition for transition in self._transitions
+                    if transition[0] == key]:
+                del self._transitions[transition]
+
+        self.store.reset(key, counts)
+        return counts
+
+    def reconcile_queryset(self, workflow_class, queryset, chunk_size=2000):
+        """
+        ``reconcile`` from the models of a Django queryset, streamed by
+        chunks of ``chunk_size``.
+        """
+        return self.reconcile(workflow_class, queryset.values_list(
+            workflow_class.state_field_name, flat=True,
+        ).iterator(chunk_size=chunk_size))
+
+
+def get_states(args, workflow_class):
+    if args.sqlite:
+        connection = sqlite3.connect(args.sqlite)
+        cursor = connection.execute("SELECT {} FROM {}".format(
+            workflow_class.state_field_name, args.source_table))
+        return SQLiteCounterStore(connection, table=args.table), (
+            state for state, in cursor)
+
+    import django
+    from django.apps import apps
+
+    django.setup()
+    queryset = apps.get_model(args.model)._default_manager.values_list(
+        workflow_class.state_field_name, flat=True)
+    return (
+        DjangoCounterStore(apps.get_model(args.counter_model)),
+        queryset.iterator(chunk_size=args.chunk_size))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m pieuvre.counters",
+        description="Rebuild the state counters of a workflow.")
+    parser.add_argument(
+        "--workflow", required=True, help="workflow class as module:Class")
+    backend = parser.add_mutually_exclusive_group(required=True)
+    backend.add_argument("--sqlite", help="sqlite database path")
+    backend.add_argument(
+        "--model",
+        help="model as app_label.ModelName, with DJANGO_SETTINGS_MODULE")
+    parser.add_argument(
+        "--counter-model", help="counter model as app_label.ModelName")
+    parser.add_argument("--source-table", help="sqlite table of the models")
+    parser.add_argument(
+        "--table", default="pieuvre_state_counter",
+        help="sqlite counter table name")
+    parser.add_argument("--chunk-size", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    if args.sqlite and not args.source_table:
+        parser.error("--source-table is required with --sqlite")
+    if args.model and not args.counter_model:
+        parser.error("--counter-model is required with --model")
+
+    workflow_class = load_object(args.workflow)
+    store, states = get_states(args, workflow_class)
+    try:
+        if args.sqlite:
+            store.create_table()
+
+        counter = StateCounter(store)
+        counts = counter.reconcile(workflow_class, states)
+    finally:
+        if args.sqlite:
+            store.connection.close()
+
+    for state, count in sorted(counts.items()):
+        print("{}\t{}".format(state, count))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""
+db_logging.py
+=================================================
+Buffered backend for transition logs.
+"""
+
+import threading
+
+from functools import partial
+
+try:
+    from django.db import connections, transaction
+except ImportError:
+    # Fallback if Django is not installed
+    from .utils import transaction
+    connections = None
+
+from .utils import call_at_exit
+
+
+class BufferedTransitionLog:
+    """
+    Buffer transition logs and write them in bulk.
+
+    Use an instance as ``db_logging_class`` of a workflow, wrapping the
+    actual logging backend:
+
+    .. code-block::
+
+       class OrderWorkflow(Workflow):
+           db_logging = True
+           db_logging_class = BufferedTransitionLog(TransitionLog)
+
+    The logs of a transition, of the transitions it triggers and of the
+    chunks of ``bulk_run_transition`` are buffered until the end of the
+    outermost transition, or chunk, and written together in its
+    transaction, before it is committed: a failed write rolls the
+    transition back. Records are written by batches of ``flush_size``
+    records. To write the logs of several transitions together, run them
+    in a ``pieuvre.unit_of_work.UnitOfWork`` inside the transaction:
+
+    .. code-block::
+
+       with transaction.atomic(), UnitOfWork(defer_saves=False):
+           for order in orders:
+               OrderWorkflow(order).submit()
+
+    With ``after_commit`` enabled, records are instead kept once their
+    transaction is committed and written across transactions, when
+    ``flush_size`` records are buffered, or ``flush_interval`` seconds
+    after the oldest one by a timer thread: the backend must then be usable
+    from any thread. Remaining records are written by ``flush`` which is
+    also called at exit. Buffered records are lost if the process crashes,
+    and write errors are not reported to the transitions.
+
+    The backend writes records with a ``bulk_log(records)`` method if it
+    has one, records being dicts of ``log`` keyword arguments. Otherwise
+    ``log`` is called for each record. With Django, ``bulk_log`` is
+    typically implemented with ``bulk_create``.
+
+    Attributes:
+        backend: logging backend, as ``db_logging_class``
+        flush_size (int): maximum number of records per write
+        flush_interval (float): with ``after_commit``, maximum age in
+            seconds of buffered records, None to only flush by size
+        after_commit (bool): buffer the records of committed transactions
+            instead of writing them before commit
+    """
+
+    # Logs are deferred to the end of the outermost transition
+    batch_logs = True
+
+    def __init__(self, backend, flush_size=500, flush_interval=5.0,
+                 after_commit=False):
+        self.backend = backend
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.after_commit = after_commit
+
+        self._records = []
+        self._timer = None
+        self._lock = threading.Lock()
+
+        call_at_exit(self)
+
+    def log(self, **record):
+        """
+        Write a record logged outside of a transition. Takes the arguments
+        of the backend ``log`` method.
+        """
+        self.bulk_log([record])
+
+    def bulk_log(self, records):
+        """
+        Write the records of a transaction, or buffer them until it is
+        committed with ``after_commit``.
+
+        Args:
+            records (list): dicts of ``log`` keyword arguments
+        """
+        if self.after_commit:
+            transaction.on_commit(partial(self._buffer, records))
+            return
+
+        self._write_chunks(records)
+
+    def _buffer(self, records):
+        with self._lock:
+            self._records.extend(records)
+            flush = len(self._records) >= self.flush_size
+            if not flush and self._timer is None \
+                    and self.flush_interval is not None:
+                self._timer = threading.Timer(
+                    self.flush_interval, self._flush_in_thread)
+                self._timer.daemon = True
+                self._timer.start()
+
+        if flush:
+            self.flush()
+
+    def _flush_in_thread(self):
+        try:
+            self.flush()
+        finally:
+            # Each timer runs in a new thread
+            if connections is not None:
+                connections.close_all()
+
+    def flush(self):
+        """
+        Write all buffered records.
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            records, self._records = self._records, []
+
+        self._write_chunks(records)
+
+    def _write_chunks(self, records):
+        for start in range(0, len(records), self.flush_size):
+            self._write(records[start:start + self.flush_size])
+
+    def _write(self, records):
+        bulk_log = getattr(self.backend, "bulk_log", None)
+        if bulk_log:
+            bulk_log(records)
+            return
+
+        for record in records:
+            self.backend.log(**record)
+
+    def __len__(self):
+        return len(self._records)
@@ -0,0 +1,108 @@
+"""
+decorators.py
+=================================================
+Transition and state hook decorators.
+"""
+
+from functools import wraps
+
+
+class Transition:
+    """
+    @transition decorator.
+    """
+    def __call__(self, func):
+        #  TODO: Check if it is a valid transition
+        @wraps(func)
+        def wrapped_func(workflow, *args, **kwargs):
+            return workflow.execute_transition(
+                func.__name__, func, args, kwargs)
+
+        # Read by ``CompiledTransition``
+        wrapped_func._transition_body = func
+        return wrapped_func
+
+
+class BaseDecorator:
+    """
+    Base class for hook decorators.
+    """
+    type = None
+
+    def __init__(self, state):
+        self.states = state if isinstance(state, list) else [state, ]
+        super().__init__()
+
+    def __call__(self, func):
+        setattr(func, self.type, self.states)
+        return func
+
+
+class OnEnterStateCheck(BaseDecorator):
+    """
+    Wrap a function with this decorator so that it is ran before a transition
+    that would enter the given state. This function must return True to carry
+    on with the transition.
+
+    Example:
+
+    .. code-block::
+
+       @on_enter_state_check(ROCKET_STATES.ON_LAUNCHPAD)
+       def has_enough_fuel(self, result):
+           if self.model.fuel > 10:
+               return True
+           # Transition is aborted if there is not enough fuel
+    """
+    type = "_on_enter_state_check"
+
+
+class OnExitStateCheck(BaseDecorator):
+    """
+    Wrap a function with this decorator so that it is ran before a transition
+    that would exit the given state. This function must return True to carry
+    on with the transition.
+
+    Example:
+
+    .. code-block::
+
+       @on_exit_state_check(ROCKET_STATES.ON_LAUNCHPAD)
+       def is_it_a_beautiful_day(self, result):
+           if datetime.today().day == 7:
+                return True
+           # Transition is aborted if the day is not the 7th
+    """
+    type = "_on_exit_state_check"
+
+
+class OnEnterState(BaseDecorator):
+    """
+    Wrap a function with this decorator to run it before
+    entering a state, after the transition is ran.
+
+    Example:
+
+    .. code-block::
+
+       @on_enter_state(ROCKET_STATES.ON_LAUNCHPAD)
+       def start_countdown(self, result):
+           print("Launch is imminent!")
+    """
+    type = "_on_enter_state_hook"
+
+
+class OnExitState(BaseDecorator):
+    """
+    Wrap a function with this decorator to run it after
+    exiting a state, before the transition is ran.
+
+    Example:
+
+    .. code-block::
+
+       @on_exit_state(ROCKET_STATES.ON_LAUNCHPAD)
+       def warn_aliens(self, result):
+           print("Beware aliens, a rocket has left the launchpad!")
+    """
+    type = "_on_exit_state_hook"
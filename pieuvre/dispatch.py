@@ -0,0 +1,200 @@
+"""
+dispatch.py
+=================================================
+Asynchronous dispatch of workflow events.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+from functools import partial
+
+try:
+    from django.db import transaction
+except ImportError:
+    # Fallback if Django is not installed
+    from .utils import transaction
+
+from .utils import call_at_exit
+
+
+logger = logging.getLogger(__name__)
+
+# Sent to the workers to stop them
+STOP = object()
+
+
+class EventDispatcher:
+    """
+    Publish workflow events from a pool of worker threads, once the
+    transaction of the transition is committed.
+
+    Set an instance as ``event_dispatcher`` of a workflow:
+
+    .. code-block::
+
+       class OrderWorkflow(Workflow):
+           event_manager_classes = (OrderEventManager, )
+           event_dispatcher = EventDispatcher(max_workers=4)
+
+    Events are generated during the transition, then queued when the
+    transaction commits (with ``transaction.on_commit``), so that events of
+    rolled back transactions are never published. The workers publish them
+    with the ``_push_event`` method of their event manager.
+
+    The queue is bounded: when it is full, committing threads wait for
+    a free slot, or get ``queue.Full`` after ``put_timeout`` seconds.
+
+    Attributes:
+        max_workers (int): number of worker threads
+        max_queue_size (int): maximum number of queued events
+        put_timeout (float): maximum wait for a free slot, None to wait
+            forever
+    """
+
+    def __init__(self, max_workers=4, max_queue_size=10000, put_timeout=None):
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.put_timeout = put_timeout
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._workers = []
+        # Workers sent a ``STOP`` by ``shutdown``, not joined yet
+        self._stopping = []
+        # Held to start and stop workers
+        self._workers_lock = threading.Lock()
+        # Held to update the counters
+        self._lock = threading.Lock()
+
+        self.published = 0
+        self.failed = 0
+        self.total_latency = 0.
+        self.max_latency = 0.
+
+        call_at_exit(self, "shutdown")
+
+    def dispatch(self, manager, event):
+        """
+        Queue an event once the current transaction is committed.
+
+        Args:
+            manager (WorkflowEventManager): manager pushing the event
+            event (dict): the event
+        """
+        transaction.on_commit(partial(self._enqueue, manager, event))
+
+    def _enqueue(self, manager, event):
+        if len(self._workers) < self.max_workers:
+            self._start_workers()
+
+        self._queue.put(
+            (manager, event, time.monotonic()), timeout=self.put_timeout)
+
+    def _start_workers(self):
+        with self._workers_lock:
+            # Stopped workers must consume their ``STOP`` first: a new
+            # worker taking it would exit at once
+            self._join_stopping()
+            while len(self._workers) < self.max_workers:
+                worker = threading.Thread(
+                    target=self._work, name="pieuvre-dispatch-{}".format(
+                        len(self._workers)), daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is STOP:
+                    return
+                self._publish(*item)
+            finally:
+                self._queue.task_done()
+
+    def _publish(self, manager, event, queued_at):
+        try:
+            manager._push_event(event)
+        except Exception:
+            logger.exception("Failed to publish event %s", event.get("type"))
+            success = False
+        else:
+            success = True
+
+        latency = time.monotonic() - queued_at
+        with self._lock:
+            if success:
+                self.published += 1
+            else:
+                self.failed += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def flush(self, timeout=None):
+        """
+        Wait until all queued events are published.
+
+        Args:
+            timeout (float): maximum wait in seconds, None to wait forever
+
+        Returns:
+            bool: True if the queue was drained
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def shutdown(self, wait=True):
+        """
+        Publish queued events and stop the workers. The dispatcher starts
+        new workers if more events are dispatched afterwards, once the
+        stopped workers have published the events queued before the
+        shutdown.
+
+        Args:
+            wait (bool): wait for the queued events to be published
+        """
+        with self._workers_lock:
+            workers, self._workers = self._workers, []
+            self._stopping.extend(workers)
+            for _ in workers:
+                self._queue.put(STOP)
+
+            if wait:
+                self._join_stopping()
+
+    def _join_stopping(self):
+        stopping, self._stopping = self._stopping, []
+        current = threading.current_thread()
+        for worker in stopping:
+            # A worker may dispatch events while publishing one
+            if worker is not current:
+                worker.join()
+
+    def get_stats(self):
+        """
+        Return the dispatcher counters.
+
+        Returns:
+            dict: ``queued`` events, ``published`` and ``failed`` events,
+                ``average_latency`` and ``max_latency`` in seconds between
+                queuing and publication
+        """
+        with self._lock:
+            done = self.published + self.failed
+            return {
+                "queued": self._queue.qsize(),
+                "published": self.published,
+                "failed": self.failed,
+                "average_latency": self.total_latency / done if done else 0.,
+                "max_latency": self.max_latency,
+            }
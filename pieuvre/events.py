@@ -4,6 +4,8 @@ events.py
 Hooks to generate events from transitions.
 """
 
+import asyncio
+
 
 class WorkflowEventManager:
     """
@@ -22,25 +24,74 @@ class WorkflowEventManager:
            }
        }
 
+    Set ``batch_events`` to push the events of a workflow transaction
+    together, with ``_push_events``, at the end of the outermost transition
+    instead of one by one. The batch may contain events of different models,
+    ``_push_events`` should not depend on ``self.model``.
+
     """
     supported_transitions = {
 
     }
 
+    batch_events = False
+
     def __init__(self, model):
         self.model = model
 
     def push_event(self, transition):
-        transition_name = transition["name"]
-
-        if transition_name not in self.supported_transitions:
+        event = self.build_event(transition)
+        if event is None:
             return
 
-        event = self.get_event(transition_name)
-
         # Push event
         self._push_event(event)
 
+    def push_events(self, transitions):
+        """
+        Push the events of several transitions of the model with a single
+        ``_push_events`` call, for high-volume transitions.
+
+        Args:
+            transitions (list): the transitions
+        """
+        events = []
+        for transition in transitions:
+            event = self.build_event(transition)
+            if event is not None:
+                events.append(event)
+
+        if events:
+            self._push_events(events)
+
+    async def apush_event(self, transition):
+        """
+        Asynchronous version of ``push_event``, used by ``AsyncWorkflow``.
+        """
+        event = self.build_event(transition)
+        if event is None:
+            return
+
+        await self._apush_event(event)
+
+    def build_event(self, transition):
+        """
+        Generate the event of a transition.
+
+        Args:
+            transition (dict): the transition
+
+        Returns:
+            dict: the event, or None if the transition does not generate
+                an event
+        """
+        transition_name = transition["name"]
+
+        if transition_name not in self.supported_transitions:
+            return None
+
+        return self.get_event(transition_name)
+
     def get_event(self, transition_name):
         """
         Generate an event dictionary from the transition.
@@ -50,7 +101,7 @@ class WorkflowEventManager:
         """
         return {
             "type": self.supported_transitions[transition_name]["event_type"],
-            "data": self.supported_transitions.get(transition_name, dict())()
+            "data": self.supported_transitions[transition_name]["data"]()
         }
 
     def _push_event(self, event):
@@ -58,3 +109,23 @@ class WorkflowEventManager:
         This method is to be overriden to push events to your backend.
         """
         pass
+
+    def _push_events(self, events):
+        """
+        Push a batch of events. Calls ``_push_event`` for each event by
+        default, override to push them in bulk.
+
+        Args:
+            events (list): the events
+        """
+        for event in events:
+            self._push_event(event)
+
+    async def _apush_event(self, event):
+        """
+        This method is to be overriden to push events to your backend
+        asynchronously. Runs ``_push_event`` in the default executor of the
+        event loop by default, not to block the loop.
+        """
+        await asyncio.get_event_loop().run_in_executor(
+            None, self._push_event, event)
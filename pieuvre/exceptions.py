@@ -46,6 +46,22 @@ class TransitionNotFound(WorkflowBaseError):
     message = "Transition not found from {current_state} to {to_state}"
 
 
+class ConcurrentTransition(WorkflowBaseError):
+    """
+    Raised when the state of the model was changed concurrently during a
+    transition with ``cas_writes`` enabled
+    """
+    message = "Concurrent transition of {model}: {current_state} -> {to_state}"
+
+
+class LockOrderError(WorkflowBaseError):
+    """
+    Raised when a thread holding a lock stripe of a ``StripedLockManager``
+    times out waiting for a stripe of a lower index, which could deadlock
+    """
+    message = "Timed out acquiring lock stripe {stripe} while holding stripe {held}"
+
+
 class WorkflowValidationError(WorkflowBaseError):
     """
     Raised by the application when the transition fails
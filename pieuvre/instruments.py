@@ -0,0 +1,77 @@
+"""
+instruments.py
+=================================================
+Tracing and metrics of the transition stages.
+"""
+
+from contextlib import contextmanager
+from time import monotonic
+
+
+def call_stage(_compiled, _stage, func, *args):
+    """
+    Instrument of the workflows without tracer nor metrics collector: call
+    ``func``. See ``Workflow._get_instrument``.
+    """
+    return func(*args)
+
+
+class InstrumentsMixin:
+    """
+    Stages of the transitions ran in the spans of ``Workflow.tracer`` and
+    measured by ``Workflow.metrics_collector``.
+    """
+
+    def _get_instrument(self):
+        """
+        Return the function running the stages of the transitions:
+        ``_instrument`` if the workflow has a tracer or a metrics collector,
+        ``call_stage`` otherwise.
+        """
+        if self.metrics_collector is None and self.tracer is None:
+            return call_stage
+        return self._instrument
+
+    def _instrument(self, compiled, stage, func, *args):
+        """
+        Call ``func`` in a span of the tracer and report its duration to the
+        metrics collector, depending on the instruments of the workflow.
+        """
+        with self._measure(compiled, stage):
+            return func(*args)
+
+    @contextmanager
+    def _measure(self, compiled, stage):
+        """
+        Run the block in a span of the tracer and report its duration to
+        the metrics collector.
+        """
+        span = None
+        if self.tracer is not None:
+            span = self.tracer.start_span(
+                stage, self._get_span_attributes(compiled, stage))
+
+        start = monotonic()
+        try:
+            yield
+        except Exception as exc:
+            if span is not None:
+                span.record_exception(exc)
+            raise
+        finally:
+            if self.metrics_collector is not None:
+                self.metrics_collector.observe(
+                    type(self), compiled.name, stage, monotonic() - start)
+            if span is not None:
+                span.end()
+
+    def _get_span_attributes(self, compiled, stage):
+        attributes = {
+            "workflow": type(self).__name__,
+            "transition": compiled.name,
+        }
+        if stage == "transition":
+            attributes["model"] = getattr(self.model, "pk", None)
+            attributes["source"] = self._get_model_state()
+            attributes["destination"] = compiled.destination
+        return attributes
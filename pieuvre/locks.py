@@ -0,0 +1,119 @@
+"""
+locks.py
+=================================================
+In-process locking of the models during transitions.
+"""
+
+import threading
+
+from .exceptions import LockOrderError
+
+
+class StripeLock:
+    """
+    Reentrant lock of a stripe, usable as a context manager. See
+    ``StripedLockManager``.
+
+    Attributes:
+        index (int): index of the stripe
+    """
+
+    __slots__ = ("index", "_lock", "_manager")
+
+    def __init__(self, index, manager):
+        self.index = index
+        self._lock = threading.RLock()
+        self._manager = manager
+
+    def __enter__(self):
+        local = self._manager._held
+        held = getattr(local, "stripes", None)
+        if held is None:
+            held = local.stripes = []
+
+        if held and self.index not in held and max(held) > self.index:
+            # Out of order: the owner of the stripe may be waiting for one
+            # of the stripes held here, do not wait for it forever
+            if not self._lock.acquire(timeout=self._manager.order_timeout):
+                raise LockOrderError(stripe=self.index, held=max(held))
+        else:
+            self._lock.acquire()
+        held.append(self.index)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._manager._held.stripes.pop()
+        self._lock.release()
+
+
+class StripedLockManager:
+    """
+    Serialise the transitions of a model across threads, while transitions
+    of different models run in parallel. Set an instance as
+    ``lock_manager`` of a workflow:
+
+    .. code-block::
+
+       class OrderWorkflow(Workflow):
+           lock_manager = StripedLockManager(stripes=256)
+
+    Models are mapped to a fixed set of reentrant locks by identity: their
+    class and primary key if they have one, the object otherwise. Two
+    models may share a lock, which only delays one of them. Locks are
+    reentrant, so that hooks may run transitions on the same model.
+
+    Hooks may run transitions on other models. Stripes acquired in
+    increasing index order cannot deadlock and are waited for. A stripe of
+    a lower index than one the thread holds is acquired as soon as it is
+    free, but waited for at most ``order_timeout`` seconds: its owner may
+    be waiting for a stripe held by the thread. ``LockOrderError`` is then
+    raised, which rolls the transition back and releases its stripes.
+
+    Models loaded separately with the same primary key share a lock, but
+    only within the process: use ``cas_writes`` or database locks to
+    protect models across processes.
+
+    Attributes:
+        stripes (int): number of locks
+        order_timeout (float): seconds to wait for a stripe acquired out of
+            index order
+    """
+
+    def __init__(self, stripes=64, order_timeout=5.):
+        self.stripes = stripes
+        self.order_timeout = order_timeout
+        # Indexes of the stripes held by each thread, in acquisition order
+        self._held = threading.local()
+        self._locks = tuple(StripeLock(index, self) for index in range(stripes))
+
+    def get_key(self, model):
+        """
+        Return the identity of a model.
+        """
+        pk = getattr(model, "pk", None)
+        if pk is None:
+            return id(model)
+        return (type(model), pk)
+
+    def get_index(self, model):
+        """
+        Return the index of the stripe of a model.
+        """
+        return hash(self.get_key(model)) % self.stripes
+
+    def lock(self, model):
+        """
+        Return the lock of a model, usable as a context manager.
+
+        Args:
+            model: the model
+
+        Returns:
+            StripeLock: the lock
+
+        Raises:
+            LockOrderError: on enter, if the stripe was not acquired in
+                ``order_timeout`` seconds while the thread holds a stripe of
+                a higher index
+        """
+        return self._locks[self.get_index(model)]
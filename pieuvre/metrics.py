@@ -0,0 +1,203 @@
+"""
+metrics.py
+=================================================
+Collect the duration of each stage of the transitions.
+"""
+
+import threading
+
+from bisect import bisect_left
+
+
+# Stages measured by the workflows, in execution order
+STAGES = (
+    "check",
+    "before",
+    "exit_hooks",
+    "body",
+    "enter_hooks",
+    "after",
+    "save",
+    "log",
+    "events",
+    "transition",
+)
+
+# Histogram upper bounds in seconds
+DEFAULT_BUCKETS = (
+    .0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5,
+    1., 2.5, 5., 10.,
+)
+
+
+class MetricsCollector:
+    """
+    Base class of metrics collectors. Set an instance as
+    ``metrics_collector`` of a workflow to measure its transitions:
+
+    .. code-block::
+
+       class OrderWorkflow(Workflow):
+           metrics_collector = HistogramCollector()
+
+    ``observe`` is called after each stage of a transition with its
+    duration, measured with a monotonic clock. See ``STAGES`` for the list
+    of stages, ``transition`` being the whole transition.
+    """
+
+    def observe(self, workflow_class, transition, stage, duration):
+        """
+        Record the duration of a transition stage. To be overridden, does
+        nothing by default.
+
+        Args:
+            workflow_class (type): class of the workflow
+            transition (str): transition name
+            stage (str): stage name
+            duration (float): duration in seconds
+        """
+        pass
+
+
+def get_workflow_name(workflow_class):
+    """
+    Return the qualified name of a workflow class, identifying its series:
+    classes with the same name in different modules are kept apart.
+    """
+    return "{}.{}".format(workflow_class.__module__, workflow_class.__qualname__)
+
+
+class Histogram:
+    """
+    Histogram of durations. Bucket counts are not cumulative.
+
+    Attributes:
+        buckets (tuple): upper bounds of the buckets
+        counts (list): number of observations per bucket, the last one
+            counting observations above the highest bound
+        count (int): number of observations
+        sum (float): sum of the observations
+    """
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other):
+        """
+        Add the observations of a histogram with the same buckets.
+        """
+        if other.buckets != self.buckets:
+            raise ValueError("Cannot merge histograms with different buckets")
+
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q):
+        """
+        Return an upper bound of the ``q`` quantile: the bound of the bucket
+        containing it, or infinity.
+        """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank and seen:
+                return bound
+        return float("inf")
+
+
+class HistogramCollector(MetricsCollector):
+    """
+    In-memory collector keeping a histogram per workflow class, transition
+    and stage. Workflow classes are identified by their qualified name, see
+    ``get_workflow_name``.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, workflow_class, transition, stage, duration):
+        key = (get_workflow_name(workflow_class), transition, stage)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(duration)
+
+    def get(self, workflow_class, transition, stage):
+        """
+        Return the histogram of a stage, or None if it was not observed.
+        """
+        return self._histograms.get(
+            (get_workflow_name(workflow_class), transition, stage))
+
+    def items(self):
+        """
+        Return ``((workflow, transition, stage), histogram)`` pairs, sorted.
+        """
+        with self._lock:
+            return sorted(self._histograms.items())
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace(
+        "\n", "\\n").replace('"', '\\"')
+
+
+def format_float(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+def to_prometheus(collector, name="pieuvre_transition_stage_duration_seconds"):
+    """
+    Export the histograms of a ``HistogramCollector`` in the Prometheus
+    text exposition format.
+
+    Args:
+        collector (HistogramCollector): the collector
+        name (str): metric name
+
+    Returns:
+        str: the exposition text
+    """
+    lines = [
+        "# HELP {} Duration of the workflow transition stages.".format(name),
+        "# TYPE {} histogram".format(name),
+    ]
+    for (workflow, transition, stage), histogram in collector.items():
+        labels = 'workflow="{}",transition="{}",stage="{}"'.format(
+            escape_label(workflow), escape_label(transition),
+            escape_label(stage))
+
+        cumulative = 0
+        bounds = histogram.buckets + (float("inf"), )
+        for bound, count in zip(bounds, histogram.counts):
+            cumulative += count
+            lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                name, labels, format_float(bound), cumulative))
+        lines.append("{}_sum{{{}}} {}".format(
+            name, labels, format_float(histogram.sum)))
+        lines.append("{}_count{{{}}} {}".format(
+            name, labels, histogram.count))
+
+    return "\n".join(lines) + "\n"
@@ -4,6 +4,16 @@ mixins.py
 Various helper mixins.
 """
 
+from .compiler import get_transition_sources
+from .shared import BoundWorkflow
+from .exceptions import TransitionDoesNotExist
+
+try:
+    from django.db.models import BooleanField, Case, CharField, Q, Value, When
+except ImportError:
+    # Django is only needed by ``WorkflowQuerySetMixin``
+    BooleanField = Case = CharField = Q = Value = When = None
+
 
 class WorkflowEnabled:
     """
@@ -16,9 +26,13 @@ class WorkflowEnabled:
     Attributes:
         workflow_class: class extending ``Workflow`` describing the model
             workflow.
+        shared_workflow (bool): operate on the model with the shared workflow
+            of the class (see ``Workflow.shared``) through a lightweight
+            ``BoundWorkflow``, instead of creating a workflow per model.
     """
 
     workflow_class = None
+    shared_workflow = False
 
     def __init__(self, *args, **kwargs):
         self._workflow = None
@@ -40,9 +54,166 @@ class WorkflowEnabled:
         if self._workflow:
             return self._workflow
         workflow_class = self.get_workflow_class()
-        self.workflow = workflow_class(model=self)
+        if self.shared_workflow:
+            self.workflow = BoundWorkflow(workflow_class.shared(), self)
+        else:
+            self.workflow = workflow_class(model=self)
         return self._workflow
 
     @workflow.setter
     def workflow(self, value):
         self._workflow = value
+
+
+class WorkflowQuerySetMixin:
+    """
+    This mixin filters and annotates Django querysets with the transitions
+    available from the state of each row, in SQL: the sources of the
+    transitions are translated to ``<state_field>__in`` lookups, instead
+    of instantiating a workflow per model.
+
+    .. code-block::
+
+       class OrderQuerySet(WorkflowQuerySetMixin, models.QuerySet):
+           pass
+
+       class Order(WorkflowEnabled, models.Model):
+           workflow_class = OrderWorkflow
+           objects = OrderQuerySet.as_manager()
+
+       Order.objects.available_for("submit")
+       Order.objects.annotate_transitions("submit", "cancel")  # can_submit...
+       Order.objects.annotate_available_transitions()
+
+    Like ``Workflow.get_available_transitions``, only the source states
+    are considered, not the checks of the transitions.
+
+    Attributes:
+        workflow_class: class extending ``Workflow``, by default the
+            ``workflow_class`` of the model
+        transitions_separator (str): separator of the transition names
+            of ``annotate_available_transitions``
+    """
+
+    workflow_class = None
+    transitions_separator = ","
+
+    def get_workflow_class(self):
+        """
+        Return the workflow class of the queryset, by default
+        ``self.workflow_class`` or the ``workflow_class`` of the model.
+        """
+        return self.workflow_class or self.model.workflow_class
+
+    def get_source_states(self, name):
+        """
+        Return the source states of a transition.
+
+        Args:
+            name (str): transition name
+
+        Returns:
+            list: the source states, or None if the transition is available
+                from any state
+
+        Raises:
+            TransitionDoesNotExist
+        """
+        workflow_class = self.get_workflow_class()
+        transition = workflow_class._get_transition_by_name(name)
+        if not transition:
+            raise TransitionDoesNotExist(transition=name)
+
+        if transition["source"] == workflow_class.wildcard_state:
+            return None
+        return get_transition_sources(transition)
+
+    def get_states_by_transitions(self):
+        """
+        Group the known states of the workflow by the transitions available
+        from them.
+
+        Returns:
+            dict: lists of states, by tuple of transition names
+        """
+        states_by_transitions = {}
+        transitions_by_source = \
+            self.get_workflow_class()._transitions_by_source
+        for state, transitions in transitions_by_source.items():
+            names = tuple(trans["name"] for trans in transitions)
+            states_by_transitions.setdefault(names, []).append(state)
+        return states_by_transitions
+
+    def _get_state_lookup(self, states):
+        return Q(**{
+            "{}__in".format(self.get_workflow_class().state_field_name): states
+        })
+
+    def available_for(self, *names):
+        """
+        Filter the models from which any of the given transitions is
+        available. Without transition names, no model is returned.
+
+        Args:
+            names (str): transition names
+        """
+        if not names:
+            return self.none()
+
+        condition = Q()
+        for name in names:
+            states = self.get_source_states(name)
+            if states is None:
+                return self.all()
+            condition |= self._get_state_lookup(states)
+        return self.filter(condition)
+
+    def annotate_transitions(self, *names, prefix="can_"):
+        """
+        Annotate each model with a boolean ``<prefix><name>`` per given
+        transition, True if the transition is available from its state.
+
+        Args:
+            names (str): transition names
+            prefix (str): prefix of the annotations
+        """
+        annotations = {}
+        for name in names:
+            states = self.get_source_states(name)
+            if states is None:
+                expression = Value(True, output_field=BooleanField())
+            else:
+                expression = Case(
+                    When(self._get_state_lookup(states), then=Value(True)),
+                    default=Value(False), output_field=BooleanField())
+            annotations[prefix + name] = expression
+        return self.annotate(**annotations)
+
+    def annotate_available_transitions(self, alias="available_transitions"):
+        """
+        Annotate each model with the names of the transitions available
+        from its state, joined by ``transitions_separator``. States that
+        share the same transitions are grouped in a single ``When``.
+
+        Args:
+            alias (str): name of the annotation
+        """
+        workflow_class = self.get_workflow_class()
+        join = self.transitions_separator.join
+        default = tuple(
+            trans["name"] for trans in workflow_class._wildcard_transitions)
+
+        cases = [
+            When(self._get_state_lookup(states), then=Value(join(names)))
+            for names, states in self.get_states_by_transitions().items()
+            if names != default
+        ]
+        return self.annotate(**{alias: Case(
+            *cases, default=Value(join(default)), output_field=CharField())})
+
+    def split_transitions(self, value):
+        """
+        Return the list of transition names of an
+        ``annotate_available_transitions`` value.
+        """
+        return value.split(self.transitions_separator) if value else []
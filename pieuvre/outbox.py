@@ -0,0 +1,498 @@
+"""
+outbox.py
+=================================================
+Transactional outbox of workflow events.
+
+Events are written to an outbox table in the transaction of the
+transition, then published by a separate worker:
+
+.. code-block::
+
+   python -m pieuvre.outbox --sqlite outbox.db --sink myapp.sinks:make_sink
+"""
+
+import abc
+import argparse
+import datetime
+import json
+import logging
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+from .events import WorkflowEventManager
+from .utils import load_object
+
+try:
+    from django.db import connections, router, transaction
+    from django.db.models import Q
+    from django.utils.timezone import now
+except ImportError:
+    # Django is only needed by ``DjangoOutboxStore``
+    connections = router = transaction = Q = None
+    from .utils import now
+
+
+logger = logging.getLogger(__name__)
+
+
+def encode_event(event):
+    return json.dumps(event, default=str, sort_keys=True)
+
+
+def decode_event(payload):
+    return json.loads(payload)
+
+
+class OutboxRecord:
+    """
+    An event claimed from the outbox.
+
+    Attributes:
+        pk: identifier of the outbox row
+        event (dict): the event
+        token (str): identifier of the claim
+    """
+
+    __slots__ = ("pk", "event", "token")
+
+    def __init__(self, pk, event, token):
+        self.pk = pk
+        self.event = event
+        self.token = token
+
+
+def group_by_token(records):
+    """
+    Return the row identifiers of claimed records, by claim token.
+    """
+    ids_by_token = {}
+    for record in records:
+        ids_by_token.setdefault(record.token, []).append(record.pk)
+    return ids_by_token
+
+
+class OutboxStore(abc.ABC):
+    """
+    Base class of the outbox storages.
+
+    ``insert`` is called in the transaction of the transitions. ``claim``,
+    ``ack`` and ``release`` are called by the worker: a claimed event is not
+    claimed again until its lease expires, so that several workers can
+    drain the same outbox. ``ack`` and ``release`` only affect the events
+    still held by the claim of the records: once a lease expired and the
+    event was claimed by another worker, they leave it alone.
+    """
+
+    @abc.abstractmethod
+    def insert(self, events):
+        """
+        Add events to the outbox, with a single bulk insert.
+
+        Args:
+            events (list): event dicts
+        """
+        pass
+
+    @abc.abstractmethod
+    def claim(self, batch_size=100, lease=30.):
+        """
+        Claim the oldest events that are not claimed yet.
+
+        Args:
+            batch_size (int): maximum number of events
+            lease (float): duration of the claim in seconds
+
+        Returns:
+            list: ``OutboxRecord`` instances, oldest first
+        """
+        pass
+
+    @abc.abstractmethod
+    def ack(self, records):
+        """
+        Delete published events.
+
+        Args:
+            records (list): ``OutboxRecord`` instances returned by ``claim``
+
+        Returns:
+            int: number of deleted events
+        """
+        pass
+
+    @abc.abstractmethod
+    def release(self, records):
+        """
+        Make claimed events available again.
+
+        Args:
+            records (list): ``OutboxRecord`` instances returned by ``claim``
+        """
+        pass
+
+
+class SQLiteOutboxStore(OutboxStore):
+    """
+    Outbox stored in a sqlite table.
+
+    Share the connection of the application to insert events in its
+    transactions, with ``commit=False``. Otherwise inserts are committed
+    immediately.
+
+    Attributes:
+        connection (sqlite3.Connection): the connection, or a database path
+        table (str): table name
+        commit (bool): commit after inserting events
+    """
+
+    def __init__(self, connection, table="pieuvre_outbox", commit=True):
+        if isinstance(connection, str):
+            connection = sqlite3.connect(connection, check_same_thread=False)
+        self.connection = connection
+        self.table = table
+        self.commit = commit
+        self._lock = threading.RLock()
+
+    def create_table(self):
+        with self._lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS {} ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "event_type TEXT, "
+                "payload TEXT NOT NULL, "
+                "created_at REAL NOT NULL, "
+                "claimed_by TEXT, "
+                "claimed_until REAL)".format(self.table))
+
+    def insert(self, events):
+        created_at = time.time()
+        rows = [
+            (event.get("type"), encode_event(event), created_at)
+            for event in events
+        ]
+        with self._lock:
+            self.connection.executemany(
+                "INSERT INTO {} (event_type, payload, created_at) "
+                "VALUES (?, ?, ?)".format(self.table), rows)
+            if self.commit:
+                self.connection.commit()
+
+    def claim(self, batch_size=100, lease=30.):
+        token = uuid.uuid4().hex
+        claimed_at = time.time()
+        with self._lock, self.connection:
+            self.connection.execute(
+                "UPDATE {table} SET claimed_by = ?, claimed_until = ? "
+                "WHERE id IN (SELECT id FROM {table} "
+                "WHERE claimed_until IS NULL OR claimed_until < ? "
+                "ORDER BY id LIMIT ?)".format(table=self.table),
+                (token, claimed_at + lease, claimed_at, batch_size))
+            rows = self.connection.execute(
+                "SELECT id, payload FROM {} WHERE claimed_by = ? "
+                "ORDER BY id".format(self.table), (token, )).fetchall()
+
+        return [
+            OutboxRecord(pk, decode_event(payload), token)
+            for pk, payload in rows
+        ]
+
+    def ack(self, records):
+        return self._execute_for_records(
+            "DELETE FROM {} WHERE claimed_by = ? AND id IN ({})", records)
+
+    def release(self, records):
+        self._execute_for_records(
+            "UPDATE {} SET claimed_by = NULL, claimed_until = NULL "
+            "WHERE claimed_by = ? AND id IN ({})", records)
+
+    def _execute_for_records(self, query, records):
+        count = 0
+        with self._lock, self.connection:
+            for token, ids in group_by_token(records).items():
+                count += self.connection.execute(
+                    query.format(self.table, ", ".join("?" * len(ids))),
+                    [token] + ids).rowcount
+        return count
+
+    def count(self):
+        with self._lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM {}".format(self.table)).fetchone()[0]
+
+
+class DjangoOutboxStore(OutboxStore):
+    """
+    Outbox stored with a Django model, in the transaction of the
+    transitions. The model must define these fields:
+
+    .. code-block::
+
+       class OutboxEvent(models.Model):
+           event_type = models.CharField(max_length=255, null=True)
+           payload = models.TextField()
+           created_at = models.DateTimeField()
+           claimed_by = models.CharField(max_length=32, null=True)
+           claimed_until = models.DateTimeField(null=True, db_index=True)
+
+    Workers claim events with ``select_for_update(skip_locked=True)`` where
+    the database supports it, with a plain ``select_for_update()``
+    otherwise: concurrent workers then wait for each other's claims.
+
+    Attributes:
+        model: the outbox model class
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    def insert(self, events):
+        created_at = now()
+        self.model._default_manager.bulk_create([
+            self.model(
+                event_type=event.get("type"),
+                payload=encode_event(event),
+                created_at=created_at)
+            for event in events
+        ])
+
+    def claim(self, batch_size=100, lease=30.):
+        manager = self.model._default_manager
+        token = uuid.uuid4().hex
+        claimed_at = now()
+        using = router.db_for_write(self.model)
+        skip_locked = \
+            connections[using].features.has_select_for_update_skip_locked
+        with transaction.atomic(using=using):
+            rows = list(
+                manager.select_for_update(skip_locked=skip_locked)
+                .filter(
+                    Q(claimed_until__isnull=True)
+                    | Q(claimed_until__lt=claimed_at))
+                .order_by("pk")
+                .values_list("pk", "payload")[:batch_size])
+            manager.filter(pk__in=[pk for pk, _ in rows]).update(
+                claimed_by=token,
+                claimed_until=claimed_at + datetime.timedelta(seconds=lease))
+
+        return [
+            OutboxRecord(pk, decode_event(payload), token)
+            for pk, payload in rows
+        ]
+
+    def ack(self, records):
+        manager = self.model._default_manager
+        count = 0
+        for token, ids in group_by_token(records).items():
+            count += manager.filter(pk__in=ids, claimed_by=token).delete()[0]
+        return count
+
+    def release(self, records):
+        manager = self.model._default_manager
+        for token, ids in group_by_token(records).items():
+            manager.filter(pk__in=ids, claimed_by=token).update(
+                claimed_by=None, claimed_until=None)
+
+
+class OutboxEventManager(WorkflowEventManager):
+    """
+    Event manager writing events to an outbox instead of publishing them.
+
+    The events of the transitions ran in a workflow transaction, nested
+    ones included, are inserted together at the end of the outermost
+    transition, still in its transaction: events of rolled back transitions
+    are never published, and publishing never holds the transaction open.
+
+    .. code-block::
+
+       class OrderEventManager(OutboxEventManager):
+           outbox_store = DjangoOutboxStore(OutboxEvent)
+           supported_transitions = {...}
+
+    Attributes:
+        outbox_store (OutboxStore): the outbox
+    """
+
+    batch_events = True
+    outbox_store = None
+
+    def _push_event(self, event):
+        self.outbox_store.insert([event])
+
+    def _push_events(self, events):
+        self.outbox_store.insert(events)
+
+
+class OutboxWorker:
+    """
+    Publish the events of an outbox through a sink, by batches.
+
+    Events are deleted from the outbox once the sink published them. If
+    the sink fails, they are released and published again later: delivery
+    is at least once, sinks can deduplicate events with their
+    ``outbox_id`` key. Events whose lease expired before they were
+    published may be claimed and published again by another worker.
+
+    ``run`` logs the errors of the store and waits before trying again,
+    ``poll_interval`` seconds after the first error then twice longer after
+    each consecutive error, up to ``max_backoff`` seconds.
+
+    Attributes:
+        store (OutboxStore): the outbox
+        sink (Sink): the sink publishing events
+        batch_size (int): maximum number of events per batch
+        lease (float): seconds before claimed events that are not
+            acknowledged can be claimed again
+        poll_interval (float): wait in seconds when the outbox is empty
+        max_backoff (float): maximum wait in seconds after errors
+    """
+
+    def __init__(self, store, sink, batch_size=100, lease=30.,
+                 poll_interval=1., max_backoff=60.):
+        self.store = store
+        self.sink = sink
+        self.batch_size = batch_size
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.max_backoff = max_backoff
+
+        self.published = 0
+        self.failed = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def drain_once(self):
+        """
+        Publish one batch of events.
+
+        Returns:
+            int: number of published events
+        """
+        records = self.store.claim(self.batch_size, self.lease)
+        if not records:
+            return 0
+
+        events = [dict(record.event, outbox_id=record.pk) for record in records]
+        try:
+            self.sink.publish(events)
+            self.sink.flush()
+        except Exception:
+            logger.exception("Failed to publish %s outbox events", len(records))
+            self.failed += len(records)
+            self.store.release(records)
+            return 0
+
+        acked = self.store.ack(records)
+        if acked < len(records):
+            logger.warning(
+                "%s outbox events were claimed by another worker before "
+                "their publication was acknowledged", len(records) - acked)
+        self.published += len(records)
+        return len(records)
+
+    def drain(self):
+        """
+        Publish events until the outbox is empty or the sink fails.
+
+        Returns:
+            int: number of published events
+        """
+        total = 0
+        while True:
+            published = self.drain_once()
+            if not published:
+                return total
+            total += published
+
+    def run(self):
+        """
+        Publish events until ``stop`` is called.
+        """
+        self._stop.clear()
+        backoff = 0
+        while not self._stop.is_set():
+            try:
+                published = self.drain_once()
+            except Exception:
+                backoff = min(
+                    backoff * 2 or self.poll_interval, self.max_backoff)
+                logger.exception(
+                    "Outbox worker failed, retrying in %s seconds", backoff)
+                self._stop.wait(backoff)
+                continue
+
+            backoff = 0
+            if not published:
+                self._stop.wait(self.poll_interval)
+        self.sink.close()
+
+    def start(self):
+        """
+        Run the worker in a daemon thread.
+        """
+        self._thread = threading.Thread(
+            target=self.run, name="pieuvre-outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait=True):
+        self._stop.set()
+        if wait and self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def get_store(args):
+    if args.sqlite:
+        store = SQLiteOutboxStore(args.sqlite, table=args.table)
+        store.create_table()
+        return store
+
+    import django
+    from django.apps import apps
+
+    django.setup()
+    return DjangoOutboxStore(apps.get_model(args.django_model))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m pieuvre.outbox",
+        description="Publish the events of a pieuvre outbox.")
+    backend = parser.add_mutually_exclusive_group(required=True)
+    backend.add_argument("--sqlite", help="sqlite database path")
+    backend.add_argument(
+        "--django-model",
+        help="outbox model as app_label.ModelName, with DJANGO_SETTINGS_MODULE")
+    parser.add_argument(
+        "--table", default="pieuvre_outbox", help="sqlite table name")
+    parser.add_argument(
+        "--sink", required=True,
+        help="module:callable returning the sink, called without argument")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--lease", type=float, default=30.)
+    parser.add_argument("--poll-interval", type=float, default=1.)
+    parser.add_argument(
+        "--once", action="store_true",
+        help="exit when the outbox is empty")
+    args = parser.parse_args(argv)
+
+    worker = OutboxWorker(
+        get_store(args), load_object(args.sink)(), batch_size=args.batch_size,
+        lease=args.lease, poll_interval=args.poll_interval)
+
+    if args.once:
+        worker.drain()
+        worker.sink.close()
+        return 0 if not worker.failed else 1
+
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.sink.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
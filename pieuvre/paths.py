@@ -0,0 +1,172 @@
+"""
+paths.py
+=================================================
+Multi-hop transitions along the shortest path to a state.
+"""
+
+from collections import deque
+from contextlib import contextmanager
+
+from .exceptions import TransitionNotFound
+from .unit_of_work import UnitOfWork, _unit_of_work
+
+try:
+    from django.db import transaction
+except ImportError:
+    # Fallback if Django is not installed
+    from .utils import transaction
+
+
+class PathsMixin:
+    """
+    ``Workflow.path_to`` and ``Workflow.advance_to``.
+    """
+
+    @classmethod
+    def _get_next_transitions(cls, source):
+        """
+        Return the first transition of a shortest path from ``source`` to
+        every reachable state, found with a breadth-first search over the
+        transition graph. Results are cached per class and source state.
+
+        Args:
+            source (str): source state
+
+        Returns:
+            dict: first transition to run, by target state
+        """
+        next_transitions = cls._next_transitions.get(source)
+        if next_transitions is not None:
+            return next_transitions
+
+        by_source = cls._transitions_by_source
+        wildcard_transitions = cls._wildcard_transitions
+
+        next_transitions = {}
+        queue = deque()
+        for trans in by_source.get(source, wildcard_transitions):
+            destination = trans["destination"]
+            if destination != source and destination not in next_transitions:
+                next_transitions[destination] = trans
+                queue.append(destination)
+
+        while queue:
+            state = queue.popleft()
+            first = next_transitions[state]
+            for trans in by_source.get(state, wildcard_transitions):
+                destination = trans["destination"]
+                if destination != source \
+                        and destination not in next_transitions:
+                    next_transitions[destination] = first
+                    queue.append(destination)
+
+        cls._next_transitions[source] = next_transitions
+        return next_transitions
+
+    def path_to(self, target_state):
+        """
+        Return the shortest chain of transitions leading from the current
+        state to ``target_state``, without running them.
+
+        Args:
+            target_state (str): state to reach
+
+        Returns:
+            list: transitions to run, in order. Empty if the model is
+                already in ``target_state``.
+
+        Raises:
+            TransitionNotFound
+        """
+        state = self._get_model_state()
+        path = []
+        while state != target_state:
+            trans = self._get_next_transitions(state).get(target_state)
+            if trans is None:
+                raise TransitionNotFound(
+                    current_state=self._get_model_state(),
+                    to_state=target_state)
+            path.append(trans)
+            state = trans["destination"]
+        return path
+
+    def advance_to(self, target_state):
+        """
+        Move the model to ``target_state`` through the shortest chain of
+        transitions (see ``path_to``), in a single transaction.
+
+        The checks and hooks of every transition are run in order, then the
+        model is saved once and the transitions are logged and their events
+        created. If a transition fails, the model is put back in its
+        initial state and the exception is raised.
+
+        Transitions are ran without arguments.
+
+        Args:
+            target_state (str): state to reach
+
+        Returns:
+            list: the transitions ran, with their actual source state
+
+        Raises:
+            TransitionNotFound
+        """
+        if self.lock_manager is None and not self.cas_writes:
+            return self._advance_to(target_state)
+        return self._guarded(self._advance_to, target_state)
+
+    @transaction.atomic
+    def _advance_to(self, target_state):
+        path = self.path_to(target_state)
+        if not path:
+            return []
+
+        if (self.coalesce_saves or self._has_batched_writes()) \
+                and _unit_of_work.get() is None:
+            with UnitOfWork(defer_saves=self.coalesce_saves):
+                return self._advance(path, target_state)
+        return self._advance(path, target_state)
+
+    def _advance(self, path, target_state):
+        done = []
+        with self._restoring_state(target_state):
+            for trans in path:
+                compiled, source = self._check_path_step(trans)
+                self._run_unsaved(compiled, source, (), {})
+                done.append(dict(trans, source=source))
+
+        self._save_model(self._pop_path_changed_fields(done))
+
+        for trans in done:
+            self._log_db(trans)
+            self._count_transition(trans)
+            self.create_events(trans)
+        return done
+
+    def _check_path_step(self, transition):
+        """
+        Return the compiled transition of a step of a path and the current
+        state, checking it is a valid source of the transition.
+
+        Raises:
+            InvalidTransition
+        """
+        compiled = self._compiled_transitions[transition["name"]]
+        source = self._get_model_state()
+        self._pre_transition_check(transition, source)
+        return compiled, source
+
+    @contextmanager
+    def _restoring_state(self, target_state):
+        """
+        Put the model back in its current state if the block fails.
+        """
+        initial_state = self._get_model_state()
+        snapshots = len(self._change_snapshots or ())
+        try:
+            yield
+        except Exception as exc:
+            if self._change_snapshots:
+                del self._change_snapshots[snapshots:]
+            self.rollback(initial_state, target_state, exc)
+            raise
@@ -0,0 +1,408 @@
+"""
+replay.py
+=================================================
+Reconstruction of the model states from the transition log.
+
+Log records are folded through the transitions of the workflow, without
+running any hook, and the reconstructed states are written back by
+batches:
+
+.. code-block::
+
+   python -m pieuvre.replay --workflow myapp.workflows:OrderWorkflow \
+       --log-model orders.TransitionLog --model orders.Order --dry-run
+"""
+
+import argparse
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import groupby, islice
+
+from .analytics import get_model_key, iter_queryset
+from .utils import load_object
+
+try:
+    from django.db import connections
+    from django.db.models.functions import Mod
+except ImportError:
+    # Django is only needed by ``DjangoStateStore`` and ``shard_queryset``
+    connections = Mod = None
+
+
+def get_record_field(record, name):
+    if isinstance(record, dict):
+        return record.get(name)
+    return getattr(record, name)
+
+
+def shard_queryset(queryset, shard, shards, model_field="model_id"):
+    """
+    Filter the log records of the models of a shard: models whose integer
+    key modulo ``shards`` is ``shard``.
+    """
+    return queryset.annotate(
+        pieuvre_shard=Mod(model_field, shards)).filter(pieuvre_shard=shard)
+
+
+class MemoryStateStore:
+    """
+    States of models kept in a dict, by model key.
+
+    Attributes:
+        states (dict): state by model key
+    """
+
+    def __init__(self, states=None):
+        self.states = {} if states is None else states
+
+    def read(self, keys):
+        return {key: self.states[key] for key in keys if key in self.states}
+
+    def write(self, states):
+        self.states.update(states)
+
+
+class DjangoStateStore:
+    """
+    States of Django models, by primary key. States are written with one
+    ``UPDATE`` per distinct state of each batch.
+
+    Attributes:
+        model: the model class
+        state_field_name (str): name of the state field
+    """
+
+    def __init__(self, model, state_field_name="state"):
+        self.model = model
+        self.state_field_name = state_field_name
+
+    def read(self, keys):
+        """
+        Return the current state of models.
+
+        Args:
+            keys (list): primary keys
+
+        Returns:
+            dict: state by primary key
+        """
+        return dict(self.model._default_manager.filter(pk__in=keys).values_list(
+            "pk", self.state_field_name))
+
+    def write(self, states):
+        """
+        Update the state of models.
+
+        Args:
+            states (dict): state by primary key
+        """
+        keys_by_state = {}
+        for key, state in states.items():
+            keys_by_state.setdefault(state, []).append(key)
+
+        manager = self.model._default_manager
+        for state, keys in keys_by_state.items():
+            manager.filter(pk__in=keys).update(
+                **{self.state_field_name: state})
+
+
+class ReplayAnomaly:
+    """
+    A log record that does not match the transitions of the workflow.
+
+    Attributes:
+        model: key of the model
+        transition (str): name of the transition of the record
+        state (str): reconstructed state of the model before the record
+        reason (str): ``unknown transition``, ``invalid source`` or
+            ``destination mismatch``
+    """
+
+    __slots__ = ("model", "transition", "state", "reason")
+
+    def __init__(self, model, transition, state, reason):
+        self.model = model
+        self.transition = transition
+        self.state = state
+        self.reason = reason
+
+    def __repr__(self):
+        return "<ReplayAnomaly {} {} from {}: {}>".format(
+            self.model, self.transition, self.state, self.reason)
+
+
+class ReplayResult:
+    """
+    Outcome of a replay.
+
+    Attributes:
+        records (int): number of log records read
+        models (int): number of models replayed
+        changed (int): number of models whose state differs from the
+            reconstructed one
+        written (int): number of models updated
+        diff (list): ``(model, current, replayed)`` tuple of changed
+            models, up to ``max_report``
+        anomalies (list): ``ReplayAnomaly`` instances, up to ``max_report``
+        anomalies_count (int): total number of anomalies
+    """
+
+    def __init__(self):
+        self.records = 0
+        self.models = 0
+        self.changed = 0
+        self.written = 0
+        self.diff = []
+        self.anomalies = []
+        self.anomalies_count = 0
+
+    def merge(self, other, max_report=None):
+        """
+        Add the outcome of the replay of another shard.
+        """
+        for name in (
+                "records", "models", "changed", "written", "anomalies_count"):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.diff.extend(other.diff)
+        self.anomalies.extend(other.anomalies)
+        if max_report is not None:
+            del self.diff[max_report:]
+            del self.anomalies[max_report:]
+        return self
+
+    def __repr__(self):
+        return "<ReplayResult {} models, {} changed, {} anomalies>".format(
+            self.models, self.changed, self.anomalies_count)
+
+
+class StateReplayer:
+    """
+    Rebuild the states of models from their transition log.
+
+    The records of a model, dicts or objects with the ``transition``,
+    ``from_state``, ``model`` and ``to_state`` keys or attributes of
+    ``pieuvre.analytics.RECORD_FIELDS``, are folded through the transitions
+    of the workflow, starting from the source state of its first record.
+    Records must be ordered by model, then chronologically, as returned by
+    ``iter_queryset(queryset, by_model=True)``. Only the transition table
+    is used, no workflow is created and no hook is called.
+
+    Records whose transition is unknown or invalid from the reconstructed
+    state are skipped and reported as anomalies. A record whose
+    ``to_state`` differs from the destination of its transition is
+    applied and reported: the destination of the transition table wins,
+    unless ``trust_log`` is set. The reconstructed states are compared to the
+    current ones by batches of ``batch_size`` models, and the changed
+    states written, unless ``dry_run`` is set.
+
+    .. code-block::
+
+       replayer = StateReplayer(OrderWorkflow, DjangoStateStore(Order))
+       result = replayer.replay(iter_queryset(
+           TransitionLog.objects.all(), by_model=True))
+
+    Attributes:
+        workflow_class: class extending ``Workflow``
+        store: object with ``read(keys)`` and ``write(states)`` methods,
+            such as ``DjangoStateStore``
+        batch_size (int): number of models compared and written at once
+        dry_run (bool): report the differences without writing them
+        max_report (int): maximum number of differences and anomalies
+            kept in the result
+        trust_log (bool): on a destination mismatch, move the model to the
+            ``to_state`` of the record instead of the destination of the
+            transition
+    """
+
+    def __init__(self, workflow_class, store, batch_size=1000, dry_run=False,
+                 max_report=1000, trust_log=False):
+        self.workflow_class = workflow_class
+        self.store = store
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.max_report = max_report
+        self.trust_log = trust_log
+
+    def fold(self, records, result=None):
+        """
+        Reconstruct the state of each model of the records.
+
+        Args:
+            records (iterable): log records, ordered by model
+            result (ReplayResult): optional: counts records and anomalies
+
+        Yields:
+            tuple: model key and reconstructed state
+        """
+        result = result if result is not None else ReplayResult()
+        workflow_class = self.workflow_class
+        get_transition = workflow_class._get_transition_by_name
+        check_state = workflow_class._check_state
+
+        def get_key(record):
+            return get_model_key(get_record_field(record, "model"))
+
+        for key, model_records in groupby(records, key=get_key):
+            state = None
+            for record in model_records:
+                result.records += 1
+                name = get_record_field(record, "transition")
+                if state is None:
+                    state = get_record_field(record, "from_state")
+
+                transition = get_transition(name)
+                if not transition:
+                    self._report(result, key, name, state, "unknown transition")
+                    continue
+                if not check_state(transition["source"], state):
+                    self._report(result, key, name, state, "invalid source")
+                    continue
+
+                destination = transition["destination"]
+                logged = get_record_field(record, "to_state")
+                if destination != logged:
+                    self._report(
+                        result, key, name, state, "destination mismatch")
+                    if self.trust_log:
+                        destination = logged
+                state = destination
+
+            result.models += 1
+            yield key, state
+
+    def _report(self, result, key, name, state, reason):
+        result.anomalies_count += 1
+        if len(result.anomalies) < self.max_report:
+            result.anomalies.append(ReplayAnomaly(key, name, state, reason))
+
+    def replay(self, records):
+        """
+        Reconstruct the states of the models of the records and write the
+        changed ones.
+
+        Args:
+            records (iterable): log records, ordered by model
+
+        Returns:
+            ReplayResult: the outcome
+        """
+        result = ReplayResult()
+        states = self.fold(records, result)
+        while True:
+            batch = dict(islice(states, self.batch_size))
+            if not batch:
+                return result
+            self._replay_batch(batch, result)
+
+    def _replay_batch(self, batch, result):
+        current = self.store.read(list(batch))
+        changed = {
+            key: state for key, state in batch.items()
+            if current.get(key) != state
+        }
+        result.changed += len(changed)
+        result.diff.extend(
+            (key, current.get(key), state)
+            for key, state in islice(
+                changed.items(), max(0, self.max_report - len(result.diff))))
+
+        if changed and not self.dry_run:
+            self.store.write(changed)
+            result.written += len(changed)
+
+    def replay_sharded(self, get_records, shards, max_workers=None):
+        """
+        Replay shards of the models in parallel threads, each shard reading
+        its own records. The database connections of a thread are closed
+        once its shard is replayed.
+
+        Args:
+            get_records (callable): called with the shard index and
+                ``shards``, returns the records of the models of the shard,
+                ordered by model, see ``shard_queryset``
+            shards (int): number of shards
+            max_workers (int): number of threads, ``shards`` by default
+
+        Returns:
+            ReplayResult: the outcome of all the shards
+        """
+        def replay_shard(shard):
+            try:
+                return self.replay(get_records(shard, shards))
+            finally:
+                if connections is not None:
+                    connections.close_all()
+
+        result = ReplayResult()
+        with ThreadPoolExecutor(max_workers=max_workers or shards) as executor:
+            for shard_result in executor.map(replay_shard, range(shards)):
+                result.merge(shard_result, self.max_report)
+        return result
+
+
+def get_shard_records(log_queryset, args, shard, shards):
+    return iter_queryset(
+        shard_queryset(log_queryset, shard, shards, args.model_field),
+        timestamp_field=args.timestamp_field, model_field=args.model_field,
+        chunk_size=args.batch_size, by_model=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m pieuvre.replay",
+        description="Rebuild model states from the transition log.")
+    parser.add_argument(
+        "--workflow", required=True, help="workflow class as module:Class")
+    parser.add_argument(
+        "--log-model", required=True,
+        help="log model as app_label.ModelName, with DJANGO_SETTINGS_MODULE")
+    parser.add_argument(
+        "--model", required=True, help="model as app_label.ModelName")
+    parser.add_argument("--timestamp-field", default="created")
+    parser.add_argument("--model-field", default="model_id")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument(
+        "--shards", type=int, default=1,
+        help="number of shards replayed in parallel")
+    parser.add_argument(
+        "--dry-run", action="store_true",
+        help="print the differences without writing them")
+    parser.add_argument(
+        "--trust-log", action="store_true",
+        help="use the logged state when it differs from the transition")
+    args = parser.parse_args(argv)
+
+    import django
+    from django.apps import apps
+
+    django.setup()
+    workflow_class = load_object(args.workflow)
+    log_queryset = apps.get_model(args.log_model)._default_manager.all()
+    replayer = StateReplayer(
+        workflow_class,
+        DjangoStateStore(
+            apps.get_model(args.model), workflow_class.state_field_name),
+        batch_size=args.batch_size, dry_run=args.dry_run,
+        trust_log=args.trust_log)
+
+    if args.shards > 1:
+        result = replayer.replay_sharded(
+            partial(get_shard_records, log_queryset, args), args.shards)
+    else:
+        result = replayer.replay(iter_queryset(
+            log_queryset, timestamp_field=args.timestamp_field,
+            model_field=args.model_field, chunk_size=args.batch_size,
+            by_model=True))
+
+    for key, current, state in result.diff:
+        print("{}\t{}\t{}".format(key, current, state))
+    for anomaly in result.anomalies:
+        print(repr(anomaly), file=sys.stderr)
+    print(repr(result), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+"""
+shared.py
+=================================================
+Workflows shared by all the models of a class.
+"""
+
+import inspect
+import threading
+
+from contextlib import contextmanager
+from functools import partial
+from types import MethodType
+
+from .utils import context_var
+
+
+# Guards the creation of the shared workflows
+_shared_lock = threading.Lock()
+
+
+class SharedWorkflowMixin:
+    """
+    ``Workflow.shared``.
+    """
+
+    @classmethod
+    def shared(cls):
+        """
+        Return the workflow of the class shared by all the models, created
+        on first use.
+
+        The shared workflow is immutable and holds no model: it operates on
+        the model bound to the current context (thread or asyncio task),
+        with ``bind`` or through a ``BoundWorkflow``:
+
+        .. code-block::
+
+           workflow = OrderWorkflow.shared()
+           with workflow.bind(order):
+               workflow.submit()
+
+           BoundWorkflow(workflow, order).submit()
+
+        Hooks must not set attributes on the workflow, state specific to a
+        transition belongs to the model.
+
+        Returns:
+            Workflow: the shared workflow
+        """
+        shared = cls.__dict__.get("_shared_workflow")
+        if shared is not None:
+            return shared
+
+        with _shared_lock:
+            shared = cls.__dict__.get("_shared_workflow")
+            if shared is None:
+                shared_class = type(cls)(cls.__name__, (SharedWorkflow, cls), {
+                    "__module__": cls.__module__,
+                    "__qualname__": cls.__qualname__,
+                })
+                shared = object.__new__(shared_class)
+                shared.__dict__["_binding"] = context_var(
+                    "pieuvre_{}".format(cls.__qualname__), default=None)
+                type.__setattr__(shared_class, "_shared_workflow", shared)
+                type.__setattr__(cls, "_shared_workflow", shared)
+        return shared
+
+
+class ModelBinding:
+    """
+    Model a shared workflow operates on, with the state of its transitions.
+    """
+
+    __slots__ = ("model", "event_managers", "change_snapshots")
+
+    def __init__(self, model):
+        self.model = model
+        self.event_managers = None
+        self.change_snapshots = None
+
+
+class SharedWorkflow:
+    """
+    Base of the shared workflow classes created by ``Workflow.shared``.
+    The model, the event managers and the change snapshots are read from
+    the model binding of the current context instead of the instance.
+    """
+
+    def __setattr__(self, name, value):
+        if not isinstance(getattr(type(self), name, None), property):
+            raise AttributeError(
+                "Cannot set {} on a shared workflow".format(name))
+        super().__setattr__(name, value)
+
+    def _get_binding(self):
+        binding = self._binding.get()
+        if binding is None:
+            raise AttributeError(
+                "No model is bound to the shared {}".format(
+                    type(self).__name__))
+        return binding
+
+    @property
+    def model(self):
+        return self._get_binding().model
+
+    @property
+    def event_managers(self):
+        binding = self._get_binding()
+        if binding.event_managers is None:
+            binding.event_managers = [
+                klass(binding.model)
+                for klass in self._get_event_manager_classes()]
+        return binding.event_managers
+
+    @property
+    def _change_snapshots(self):
+        return self._get_binding().change_snapshots
+
+    @_change_snapshots.setter
+    def _change_snapshots(self, value):
+        self._get_binding().change_snapshots = value
+
+    def _bind(self, model):
+        return self._binding.set(ModelBinding(model))
+
+    def _unbind(self, token):
+        self._binding.reset(token)
+
+    @contextmanager
+    def bind(self, model):
+        """
+        Bind a model to the workflow in the current context.
+
+        Args:
+            model: the model to operate on
+        """
+        token = self._bind(model)
+        try:
+            yield self
+        finally:
+            self._unbind(token)
+
+
+class BoundWorkflow:
+    """
+    Proxy running a shared workflow on a model. Attributes are read from the
+    workflow with the model bound, and methods bind it when called:
+
+    .. code-block::
+
+       workflow = BoundWorkflow(OrderWorkflow.shared(), order)
+       workflow.submit()
+
+    The proxy only holds two references: it is cheap to keep one per model.
+    Methods are cached on first access.
+
+    Attributes:
+        workflow (Workflow): the shared workflow
+        model: the model
+    """
+
+    __slots__ = ("workflow", "model", "_callables")
+
+    def __init__(self, workflow, model):
+        self.workflow = workflow
+        self.model = model
+        self._callables = None
+
+    def __getattr__(self, name):
+        callables = self._callables
+        if callables is not None and name in callables:
+            return callables[name]
+
+        workflow = self.workflow
+        token = workflow._bind(self.model)
+        try:
+            value = getattr(workflow, name)
+        finally:
+            workflow._unbind(token)
+
+        if not isinstance(value, (MethodType, partial)):
+            return value
+
+        func = partial(self._call, value)
+        if callables is None:
+            callables = self._callables = {}
+        callables[name] = func
+        return func
+
+    def _call(self, func, *args, **kwargs):
+        workflow = self.workflow
+        token = workflow._bind(self.model)
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            workflow._unbind(token)
+
+        if isinstance(result, (MethodType, partial)):
+            # e.g. ``get_transition``
+            return partial(self._call, result)
+        if inspect.isawaitable(result):
+            return self._await(result)
+        return result
+
+    async def _await(self, awaitable):
+        # Coroutines run after ``_call`` returns: bind the model again
+        workflow = self.workflow
+        token = workflow._bind(self.model)
+        try:
+            return await awaitable
+        finally:
+            workflow._unbind(token)
+
+    def __repr__(self):
+        return "<BoundWorkflow {} {!r}>".format(
+            type(self.workflow).__name__, self.model)
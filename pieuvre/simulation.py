@@ -0,0 +1,295 @@
+"""
+simulation.py
+=================================================
+Monte Carlo simulation of instances flowing through a workflow.
+
+Requires NumPy. Synthetic instances follow the transitions of a workflow
+class with given probabilities and delays, without models, saves or hooks:
+
+.. code-block::
+
+   simulator = WorkflowSimulator(
+       OrderWorkflow,
+       probabilities={"submit": 1, "pay": 0.7, "abandon": 0.3},
+       delays={"submit": exponential(2.), "pay": uniform(1., 5.)})
+   result = simulator.run(100000, "draft", horizon=48, runs=10)
+   result.expected_queue_sizes()["submitted"]
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    # NumPy is only needed to run simulations
+    np = None
+
+
+def constant(value):
+    """
+    Delay distribution always returning ``value``.
+    """
+    def sample(_rng, size):
+        return np.full(size, float(value))
+    return sample
+
+
+def exponential(mean):
+    """
+    Exponential delay distribution of mean ``mean``.
+    """
+    def sample(rng, size):
+        return rng.exponential(mean, size)
+    return sample
+
+
+def uniform(low, high):
+    """
+    Delay distribution uniform between ``low`` and ``high``.
+    """
+    def sample(rng, size):
+        return rng.uniform(low, high, size)
+    return sample
+
+
+def lognormal(mean, sigma):
+    """
+    Log-normal delay distribution, ``mean`` and ``sigma`` being the
+    parameters of the underlying normal distribution.
+    """
+    def sample(rng, size):
+        return rng.lognormal(mean, sigma, size)
+    return sample
+
+
+class SimulationResult:
+    """
+    Outcome of ``WorkflowSimulator.run``.
+
+    Attributes:
+        states (list): state names, indexed by their integer code
+        times (numpy.ndarray): time of each step
+        queue_sizes (numpy.ndarray): mean number of instances in each state
+            at each step, over the runs, of shape ``(steps, states)``
+        transition_counts (dict): mean number of each transition per run
+        runs (int): number of runs
+    """
+
+    def __init__(self, states, times, queue_sizes, transition_counts, runs):
+        self.states = states
+        self.times = times
+        self.queue_sizes = queue_sizes
+        self.transition_counts = transition_counts
+        self.runs = runs
+
+    def expected_queue_sizes(self):
+        """
+        Return the mean number of instances in each state over time.
+
+        Returns:
+            dict: array of queue sizes per step, by state
+        """
+        return {
+            state: self.queue_sizes[:, index]
+            for index, state in enumerate(self.states)
+        }
+
+    def final_distribution(self):
+        """
+        Return the mean number of instances per state at the horizon.
+        """
+        return {
+            state: float(self.queue_sizes[-1, index])
+            for index, state in enumerate(self.states)
+        }
+
+    def __repr__(self):
+        return "<SimulationResult {} steps, {} runs>".format(
+            len(self.times), self.runs)
+
+
+class WorkflowSimulator:
+    """
+    Simulate cohorts of instances following the transitions of a workflow
+    class.
+
+    States are encoded as integers and the instances of a cohort are
+    stepped together with NumPy arrays. An instance entering a state draws
+    its next transition among the transitions available from that state,
+    weighted by ``probabilities``, and the delay before it from the
+    distribution of that transition. States without a weighted transition
+    are final.
+
+    Attributes:
+        workflow_class: class extending ``Workflow``
+        probabilities (dict): weight of each transition, by name; weights
+            are normalized per source state, transitions without weight
+            are never taken. Weights must not be negative.
+        delays (dict): delay distribution of each transition, by name: a
+            number, or a callable taking a ``numpy.random.Generator`` and a
+            size and returning an array of delays. Transitions without
+            delay take ``default_delay``.
+        default_delay (float): delay of transitions missing from ``delays``
+    """
+
+    # Maximum number of transitions of an instance within a step
+    max_cascade = 1000
+
+    def __init__(self, workflow_class, probabilities, delays=None,
+                 default_delay=1.):
+        if np is None:
+            raise ImportError("Simulations require NumPy")
+
+        self.workflow_class = workflow_class
+        self.probabilities = probabilities
+        self.delays = delays or {}
+        self.default_delay = default_delay
+        self._compile()
+
+    def _compile(self):
+        """
+        Encode the transition graph as arrays: for each source state, the
+        cumulative probabilities of its transitions, their destination and
+        their index.
+        """
+        transitions_by_source = self.workflow_class._transitions_by_source
+        self.states = list(transitions_by_source)
+        codes = {state: code for code, state in enumerate(self.states)}
+
+        self.transition_names = []
+        for name, weight in self.probabilities.items():
+            if weight < 0:
+                raise ValueError(
+                    "Negative weight {} of transition {}".format(weight, name))
+
+        rows = []
+        for state in self.states:
+            row = [
+                (self.probabilities[trans["name"]], trans)
+                for trans in transitions_by_source[state]
+                if self.probabilities.get(trans["name"])
+            ]
+            rows.append(row)
+            for _, trans in row:
+                if trans["name"] not in self.transition_names:
+                    self.transition_names.append(trans["name"])
+
+        width = max([len(row) for row in rows] + [1])
+        shape = (len(self.states), width)
+        self._cumulative = np.ones(shape)
+        self._destinations = np.zeros(shape, dtype=np.int32)
+        self._transitions = np.full(shape, -1, dtype=np.int32)
+        self._final = np.ones(len(self.states), dtype=bool)
+
+        for code, row in enumerate(rows):
+            if not row:
+                continue
+            self._final[code] = False
+            weights = np.array([weight for weight, _ in row], dtype=float)
+            self._cumulative[code, :len(row)] = np.cumsum(weights / weights.sum())
+            self._cumulative[code, len(row) - 1] = 1.
+            for index, (_, trans) in enumerate(row):
+                self._destinations[code, index] = codes[trans["destination"]]
+                self._transitions[code, index] = self.transition_names.index(
+                    trans["name"])
+
+        self._samplers = []
+        for name in self.transition_names:
+            delay = self.delays.get(name, self.default_delay)
+            self._samplers.append(delay if callable(delay) else constant(delay))
+
+    def _schedule(self, rng, states, start):
+        """
+        Draw the next transition of instances entering ``states`` at time
+        ``start``.
+
+        Returns:
+            tuple: arrays of the transition index (-1 for final states),
+                the destination and the time of the transition
+        """
+        size = len(states)
+        draws = rng.random(size)
+        choice = (draws[:, None] > self._cumulative[states]).sum(axis=1)
+        choice = np.minimum(choice, self._cumulative.shape[1] - 1)
+
+        transitions = self._transitions[states, choice]
+        destinations = self._destinations[states, choice]
+        times = np.full(size, np.inf)
+        for index, sample in enumerate(self._samplers):
+            selected = transitions == index
+            count = int(selected.sum())
+            if count:
+                times[selected] = start[selected] + np.maximum(
+                    sample(rng, count), 0)
+
+        final = self._final[states]
+        transitions[final] = -1
+        times[final] = np.inf
+        return transitions, destinations, times
+
+    def run(self, size, initial_state, horizon, time_step=1., runs=1,
+            arrival_rate=0., seed=None):
+        """
+        Simulate instances from ``initial_state`` until ``horizon``.
+
+        Args:
+            size (int): number of instances at time 0
+            initial_state (str): state of the new instances
+            horizon (float): end of the simulation
+            time_step (float): interval between two measures of the queue
+                sizes
+            runs (int): number of independent runs averaged
+            arrival_rate (float): mean number of new instances per time
+                step, drawn from a Poisson distribution
+            seed (int): seed of the random generator
+
+        Returns:
+            SimulationResult: the expected queue sizes
+        """
+        if initial_state not in self.states:
+            raise ValueError("Unknown state {}".format(initial_state))
+
+        rng = np.random.default_rng(seed)
+        times = np.arange(0., horizon + time_step / 2, time_step)
+        queue_sizes = np.zeros((len(times), len(self.states)))
+        transition_counts = np.zeros(len(self.transition_names))
+
+        for _ in range(runs):
+            self._run_once(
+                rng, size, self.states.index(initial_state), times,
+                arrival_rate, queue_sizes, transition_counts)
+
+        return SimulationResult(
+            list(self.states), times, queue_sizes / runs,
+            dict(zip(self.transition_names, transition_counts / runs)), runs)
+
+    def _run_once(self, rng, size, initial, times, arrival_rate,
+                  queue_sizes, transition_counts):
+        arrivals = rng.poisson(arrival_rate, len(times) - 1) \
+            if arrival_rate else np.zeros(len(times) - 1, dtype=int)
+        # Arrival time of each instance, uniform within its step
+        born = np.concatenate([
+            np.zeros(size),
+            np.repeat(times[:-1], arrivals) + rng.random(int(arrivals.sum()))
+            * (times[1] - times[0] if len(times) > 1 else 0),
+        ])
+
+        states = np.full(len(born), initial, dtype=np.int32)
+        transitions, destinations, next_times = self._schedule(
+            rng, states, born)
+
+        for step, now in enumerate(times):
+            # Instances may go through several transitions within a step
+            for _ in range(self.max_cascade):
+                due = np.flatnonzero(next_times <= now)
+                if not len(due):
+                    break
+                np.add.at(transition_counts, transitions[due], 1)
+                states[due] = destinations[due]
+                transitions[due], destinations[due], next_times[due] = \
+                    self._schedule(rng, states[due], next_times[due])
+            else:
+                raise ValueError(
+                    "More than {} transitions in a step, transitions without "
+                    "delay may form a loop".format(self.max_cascade))
+
+            queue_sizes[step] += np.bincount(
+                states[born <= now], minlength=len(self.states))
@@ -0,0 +1,375 @@
+"""
+sinks.py
+=================================================
+Destinations of the published workflow events.
+"""
+
+import abc
+import json
+import struct
+import threading
+
+from functools import partial
+
+from .events import WorkflowEventManager
+from .utils import call_at_exit
+
+try:
+    from django.db import transaction
+except ImportError:
+    # Fallback if Django is not installed
+    from .utils import transaction
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Header of the records of ``LengthPrefixedFileSink``: payload size as an
+# unsigned 32 bits big endian integer
+LENGTH_PREFIX = struct.Struct(">I")
+
+
+class JSONEncoder:
+    """
+    Encode events as compact JSON with the standard library. Values that
+    are not serializable are converted with ``str``.
+    """
+
+    name = "json"
+
+    # Output is UTF-8 text without line breaks
+    text = True
+
+    def encode(self, event):
+        return json.dumps(
+            event, default=str, separators=(",", ":")).encode("utf-8")
+
+    def decode(self, payload):
+        return json.loads(payload.decode("utf-8"))
+
+
+class OrjsonEncoder(JSONEncoder):
+    """
+    Encode events as JSON with ``orjson``.
+    """
+
+    name = "orjson"
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("orjson is not installed")
+
+    def encode(self, event):
+        return orjson.dumps(event, default=str)
+
+    def decode(self, payload):
+        return orjson.loads(payload)
+
+
+class MsgpackEncoder:
+    """
+    Encode events with ``msgpack``.
+    """
+
+    name = "msgpack"
+    text = False
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError("msgpack is not installed")
+
+    def encode(self, event):
+        return msgpack.packb(event, default=str, use_bin_type=True)
+
+    def decode(self, payload):
+        return msgpack.unpackb(payload, raw=False)
+
+
+ENCODERS = {
+    encoder.name: encoder
+    for encoder in (JSONEncoder, OrjsonEncoder, MsgpackEncoder)
+}
+
+
+def get_encoder(name=None):
+    """
+    Return an encoder by name: ``json``, ``orjson`` or ``msgpack``. By
+    default, ``orjson`` if it is installed, ``json`` otherwise.
+
+    Raises:
+        ImportError: if the library of the encoder is not installed
+    """
+    if name is None:
+        name = "json" if orjson is None else "orjson"
+    return ENCODERS[name]()
+
+
+class Sink(abc.ABC):
+    """
+    Base class of the event sinks, used by the outbox worker to publish
+    events.
+    """
+
+    @abc.abstractmethod
+    def publish(self, events):
+        """
+        Publish a batch of events.
+
+        Args:
+            events (list): event dicts
+        """
+        pass
+
+    def flush(self):
+        """
+        Make sure published events are delivered.
+        """
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class BatchingSink(Sink):
+    """
+    Base class of sinks encoding events and writing them by batches.
+
+    Published events are encoded and buffered, then written when the buffer
+    holds ``max_events`` events or ``max_bytes`` bytes, ``max_delay``
+    seconds after the first buffered event, or when ``flush`` is called.
+    Sinks still alive at exit are closed, writing the buffered events.
+    Subclasses implement ``write``.
+
+    Attributes:
+        encoder: object with ``encode(event)`` returning bytes, see
+            ``get_encoder``
+        max_events (int): maximum number of buffered events
+        max_bytes (int): maximum size of the buffered events
+        max_delay (float): maximum buffering duration in seconds, None to
+            only flush by size
+    """
+
+    def __init__(self, encoder=None, max_events=1000, max_bytes=1 << 20,
+                 max_delay=1.):
+        self.encoder = encoder or get_encoder()
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+
+        self._buffer = []
+        self._size = 0
+        self._timer = None
+        self._lock = threading.RLock()
+
+        self.batches = 0
+        self.written = 0
+
+        call_at_exit(self, "close")
+
+    def publish(self, events):
+        encode = self.encoder.encode
+        payloads = [encode(event) for event in events]
+        with self._lock:
+            self._buffer.extend(payloads)
+            self._size += sum(len(payload) for payload in payloads)
+            if len(self._buffer) >= self.max_events \
+                    or self._size >= self.max_bytes:
+                self.flush()
+            elif self._timer is None and self._buffer \
+                    and self.max_delay is not None:
+                self._timer = threading.Timer(self.max_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._buffer:
+                return
+
+            payloads, self._buffer, self._size = self._buffer, [], 0
+            self.write(payloads)
+            self.batches += 1
+            self.written += len(payloads)
+
+    @abc.abstractmethod
+    def write(self, payloads):
+        """
+        Write a batch of encoded events.
+
+        Args:
+            payloads (list): encoded events, as bytes
+        """
+        pass
+
+
+class JSONLinesFileSink(BatchingSink):
+    """
+    Append events to a file, one JSON document per line.
+
+    Attributes:
+        path (str): file path
+    """
+
+    def __init__(self, path, encoder=None, **kwargs):
+        super().__init__(encoder=encoder, **kwargs)
+        if not getattr(self.encoder, "text", False):
+            raise ValueError("JSON lines require a JSON encoder")
+        self.path = path
+        self._file = open(path, "ab")
+
+    def write(self, payloads):
+        payloads.append(b"")
+        self._file.write(b"\n".join(payloads))
+        self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            self.flush()
+            self._file.close()
+
+
+class LengthPrefixedFileSink(BatchingSink):
+    """
+    Append events to a binary file, each encoded event prefixed by its size
+    as a 4 bytes big endian integer. Read them back with
+    ``read_length_prefixed``.
+
+    Attributes:
+        path (str): file path
+    """
+
+    def __init__(self, path, encoder=None, **kwargs):
+        super().__init__(encoder=encoder, **kwargs)
+        self.path = path
+        self._file = open(path, "ab")
+
+    def write(self, payloads):
+        pack = LENGTH_PREFIX.pack
+        self._file.write(b"".join(
+            pack(len(payload)) + payload for payload in payloads))
+        self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            self.flush()
+            self._file.close()
+
+
+def read_length_prefixed(path, encoder=None):
+    """
+    Iterate over the events of a file written by ``LengthPrefixedFileSink``.
+
+    Args:
+        path (str): file path
+        encoder: encoder of the events, see ``get_encoder``
+
+    Yields:
+        dict: the events
+    """
+    encoder = encoder or get_encoder()
+    with open(path, "rb") as events_file:
+        while True:
+            header = events_file.read(LENGTH_PREFIX.size)
+            if len(header) < LENGTH_PREFIX.size:
+                return
+            size, = LENGTH_PREFIX.unpack(header)
+            yield encoder.decode(events_file.read(size))
+
+
+class MemoryBatchSink(BatchingSink):
+    """
+    Keep the written batches of encoded events in the ``payloads`` list, in
+    process.
+    """
+
+    def __init__(self, encoder=None, **kwargs):
+        super().__init__(encoder=encoder, **kwargs)
+        self.payloads = []
+
+    def write(self, payloads):
+        self.payloads.append(payloads)
+
+    def get_events(self):
+        """
+        Return the written events, decoded.
+        """
+        return [
+            self.encoder.decode(payload)
+            for batch in self.payloads for payload in batch
+        ]
+
+
+class MemorySink(Sink):
+    """
+    Keep published events in the ``events`` list, in process.
+    """
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def publish(self, events):
+        with self._lock:
+            self.events.extend(events)
+
+    def clear(self):
+        with self._lock:
+            self.events = []
+
+
+class CallbackSink(Sink):
+    """
+    Hand published events to a function, in process.
+
+    Attributes:
+        callback (callable): called with each batch of events
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def publish(self, events):
+        self.callback(events)
+
+
+class SinkEventManager(WorkflowEventManager):
+    """
+    Event manager publishing events through a sink, once the transaction
+    of the transition is committed.
+
+    Events are pushed by batches: the events of the transitions ran in a
+    workflow transaction, nested ones included, and those of a
+    ``push_events`` call are handed to the sink together. With a
+    ``BatchingSink``, they are then written by larger batches.
+
+    .. code-block::
+
+       class OrderEventManager(SinkEventManager):
+           sink = JSONLinesFileSink("events.jsonl", max_delay=0.5)
+           supported_transitions = {...}
+
+    Attributes:
+        sink (Sink): the sink
+    """
+
+    batch_events = True
+    sink = None
+
+    def _push_event(self, event):
+        self._push_events([event])
+
+    def _push_events(self, events):
+        transaction.on_commit(partial(self.sink.publish, events))
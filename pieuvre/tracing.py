@@ -0,0 +1,174 @@
+"""
+tracing.py
+=================================================
+Structured tracing of the transitions.
+"""
+
+import json
+import sys
+import threading
+import time
+import uuid
+
+from .utils import context_var
+
+
+class Span:
+    """
+    A timed operation, with structured attributes. Spans started while
+    another one is active in the same context are its children.
+
+    Attributes:
+        name (str): operation name
+        attributes (dict): structured attributes
+        trace_id (str): identifier shared by a root span and its descendants
+        span_id (str): identifier of the span
+        parent (Span): parent span, or None
+        depth (int): nesting level, 0 for root spans
+        start (float): start time, as ``time.time``
+        duration (float): duration in seconds, set when the span ends
+        error (str): exception raised during the span, if any
+    """
+
+    def __init__(self, tracer, name, attributes, parent):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.span_id = uuid.uuid4().hex[:16]
+        if parent is None:
+            self.trace_id = uuid.uuid4().hex
+            self.depth = 0
+        else:
+            self.trace_id = parent.trace_id
+            self.depth = parent.depth + 1
+        self.start = time.time()
+        self.duration = None
+        self.error = None
+
+        self._start = time.monotonic()
+        self._token = None
+
+    def record_exception(self, exc):
+        self.error = "{}: {}".format(type(exc).__name__, exc)
+
+    def end(self):
+        self.duration = time.monotonic() - self._start
+        self.tracer._end(self)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent else None,
+            "start": self.start,
+            "duration": self.duration,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc is not None:
+            self.record_exception(exc)
+        self.end()
+
+
+class Tracer:
+    """
+    Create spans and hand them to an exporter when they end. Set an
+    instance as ``tracer`` of a workflow to trace its transitions:
+
+    .. code-block::
+
+       class OrderWorkflow(Workflow):
+           tracer = Tracer(ConsoleSpanExporter())
+
+    Transitions then emit a ``transition`` span, with the stages of the
+    transition as children: ``check``, ``before``, ``exit_hooks``,
+    ``body``, ``enter_hooks``, ``after``, ``save``, ``log`` and ``events``.
+    Nothing is traced on workflows without tracer.
+
+    Attributes:
+        exporter: object with an ``export(span)`` method
+    """
+
+    def __init__(self, exporter):
+        self.exporter = exporter
+        self._current = context_var("pieuvre_span", default=None)
+
+    def start_span(self, name, attributes=None):
+        """
+        Start a span, child of the current span. It becomes the current span
+        until it ends.
+
+        Args:
+            name (str): operation name
+            attributes (dict): structured attributes
+
+        Returns:
+            Span: the started span, also usable as a context manager
+        """
+        span = Span(self, name, attributes or {}, self._current.get())
+        span._token = self._current.set(span)
+        return span
+
+    def get_current_span(self):
+        return self._current.get()
+
+    def _end(self, span):
+        self._current.reset(span._token)
+        self.exporter.export(span)
+
+
+class InMemorySpanExporter:
+    """
+    Keep ended spans in the ``spans`` list, for tests.
+    """
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+    def clear(self):
+        self.spans = []
+
+
+class ConsoleSpanExporter:
+    """
+    Write a line per ended span to a stream, indented by nesting level.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stderr
+
+    def export(self, span):
+        attributes = " ".join(
+            "{}={}".format(key, value)
+            for key, value in sorted(span.attributes.items()))
+        line = "{}{} {:.3f}ms {}".format(
+            "  " * span.depth, span.name, span.duration * 1000, attributes)
+        if span.error:
+            line += " error={}".format(span.error)
+        self.stream.write(line.rstrip() + "\n")
+
+
+class FileSpanExporter:
+    """
+    Append ended spans to a file, as JSON lines.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), default=str, sort_keys=True)
+        with self._lock:
+            with open(self.path, "a") as output:
+                output.write(line + "\n")
@@ -0,0 +1,110 @@
+"""
+unit_of_work.py
+=================================================
+Writes of nested transitions deferred to the end of the outermost one.
+"""
+
+from .utils import context_var
+
+
+# Unit of work of the outermost transition of the current context
+_unit_of_work = context_var("pieuvre_unit_of_work", default=None)
+
+
+class UnitOfWork:
+    """
+    Writes deferred until the end of the outermost transition, when
+    ``Workflow.coalesce_saves`` is enabled, the ``db_logging_class`` has
+    ``batch_logs`` or an event manager has ``batch_events``. The unit is
+    flushed in the transaction of the outermost transition, before it is
+    committed.
+
+    Saves are merged per model, in the order models were first saved, the
+    saved fields being the union of the fields of each save. Logs are
+    written afterwards, in order per logging class, with a single ``bulk_log`` call per
+    logging class which has one. Events are then pushed with a single
+    ``_push_events`` call per event manager class.
+
+    Attributes:
+        defer_saves (bool): defer saves and logs, otherwise only events are
+            deferred
+    """
+
+    def __init__(self, defer_saves=True):
+        self.defer_saves = defer_saves
+        self.operations = []
+        self._token = None
+
+    def __enter__(self):
+        self._token = _unit_of_work.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        _unit_of_work.reset(self._token)
+        if exc_type is None:
+            self.flush()
+
+    def save(self, model, update_fields=None):
+        self.operations.append(("save", model, update_fields))
+
+    def defers_log(self, log_class):
+        """
+        Return True if the logs of ``log_class`` are deferred to the end of
+        the unit: when saves are deferred, or the class has ``batch_logs``.
+        """
+        return self.defer_saves or getattr(log_class, "batch_logs", False)
+
+    def log(self, log_class, record):
+        self.operations.append(("log", log_class, record))
+
+    def push_event(self, manager, event):
+        self.operations.append(("event", manager, event))
+
+    def mark(self):
+        return len(self.operations)
+
+    def rollback(self, mark):
+        """
+        Forget the operations recorded since ``mark``.
+        """
+        del self.operations[mark:]
+
+    def flush(self):
+        saves = {}
+        logs = {}
+        events = {}
+        for kind, target, value in self.operations:
+            if kind == "log":
+                logs.setdefault(id(target), (target, []))[1].append(value)
+                continue
+            if kind == "event":
+                events.setdefault(type(target), (target, []))[1].append(value)
+                continue
+
+            key = id(target)
+            if key in saves:
+                fields = saves[key][1]
+                if fields is None or value is None:
+                    value = None
+                else:
+                    value = fields + [
+                        field for field in value if field not in fields]
+            saves[key] = (target, value)
+
+        self.operations = []
+        for model, update_fields in saves.values():
+            if update_fields is None:
+                model.save()
+            else:
+                model.save(update_fields=update_fields)
+
+        for log_class, records in logs.values():
+            bulk_log = getattr(log_class, "bulk_log", None)
+            if bulk_log is not None:
+                bulk_log(records)
+                continue
+            for record in records:
+                log_class.log(**record)
+
+        for manager, batch in events.values():
+            manager._push_events(batch)
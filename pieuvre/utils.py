@@ -5,14 +5,41 @@ Utils.
 """
 
 
+import atexit
+import copy
 import datetime
+import decimal
 import functools
+import importlib
+import threading
+import uuid
+import weakref
+
+try:
+    from contextvars import ContextVar
+except ImportError:
+    # Python < 3.7: values are stored per thread
+    ContextVar = None
 
 now = datetime.datetime.now
 
+# Field values that cannot be modified in place
+IMMUTABLE_TYPES = (
+    str, bytes, int, float, bool, type(None), decimal.Decimal, uuid.UUID,
+    datetime.date, datetime.time, datetime.timedelta,
+)
+
+# Objects whose method is called at exit, see ``call_at_exit``
+_exit_calls = weakref.WeakKeyDictionary()
+_exit_lock = threading.Lock()
+
 
 class ContextDecorator(object):
-    def __call__(self, f):
+    def __call__(self, f=None):
+        if f is None:
+            # Used as ``with transaction.atomic():``
+            return self
+
         @functools.wraps(f)
         def decorated(*args, **kwargs):
             with self:
@@ -27,12 +54,155 @@ class ContextDecorator(object):
         pass
 
 
+class Atomic(ContextDecorator):
+    """
+    Replacement for Django ``transaction.atomic`` if Django is not
+    installed. There is no database transaction, however blocks are
+    tracked per thread so that ``on_commit`` callbacks run when the
+    outermost block exits without error, and are discarded when a block
+    raises.
+    """
+
+    _local = threading.local()
+
+    @classmethod
+    def get_callbacks_stack(cls):
+        if not hasattr(cls._local, "stack"):
+            cls._local.stack = []
+        return cls._local.stack
+
+    def __enter__(self):
+        self.get_callbacks_stack().append([])
+        return self
+
+    def __exit__(self, exc_type, *args):
+        stack = self.get_callbacks_stack()
+        callbacks = stack.pop()
+        if exc_type is not None:
+            return
+
+        if stack:
+            stack[-1].extend(callbacks)
+            return
+
+        for func in callbacks:
+            func()
+
+
+def on_commit(func):
+    """
+    Replacement for Django ``transaction.on_commit`` if Django is not
+    installed: ``func`` is called when the outermost ``atomic`` block
+    exits, or immediately outside of any block.
+    """
+    stack = Atomic.get_callbacks_stack()
+    if stack:
+        stack[-1].append(func)
+    else:
+        func()
+
+
 class transaction:
     """
-    No-op replacement for Django transaction if Django is not installed.
+    Replacement for Django transaction if Django is not installed.
+    """
+
+    atomic = Atomic()
+    on_commit = staticmethod(on_commit)
+
+
+class LocalVar:
+    """
+    Minimal ``ContextVar`` replacement storing its value per thread. The
+    asyncio tasks of a thread share the value: it only isolates threads.
+    """
+
+    def __init__(self, name, default=None):
+        self.default = default
+        self._local = threading.local()
+
+    def get(self):
+        return getattr(self._local, "value", self.default)
+
+    def set(self, value):
+        token = self.get()
+        self._local.value = value
+        return token
+
+    def reset(self, token):
+        self._local.value = token
+
+
+def context_var(name, default=None):
+    """
+    Return a ``ContextVar``, or a ``LocalVar`` if ``contextvars`` is not
+    available.
+    """
+    var_class = ContextVar or LocalVar
+    return var_class(name, default=default)
+
+
+def get_field_values(model, copy_values=False):
+    """
+    Return the loaded concrete field values of a Django model, by attribute
+    name. The primary key and deferred fields are ignored.
+
+    Args:
+        model: model instance
+        copy_values (bool): deep copy mutable values (e.g. of JSON or array
+            fields), so that the values returned are not modified in place
+            with the model
+
+    Returns:
+        dict: field values, or None if the model is not a Django model
+    """
+    meta = getattr(model, "_meta", None)
+    if meta is None:
+        return None
+
+    values = model.__dict__
+    field_values = {
+        field.attname: values[field.attname]
+        for field in meta.concrete_fields
+        if not field.primary_key and field.attname in values
+    }
+    if copy_values:
+        for name, value in field_values.items():
+            if not isinstance(value, IMMUTABLE_TYPES):
+                field_values[name] = copy.deepcopy(value)
+    return field_values
+
+
+def call_at_exit(obj, name="flush"):
+    """
+    Call the ``name`` method of ``obj`` at interpreter exit, if ``obj`` is
+    still alive. Objects are weakly referenced and a single ``atexit``
+    handler is registered for all of them.
+
+    Args:
+        obj: object to flush at exit
+        name (str): method name
     """
+    with _exit_lock:
+        _exit_calls[obj] = name
 
-    atomic = ContextDecorator()
+
+@atexit.register
+def _call_exit_methods():
+    with _exit_lock:
+        calls = list(_exit_calls.items())
+        _exit_calls.clear()
+
+    for obj, name in calls:
+        getattr(obj, name)()
+
+
+def load_object(path):
+    """
+    Import ``module:attribute``.
+    """
+    module_name, _, attribute = path.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)
 
 
 class TestAllTransitionsMixin:
@@ -16,6 +16,9 @@ extras_require = {
         "sphinx-rtd-theme",
         "sphinxcontrib-websupport",
     ],
+    "simulation": [
+        "numpy>=1.17",
+    ],
     "test": [
         "pycodestyle",
         "pytest==5.3.5",
@@ -47,7 +50,7 @@ setup(
         "Programming Language :: Python :: 3.7",
         "Programming Language :: Python :: 3.8",
     ],
-    packages=find_packages(exclude=("tests", "docs")),
+    packages=find_packages(exclude=("tests", "docs", "benchmarks")),
     install_requires=[
     ],
     setup_requires=["wheel"],
@@ -0,0 +1,423 @@
+import asyncio
+import threading
+
+from unittest import TestCase, mock, skipUnless
+
+from pieuvre import (
+    AsyncWorkflow,
+    BoundWorkflow,
+    ForbiddenTransition,
+    InvalidTransition,
+    TransitionDoesNotExist,
+    on_enter_state,
+    on_exit_state_check,
+    transition,
+)
+
+from pieuvre import aio, utils
+from pieuvre.aio import AsyncIterator
+from pieuvre.db_logging import BufferedTransitionLog
+from pieuvre.locks import StripedLockManager
+from pieuvre.utils import ContextVar
+
+from .test_events import MyEventManager
+from .test_workflow import MyOrder
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class MyAsyncOrder(MyOrder):
+
+    def __init__(self, state="draft"):
+        super().__init__(state=state)
+        self.saved_async = False
+
+    async def asave(self):
+        self.is_saved = True
+        self.saved_async = True
+
+
+class AsyncLoggingModel(object):
+
+    logs = []
+
+    @classmethod
+    async def alog(cls, **kwargs):
+        cls.logs.append(kwargs)
+
+
+class MyAsyncWorkflow(AsyncWorkflow):
+
+    event_manager_classes = (MyEventManager, )
+    db_logging = True
+    db_logging_class = AsyncLoggingModel
+
+    transitions = [
+        {"name": "submit", "source": "draft", "destination": "submitted"},
+        {"name": "complete", "source": "submitted", "destination": "completed"},
+        {"name": "reject", "source": "*", "destination": "rejected"},
+    ]
+
+    async def before_submit(self):
+        await asyncio.sleep(0)
+        self.model.before_submit_called = True
+
+    @transition()
+    async def submit(self):
+        await asyncio.sleep(0)
+        return "submitted"
+
+    async def after_submit(self, result):
+        self.model.after_submit_result = result
+
+    def on_enter_submitted(self, transition):
+        self.model.on_enter_submitted_called = True
+
+    async def check_submit(self):
+        return self.model.allow_submit
+
+    @on_exit_state_check("draft")
+    async def check_leaving_draft(self):
+        return self.model.allow_leaving_draft_state
+
+    @on_enter_state("rejected")
+    async def entering_rejected(self, transition):
+        self.model.entering_rejected_called = True
+
+    @transition()
+    def complete(self):
+        self.model.complete_called = True
+
+
+@skipUnless(ContextVar, "contextvars is not available")
+class TestAsyncWorkflow(TestCase):
+    def setUp(self):
+        AsyncLoggingModel.logs = []
+        self.model = MyAsyncOrder()
+        self.workflow = MyAsyncWorkflow(model=self.model)
+
+    def test_decorated_transition(self):
+        self.assertEqual(run(self.workflow.submit()), "submitted")
+
+        self.assertEqual(self.model.state, "submitted")
+        self.assertTrue(self.model.before_submit_called)
+        self.assertTrue(self.model.on_enter_submitted_called)
+        self.assertEqual(self.model.after_submit_result, "submitted")
+        # With Django, models are saved with ``save`` in a transaction
+        self.assertEqual(self.model.saved_async, aio.transaction is None)
+        self.assertEqual(AsyncLoggingModel.logs[0]["from_state"], "draft")
+        self.assertEqual(
+            self.workflow.event_managers[0].events,
+            [{"type": "order-submitted", "data": {"submitted": True}}],
+        )
+
+        # Synchronous transition body
+        run(self.workflow.complete())
+        self.assertTrue(self.model.complete_called)
+        self.assertEqual(self.model.state, "completed")
+
+    def test_default_transition(self):
+        run(self.workflow.reject())
+        self.assertEqual(self.model.state, "rejected")
+        self.assertTrue(self.model.entering_rejected_called)
+
+        run(self.workflow.run_transition("reject"))
+        with self.assertRaises(TransitionDoesNotExist):
+            run(self.workflow.run_transition("does_not_exist"))
+
+    def test_checks(self):
+        self.model.allow_leaving_draft_state = False
+        with self.assertRaises(ForbiddenTransition):
+            run(self.workflow.submit())
+        self.assertEqual(self.model.state, "draft")
+
+        with self.assertRaises(InvalidTransition):
+            run(self.workflow.complete())
+
+    def test_overridden_check_transition_condition(self):
+        class OverridingWorkflow(MyAsyncWorkflow):
+            async def check_transition_condition(self, transition, *args,
+                                                 **kwargs):
+                raise ForbiddenTransition(
+                    transition=transition["name"],
+                    current_state=self.state,
+                    to_state=transition["destination"])
+
+        workflow = OverridingWorkflow(model=self.model)
+        with self.assertRaises(ForbiddenTransition):
+            run(workflow.submit())
+        self.assertEqual(self.model.state, "draft")
+        self.assertFalse(self.model.saved_async)
+
+    def test_unsupported_options(self):
+        for option, value in (
+                ("lock_manager", StripedLockManager()),
+                ("cas_writes", True),
+                ("coalesce_saves", True)):
+            with self.assertRaisesRegex(ValueError, option):
+                type("OptionWorkflow", (MyAsyncWorkflow, ), {option: value})
+
+            # Set after the class is defined
+            workflow_class = type("OptionWorkflow", (MyAsyncWorkflow, ), {})
+            setattr(workflow_class, option, value)
+            with self.assertRaisesRegex(ValueError, option):
+                workflow_class(model=MyAsyncOrder())
+            with self.assertRaisesRegex(ValueError, option):
+                workflow_class.shared()
+
+    def test_atomic_writes(self):
+        blocks = []
+
+        class Atomic(utils.Atomic):
+            def __enter__(self):
+                blocks.append(threading.current_thread())
+                return super().__enter__()
+
+        class Transaction(utils.transaction):
+            atomic = Atomic()
+
+        class Recorder(object):
+            def log(self, **record):
+                steps.append(("log", len(utils.Atomic.get_callbacks_stack())))
+
+        steps = []
+
+        class SyncOrder(MyOrder):
+            def save(self, **kwargs):
+                steps.append(("save", len(utils.Atomic.get_callbacks_stack())))
+
+        class AtomicWorkflow(MyAsyncWorkflow):
+            db_logging_class = Recorder()
+
+        # As with Django installed
+        model = SyncOrder()
+        with mock.patch.object(aio, "transaction", Transaction):
+            run(AtomicWorkflow(model=model).submit())
+            run(AtomicWorkflow(model=model).advance_to("completed"))
+
+        self.assertEqual(model.state, "completed")
+        self.assertEqual(
+            steps, [("save", 1), ("log", 1), ("save", 1), ("log", 1)])
+        self.assertEqual(len(blocks), 2)
+        self.assertNotIn(threading.current_thread(), blocks)
+
+    def test_push_event_in_executor(self):
+        threads = []
+
+        class ThreadEventManager(MyEventManager):
+            def _push_event(self, event):
+                threads.append(threading.current_thread())
+                super()._push_event(event)
+
+        class ThreadWorkflow(MyAsyncWorkflow):
+            event_manager_classes = (ThreadEventManager, )
+
+        workflow = ThreadWorkflow(model=self.model)
+        run(workflow.submit())
+        self.assertEqual(len(workflow.event_managers[0].events), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    def test_batch_events(self):
+        batches = []
+
+        class BatchEventManager(MyEventManager):
+            batch_events = True
+            supported_transitions = dict(
+                MyEventManager.supported_transitions,
+                complete={"event_type": "order-completed", "data": dict})
+
+            def _push_events(self, events):
+                batches.append((threading.current_thread(), events))
+
+        class BatchWorkflow(MyAsyncWorkflow):
+            event_manager_classes = (BatchEventManager, )
+
+            async def after_submit(self, result):
+                await self.complete()
+
+        run(BatchWorkflow(model=self.model).submit())
+        self.assertEqual(self.model.state, "completed")
+        self.assertEqual(len(batches), 1)
+        self.assertIsNot(batches[0][0], threading.current_thread())
+        self.assertEqual(
+            [event["type"] for event in batches[0][1]],
+            ["order-completed", "order-submitted"])
+
+    def test_batch_logs(self):
+        writes = []
+
+        class Backend(object):
+            @classmethod
+            def bulk_log(cls, records):
+                writes.append((threading.current_thread(), records))
+
+        class BatchWorkflow(MyAsyncWorkflow):
+            db_logging_class = BufferedTransitionLog(Backend)
+
+            async def after_submit(self, result):
+                await self.complete()
+
+        run(BatchWorkflow(model=self.model).submit())
+        self.assertEqual(len(writes), 1)
+        self.assertIsNot(writes[0][0], threading.current_thread())
+        self.assertEqual(
+            [record["transition"] for record in writes[0][1]],
+            ["complete", "submit"])
+
+    def test_synchronous_steps_in_thread(self):
+        threads = []
+
+        class Recorder(object):
+            def record(self, workflow, transition):
+                threads.append(threading.current_thread())
+
+            def log(self, **record):
+                threads.append(threading.current_thread())
+
+            def dispatch(self, manager, event):
+                threads.append(threading.current_thread())
+
+        recorder = Recorder()
+
+        class RecordingWorkflow(MyAsyncWorkflow):
+            db_logging_class = recorder
+            state_counter = recorder
+            event_dispatcher = recorder
+
+        run(RecordingWorkflow(model=self.model).submit())
+        self.assertEqual(len(threads), 3)
+        self.assertNotIn(threading.current_thread(), threads)
+
+    def test_gather(self):
+        models = [MyAsyncOrder() for _ in range(10)]
+
+        async def submit_all():
+            return await asyncio.gather(*[
+                MyAsyncWorkflow(model=model).submit() for model in models
+            ])
+
+        self.assertEqual(run(submit_all()), ["submitted"] * 10)
+        self.assertEqual({model.state for model in models}, {"submitted"})
+
+    def test_shared_gather(self):
+        workflow = MyAsyncWorkflow.shared()
+        models = [MyAsyncOrder() for _ in range(10)]
+
+        async def submit_all():
+            return await asyncio.gather(*[
+                BoundWorkflow(workflow, model).submit() for model in models
+            ])
+
+        self.assertEqual(run(submit_all()), ["submitted"] * 10)
+        self.assertEqual({model.state for model in models}, {"submitted"})
+        self.assertTrue(all(model.after_submit_result for model in models))
+
+    def test_get_allowed_transitions(self):
+        self.model.allow_submit = False
+        allowed = run(self.workflow.get_allowed_transitions())
+        self.assertEqual(allowed.names, ["reject"])
+        self.assertEqual(allowed.forbidden, {"submit": "check_submit"})
+
+        results = run(MyAsyncWorkflow.bulk_get_allowed_transitions(
+            [MyAsyncOrder(), self.model]))
+        self.assertEqual(
+            [result.names for result in results],
+            [["submit", "reject"], ["reject"]])
+
+    def test_get_allowed_transitions_overridden_condition(self):
+        class OverridingWorkflow(MyAsyncWorkflow):
+            async def check_transition_condition(self, transition, *args,
+                                                 **kwargs):
+                if transition["name"] == "submit":
+                    raise ForbiddenTransition(
+                        transition=transition["name"],
+                        current_state=self.state,
+                        to_state=transition["destination"])
+
+        allowed = run(
+            OverridingWorkflow(model=self.model).get_allowed_transitions())
+        self.assertEqual(allowed.names, ["reject"])
+        self.assertEqual(
+            allowed.forbidden, {"submit": "check_transition_condition"})
+
+    def test_bulk_get_allowed_transitions(self):
+        running = []
+        concurrency = []
+
+        class SlowWorkflow(MyAsyncWorkflow):
+            async def check_submit(self):
+                running.append(self.model)
+                concurrency.append(len(running))
+                await asyncio.sleep(0)
+                running.remove(self.model)
+                return self.model.allow_submit
+
+        models = [MyAsyncOrder() for _ in range(5)]
+        models[3].allow_submit = False
+        results = run(SlowWorkflow.bulk_get_allowed_transitions(
+            iter(models), chunk_size=2))
+
+        self.assertEqual([result.model for result in results], models)
+        self.assertEqual(
+            [result.is_allowed("submit") for result in results],
+            [True, True, True, False, True])
+        self.assertEqual(max(concurrency), 2)
+
+        async def iterate():
+            return await SlowWorkflow.bulk_get_allowed_transitions(
+                AsyncIterator(models), chunk_size=10)
+
+        self.assertEqual(len(run(iterate())), 5)
+        self.assertEqual(max(concurrency), 5)
+
+    def test_bulk_run_transition(self):
+        class FailingWorkflow(MyAsyncWorkflow):
+            async def after_submit(self, result):
+                if self.model.allow_submit == "fail":
+                    raise ValueError()
+                await super().after_submit(result)
+
+        models = [MyAsyncOrder(), MyAsyncOrder("submitted"), MyAsyncOrder()]
+        models[2].allow_submit = "fail"
+        results = run(FailingWorkflow.bulk_run_transition(
+            "submit", iter(models), chunk_size=2))
+
+        self.assertEqual([result.model for result in results], models)
+        self.assertEqual([result.result for result in results], ["submitted", None, None])
+        self.assertIsInstance(results[1].error, InvalidTransition)
+        self.assertIsInstance(results[2].error, ValueError)
+        self.assertEqual(
+            [model.state for model in models], ["submitted", "submitted", "draft"])
+        self.assertEqual(models[0].saved_async, aio.transaction is None)
+
+        results = run(FailingWorkflow.bulk_run_transition("complete", models[:1]))
+        self.assertTrue(results[0].success)
+        self.assertEqual(models[0].state, "completed")
+
+        with self.assertRaises(TransitionDoesNotExist):
+            run(FailingWorkflow.bulk_run_transition("does_not_exist", models))
+
+    def test_advance_to(self):
+        done = run(self.workflow.advance_to("completed"))
+
+        self.assertEqual([trans["name"] for trans in done], ["submit", "complete"])
+        self.assertEqual(self.model.state, "completed")
+        self.assertEqual(self.model.after_submit_result, "submitted")
+        self.assertTrue(self.model.complete_called)
+        self.assertEqual(self.model.saved_async, aio.transaction is None)
+        self.assertEqual(len(AsyncLoggingModel.logs), 2)
+
+
+class TestContextVars(TestCase):
+    def test_requires_context_vars(self):
+        with mock.patch.object(aio, "ContextVar", None):
+            with self.assertRaises(ImportError):
+                MyAsyncWorkflow(model=MyAsyncOrder())
+            with self.assertRaises(ImportError):
+                MyAsyncWorkflow.shared()
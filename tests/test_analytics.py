@@ -0,0 +1,183 @@
+import datetime
+import io
+import json
+import os
+import pickle
+import random
+import tempfile
+
+from contextlib import redirect_stdout
+from unittest import TestCase
+
+from pieuvre.analytics import (
+    QuantileSketch, TransitionStats, main, read_records, strptime_iso,
+    to_seconds
+)
+
+
+class LogRecord(object):
+
+    def __init__(self, transition, from_state, to_state, model, timestamp):
+        self.transition = transition
+        self.from_state = from_state
+        self.to_state = to_state
+        self.model = model
+        self.timestamp = timestamp
+
+
+def make_log(models):
+    """
+    Orders submitted after ``model`` seconds, even orders then completed
+    after 10 seconds.
+    """
+    records = []
+    for model in range(1, models + 1):
+        records.append({
+            "transition": "submit", "from_state": "draft",
+            "to_state": "submitted", "model": model, "timestamp": model})
+        if model % 2 == 0:
+            records.append({
+                "transition": "complete", "from_state": "submitted",
+                "to_state": "completed", "model": model,
+                "timestamp": model + 10})
+    return records
+
+
+class TestQuantileSketch(TestCase):
+    def test_quantile(self):
+        values = [random.uniform(1, 1000) for _ in range(10000)]
+        sketch = QuantileSketch(relative_accuracy=0.01)
+        for value in values:
+            sketch.add(value)
+
+        values.sort()
+        for q in (0.1, 0.5, 0.9, 0.99):
+            expected = values[int(q * (len(values) - 1))]
+            self.assertAlmostEqual(
+                sketch.quantile(q) / expected, 1, delta=0.02)
+        self.assertEqual(sketch.quantile(0), values[0])
+        self.assertEqual(sketch.quantile(1), values[-1])
+        self.assertIsNone(QuantileSketch().quantile(0.5))
+
+    def test_merge(self):
+        first, second = QuantileSketch(), QuantileSketch()
+        for value in range(100):
+            (first if value % 2 else second).add(value)
+
+        first.merge(second)
+        self.assertEqual(first.count, 100)
+        self.assertEqual(first.min, 0)
+        self.assertEqual(first.max, 99)
+        self.assertAlmostEqual(first.quantile(0.5), 49.5, delta=1)
+        with self.assertRaises(ValueError):
+            first.merge(QuantileSketch(relative_accuracy=0.05))
+
+
+class TestTransitionStats(TestCase):
+    def test_consume(self):
+        stats = TransitionStats(
+            funnels={"order": ["draft", "submitted", "completed"]},
+            rate_interval=5)
+        stats.consume(make_log(100))
+
+        self.assertEqual(stats.records, 150)
+        self.assertEqual(stats.transitions, {"submit": 100, "complete": 50})
+        self.assertEqual(stats.transition_counts[0]["submit"], 4)
+
+        self.assertEqual(list(stats.dwell_times), ["submitted"])
+        self.assertAlmostEqual(
+            stats.dwell_percentiles()["submitted"][0.5], 10, delta=0.1)
+        self.assertEqual(
+            stats.funnel("order"),
+            [("draft", 100, 1.), ("submitted", 100, 1.),
+             ("completed", 50, 0.5)])
+        self.assertAlmostEqual(stats.transition_rates()["submit"], 100 / 109)
+
+    def test_records(self):
+        start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        stats = TransitionStats().consume([
+            LogRecord("submit", "draft", "submitted", 1, start),
+            LogRecord(
+                "complete", "submitted", "completed", 1,
+                start + datetime.timedelta(minutes=1)),
+        ])
+        self.assertAlmostEqual(stats.dwell_times["submitted"].mean, 60)
+
+    def test_merge(self):
+        records = make_log(100)
+        settings = {"funnels": {"order": ["draft", "completed"]}}
+        shards = [TransitionStats(**settings) for _ in range(3)]
+        for record in records:
+            shards[record["model"] % 3].add(record)
+
+        # Partial results are sent by workers
+        merged = pickle.loads(pickle.dumps(shards[0]))
+        for shard in shards[1:]:
+            merged.merge(shard)
+
+        stats = TransitionStats(**settings).consume(records)
+        self.assertEqual(merged.to_dict(), stats.to_dict())
+        with self.assertRaises(ValueError):
+            merged.merge(TransitionStats())
+
+    def test_max_open_models(self):
+        records = sorted(make_log(100), key=lambda record: record["timestamp"])
+        stats = TransitionStats(max_open_models=20).consume(records)
+        self.assertEqual(stats.evicted, 80)
+        self.assertEqual(len(stats._models), 20)
+        self.assertEqual(stats.dwell_times["submitted"].count, 50)
+
+        # Orders are dropped before being completed, but the last one
+        stats = TransitionStats(max_open_models=5).consume(records)
+        self.assertEqual(stats.dwell_times["submitted"].count, 1)
+
+    def test_max_rate_buckets(self):
+        records = sorted(make_log(100), key=lambda record: record["timestamp"])
+        stats = TransitionStats(rate_interval=5, max_rate_buckets=3)
+        stats.consume(records)
+        self.assertEqual(sorted(stats.transition_counts), [100, 105, 110])
+        self.assertEqual(stats.transitions["submit"], 100)
+
+        other = TransitionStats(rate_interval=5, max_rate_buckets=3)
+        other.add(records[0])
+        self.assertEqual(
+            sorted(stats.merge(other).transition_counts), [100, 105, 110])
+
+    def test_to_seconds(self):
+        self.assertEqual(to_seconds(12.5), 12.5)
+        self.assertEqual(to_seconds("12.5"), 12.5)
+        self.assertEqual(
+            to_seconds(datetime.datetime(
+                1970, 1, 1, 0, 1, tzinfo=datetime.timezone.utc)), 60)
+        self.assertEqual(to_seconds("1970-01-01T00:01:00+00:00"), 60)
+
+    def test_strptime_iso(self):
+        date = datetime.datetime(
+            2024, 5, 1, 12, 30, 15, 250000, tzinfo=datetime.timezone(
+                datetime.timedelta(hours=2)))
+        self.assertEqual(strptime_iso(date.isoformat()), date)
+        self.assertEqual(
+            strptime_iso("2024-05-01 12:30:15"),
+            datetime.datetime(2024, 5, 1, 12, 30, 15))
+        self.assertEqual(
+            strptime_iso("2024-05-01"), datetime.datetime(2024, 5, 1))
+        with self.assertRaises(ValueError):
+            strptime_iso("May 1st")
+
+    def test_main(self):
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, "w") as records_file:
+            for record in make_log(10):
+                records_file.write(json.dumps(record) + "\n")
+
+        self.assertEqual(len(list(read_records(path))), 15)
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            status = main([path, "--funnel", "draft,completed"])
+        self.assertEqual(status, 0)
+        summary = json.loads(output.getvalue())
+        self.assertEqual(summary["transitions"], {"submit": 10, "complete": 5})
+        self.assertEqual(
+            summary["funnels"]["draft,completed"][1], ["completed", 5, 0.5])
@@ -0,0 +1,148 @@
+import io
+import os
+import sqlite3
+import tempfile
+import time
+
+from contextlib import closing, redirect_stdout
+from unittest import TestCase
+
+from pieuvre import Workflow
+from pieuvre.counters import (
+    MemoryCounterStore, SQLiteCounterStore, StateCounter, main
+)
+
+from .test_workflow import MyOrder
+
+
+COUNTED_WORKFLOW = "tests.test_counters.CountedWorkflow"
+
+
+class CountedWorkflow(Workflow):
+
+    state_counter = StateCounter(MemoryCounterStore(), flush_interval=60.)
+
+    transitions = [
+        {"name": "submit", "source": "draft", "destination": "submitted"},
+        {"name": "complete", "source": "submitted", "destination": "completed"},
+        {"name": "reject", "source": "*", "destination": "rejected"},
+    ]
+
+    def after_submit(self, result):
+        if self.model.allow_submit == "fail":
+            raise ValueError()
+
+
+class TestStateCounter(TestCase):
+    def setUp(self):
+        self.counter = CountedWorkflow.state_counter
+        self.counter.reconcile(CountedWorkflow, ["draft"] * 3)
+
+    def test_transitions(self):
+        models = [MyOrder() for _ in range(3)]
+        CountedWorkflow(model=models[0]).submit()
+        CountedWorkflow(model=models[1]).submit()
+        CountedWorkflow(model=models[1]).complete()
+        CountedWorkflow(model=models[2]).advance_to("completed")
+
+        # Deltas are aggregated in memory until flushed
+        self.assertEqual(
+            self.counter.store.get_counts(COUNTED_WORKFLOW), {"draft": 3})
+        self.assertEqual(self.counter.get_counts(CountedWorkflow), {
+            "draft": 0, "submitted": 1, "completed": 2})
+
+    def test_failed_transition(self):
+        model = MyOrder()
+        model.allow_submit = "fail"
+        with self.assertRaises(ValueError):
+            CountedWorkflow(model=model).submit()
+        self.assertEqual(
+            self.counter.get_counts(CountedWorkflow), {"draft": 3})
+
+    def test_bulk_run_transition(self):
+        models = [MyOrder() for _ in range(3)]
+        CountedWorkflow.bulk_run_transition("reject", models, chunk_size=2)
+        self.assertEqual(
+            self.counter.get_counts(CountedWorkflow),
+            {"draft": 0, "rejected": 3})
+
+    def test_adjust(self):
+        self.counter.adjust(CountedWorkflow, "draft", 2)
+        self.counter.adjust(CountedWorkflow, "draft", -1)
+        self.assertEqual(
+            self.counter.get_counts(CountedWorkflow), {"draft": 4})
+
+    def test_same_name(self):
+        # Same name, other module
+        other = type("CountedWorkflow", (CountedWorkflow, ), {
+            "__module__": "other.workflows"})
+
+        self.counter.adjust(other, "draft", 1)
+        self.assertEqual(self.counter.get_counts(other), {"draft": 1})
+        self.assertEqual(
+            self.counter.get_counts(CountedWorkflow), {"draft": 3})
+
+    def test_flush_size(self):
+        counter = StateCounter(MemoryCounterStore(), flush_size=2)
+        counter.adjust(CountedWorkflow, "draft", 1)
+        self.assertEqual(counter.store.counts, {})
+        counter.adjust(CountedWorkflow, "draft", 1)
+        self.assertEqual(counter.store.counts, {(COUNTED_WORKFLOW, "draft"): 2})
+
+    def test_flush_interval(self):
+        counter = StateCounter(MemoryCounterStore(), flush_interval=0.01)
+        counter.adjust(CountedWorkflow, "draft", 1)
+        # Flushed by the timer, without another transition
+        for _ in range(500):
+            if counter.store.counts:
+                break
+            time.sleep(0.01)
+        self.assertEqual(counter.store.counts, {(COUNTED_WORKFLOW, "draft"): 1})
+        self.assertIsNone(counter._timer)
+
+    def test_reconcile(self):
+        CountedWorkflow(model=MyOrder()).submit()
+        counts = self.counter.reconcile(
+            CountedWorkflow, iter(["draft", "submitted", "submitted"]))
+        self.assertEqual(counts, {"draft": 1, "submitted": 2})
+        # Pending deltas are dropped
+        self.assertEqual(self.counter.get_counts(CountedWorkflow), counts)
+
+
+class TestSQLiteCounterStore(TestCase):
+    def test_store(self):
+        store = SQLiteCounterStore(sqlite3.connect(":memory:"))
+        self.addCleanup(store.connection.close)
+        store.create_table()
+        store.apply({("Order", "draft"): 2, ("Order", "submitted"): 1})
+        store.apply({("Order", "draft"): -1, ("Other", "draft"): 1})
+        self.assertEqual(
+            store.get_counts("Order"), {"draft": 1, "submitted": 1})
+
+        store.reset("Order", {"completed": 4})
+        self.assertEqual(store.get_counts("Order"), {"completed": 4})
+        self.assertEqual(store.get_counts("Other"), {"draft": 1})
+
+    def test_main(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+
+        with closing(sqlite3.connect(path)) as connection, connection:
+            connection.execute("CREATE TABLE orders (state TEXT)")
+            connection.executemany(
+                "INSERT INTO orders VALUES (?)",
+                [("draft", ), ("draft", ), ("completed", )])
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            status = main([
+                "--workflow", "tests.test_counters:CountedWorkflow",
+                "--sqlite", path, "--source-table", "orders"])
+        self.assertEqual(status, 0)
+        self.assertEqual(output.getvalue(), "completed\t1\ndraft\t2\n")
+
+        store = SQLiteCounterStore(path)
+        self.addCleanup(store.connection.close)
+        self.assertEqual(
+            store.get_counts(COUNTED_WORKFLOW), {"draft": 2, "completed": 1})
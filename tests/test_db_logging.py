@@ -0,0 +1,152 @@
+import time
+
+from unittest import TestCase
+
+from pieuvre import utils
+# The transaction module db_logging uses: Django's if it is installed
+from pieuvre.db_logging import BufferedTransitionLog, transaction
+from pieuvre.unit_of_work import UnitOfWork
+
+from .test_workflow import MyOrder, MyWorkflow
+
+
+class BulkLoggingModel(object):
+
+    def __init__(self):
+        self.writes = []
+
+    def bulk_log(self, records):
+        self.writes.append(records)
+
+
+class RollbackError(Exception):
+    pass
+
+
+class TestBufferedTransitionLog(TestCase):
+    def setUp(self):
+        self.backend = BulkLoggingModel()
+        self.buffer = BufferedTransitionLog(self.backend, flush_size=3)
+
+        class BufferedWorkflow(MyWorkflow):
+            db_logging_class = self.buffer
+
+        self.workflow_class = BufferedWorkflow
+
+    def test_write_before_commit(self):
+        model = MyOrder()
+        with transaction.atomic():
+            self.workflow_class(model=model).submit()
+            # Written in the transaction
+            self.assertEqual([len(records) for records in self.backend.writes], [1])
+
+        record = self.backend.writes[0][0]
+        self.assertEqual(record["transition"], "submit")
+        self.assertEqual(record["from_state"], "draft")
+        self.assertEqual(record["to_state"], "submitted")
+        self.assertIs(record["model"], model)
+        self.assertEqual(len(self.buffer), 0)
+
+    def test_nested_transitions(self):
+        class NestedWorkflow(self.workflow_class):
+            def after_submit(self, result):
+                self.complete()
+
+        NestedWorkflow(model=MyOrder()).submit()
+        self.assertEqual(
+            [[record["transition"] for record in records]
+             for records in self.backend.writes],
+            [["complete", "submit"]])
+
+    def test_unit_of_work(self):
+        with transaction.atomic(), UnitOfWork(defer_saves=False):
+            for _ in range(4):
+                self.workflow_class(model=MyOrder()).submit()
+            self.assertEqual(self.backend.writes, [])
+
+        # One write per flush_size records
+        self.assertEqual([len(records) for records in self.backend.writes], [3, 1])
+
+    def test_bulk_run_transition(self):
+        models = [MyOrder() for _ in range(5)]
+        self.workflow_class.bulk_run_transition("submit", models, chunk_size=5)
+        self.assertEqual([len(records) for records in self.backend.writes], [3, 2])
+
+        self.backend.writes = []
+        self.workflow_class.bulk_run_transition("complete", models, chunk_size=2)
+        self.assertEqual([len(records) for records in self.backend.writes], [2, 2, 1])
+        self.assertIs(self.backend.writes[2][0]["model"], models[4])
+
+    def test_write_error(self):
+        class FailingBackend(object):
+            @classmethod
+            def bulk_log(cls, records):
+                raise RollbackError()
+
+        class FailingWorkflow(MyWorkflow):
+            db_logging_class = BufferedTransitionLog(FailingBackend)
+
+        committed = []
+        with self.assertRaises(RollbackError):
+            with transaction.atomic():
+                transaction.on_commit(lambda: committed.append(True))
+                FailingWorkflow(model=MyOrder()).submit()
+        self.assertEqual(committed, [])
+
+    def test_after_commit(self):
+        self.buffer.after_commit = True
+        model = MyOrder()
+        with self.assertRaises(RollbackError):
+            with transaction.atomic():
+                self.workflow_class(model=model).submit()
+                raise RollbackError()
+
+        self.assertEqual(self.backend.writes, [])
+        self.assertEqual(len(self.buffer), 0)
+
+        with transaction.atomic():
+            self.workflow_class(model=model).reject()
+            self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(len(self.buffer), 1)
+
+        # Flushed once flush_size records are buffered
+        models = [MyOrder() for _ in range(2)]
+        self.workflow_class.bulk_run_transition("submit", models)
+        self.assertEqual([len(records) for records in self.backend.writes], [3])
+        self.assertEqual(len(self.buffer), 0)
+
+    def test_flush_interval(self):
+        self.buffer.after_commit = True
+        self.buffer.flush_interval = None
+        self.workflow_class(model=MyOrder()).submit()
+        self.assertEqual(self.backend.writes, [])
+        self.assertEqual(len(self.buffer), 1)
+
+        # Flushed by the timer, without another transition
+        self.buffer.flush_interval = 0.01
+        self.workflow_class(model=MyOrder()).submit()
+        for _ in range(500):
+            if self.backend.writes:
+                break
+            time.sleep(0.01)
+        self.assertEqual([len(records) for records in self.backend.writes], [2])
+        self.assertIsNone(self.buffer._timer)
+
+    def test_flush_at_exit(self):
+        self.buffer.after_commit = True
+        self.buffer.flush_interval = None
+        self.workflow_class(model=MyOrder()).submit()
+        utils._call_exit_methods()
+        self.assertEqual([len(records) for records in self.backend.writes], [1])
+
+    def test_log_fallback(self):
+        class Backend(object):
+            records = []
+
+            @classmethod
+            def log(cls, **kwargs):
+                cls.records.append(kwargs)
+
+        buffer = BufferedTransitionLog(Backend)
+        buffer.log(transition="submit")
+        self.assertEqual(Backend.records, [{"transition": "submit"}])
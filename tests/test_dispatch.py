@@ -0,0 +1,109 @@
+import threading
+import weakref
+
+from unittest import TestCase
+
+# The transaction module dispatch uses: Django's if it is installed
+from pieuvre.dispatch import EventDispatcher, transaction
+
+from .test_events import MyEventManager
+from .test_workflow import MyOrder, MyWorkflow
+
+
+class RollbackError(Exception):
+    pass
+
+
+class SlowEventManager(MyEventManager):
+
+    release = threading.Event()
+
+    def _push_event(self, event):
+        self.release.wait(5)
+        super()._push_event(event)
+
+
+class TestEventDispatcher(TestCase):
+    def setUp(self):
+        self.dispatcher = EventDispatcher(max_workers=2, max_queue_size=10)
+
+        class DispatchedWorkflow(MyWorkflow):
+            event_manager_classes = (MyEventManager, )
+            event_dispatcher = self.dispatcher
+
+        self.workflow_class = DispatchedWorkflow
+
+    def tearDown(self):
+        self.dispatcher.shutdown()
+
+    def test_dispatch_after_commit(self):
+        workflow = self.workflow_class(model=MyOrder())
+        manager = workflow.event_managers[0]
+
+        with transaction.atomic():
+            workflow.submit()
+            self.assertEqual(manager.events, [])
+
+        self.assertTrue(self.dispatcher.flush(timeout=5))
+        self.assertEqual(
+            manager.events,
+            [{"type": "order-submitted", "data": {"submitted": True}}],
+        )
+        stats = self.dispatcher.get_stats()
+        self.assertEqual(stats["published"], 1)
+        self.assertEqual(stats["queued"], 0)
+
+    def test_rollback(self):
+        workflow = self.workflow_class(model=MyOrder())
+
+        with self.assertRaises(RollbackError):
+            with transaction.atomic():
+                workflow.submit()
+                raise RollbackError()
+
+        self.assertTrue(self.dispatcher.flush(timeout=5))
+        self.assertEqual(workflow.event_managers[0].events, [])
+        self.assertEqual(self.dispatcher.get_stats()["published"], 0)
+
+    def test_shutdown_publishes_queued_events(self):
+        self.workflow_class.event_manager_classes = (SlowEventManager, )
+        SlowEventManager.release.clear()
+
+        workflows = [self.workflow_class(model=MyOrder()) for _ in range(5)]
+        for workflow in workflows:
+            workflow.submit()
+
+        self.assertFalse(self.dispatcher.flush(timeout=0.01))
+        self.assertGreater(self.dispatcher.get_stats()["queued"], 0)
+
+        SlowEventManager.release.set()
+        self.dispatcher.shutdown()
+        self.assertEqual(
+            [len(workflow.event_managers[0].events) for workflow in workflows],
+            [1] * 5,
+        )
+        self.assertEqual(self.dispatcher.get_stats()["published"], 5)
+
+    def test_restart_after_shutdown(self):
+        self.workflow_class.event_manager_classes = (SlowEventManager, )
+        SlowEventManager.release.clear()
+
+        self.workflow_class(model=MyOrder()).submit()
+        self.dispatcher.shutdown(wait=False)
+        SlowEventManager.release.set()
+
+        workflows = [self.workflow_class(model=MyOrder()) for _ in range(5)]
+        for workflow in workflows:
+            workflow.submit()
+
+        self.assertTrue(self.dispatcher.flush(timeout=5))
+        self.assertEqual(self.dispatcher.get_stats()["published"], 6)
+        self.assertEqual(len(self.dispatcher._workers), 2)
+        self.assertTrue(all(
+            worker.is_alive() for worker in self.dispatcher._workers))
+
+    def test_not_kept_alive(self):
+        dispatcher = EventDispatcher()
+        reference = weakref.ref(dispatcher)
+        del dispatcher
+        self.assertIsNone(reference())
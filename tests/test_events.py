@@ -0,0 +1,46 @@
+from unittest import TestCase
+
+from pieuvre import WorkflowEventManager
+
+
+def get_submitted_data():
+    return {"submitted": True}
+
+
+class MyEventManager(WorkflowEventManager):
+
+    supported_transitions = {
+        "submit": {
+            "event_type": "order-submitted",
+            "data": get_submitted_data,
+        }
+    }
+
+    def __init__(self, model):
+        super().__init__(model)
+        self.events = []
+
+    def _push_event(self, event):
+        self.events.append(event)
+
+
+class TestWorkflowEventManager(TestCase):
+    def setUp(self):
+        self.manager = MyEventManager(model=None)
+
+    def test_build_event(self):
+        self.assertEqual(
+            self.manager.build_event({"name": "submit"}),
+            {"type": "order-submitted", "data": {"submitted": True}},
+        )
+        self.assertIsNone(self.manager.build_event({"name": "reject"}))
+
+    def test_push_event(self):
+        self.manager.push_event({"name": "reject"})
+        self.assertEqual(self.manager.events, [])
+
+        self.manager.push_event({"name": "submit"})
+        self.assertEqual(
+            self.manager.events,
+            [{"type": "order-submitted", "data": {"submitted": True}}],
+        )
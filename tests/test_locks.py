@@ -0,0 +1,150 @@
+import threading
+import time
+
+from unittest import TestCase
+
+from pieuvre import BoundWorkflow, LockOrderError, Workflow
+from pieuvre.locks import StripedLockManager
+
+
+class Counter(object):
+
+    def __init__(self, pk=None):
+        self.pk = pk
+        self.state = "idle"
+        self.count = 0
+        self.saves = 0
+
+    def save(self):
+        self.saves += 1
+
+
+class CounterWorkflow(Workflow):
+
+    lock_manager = StripedLockManager()
+
+    transitions = [
+        {"name": "increment", "source": "*", "destination": "counted"},
+    ]
+
+    def before_increment(self):
+        count = self.model.count
+        # Let other threads run between the read and the write
+        time.sleep(0)
+        self.model.count = count + 1
+
+
+def hammer(target, threads=16):
+    workers = [threading.Thread(target=target) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+class TestStripedLockManager(TestCase):
+    def test_lock(self):
+        manager = StripedLockManager(stripes=8)
+        self.assertIs(manager.lock(Counter(pk=1)), manager.lock(Counter(pk=1)))
+        self.assertEqual(manager.get_key(Counter(pk=1)), (Counter, 1))
+
+        model = Counter()
+        self.assertEqual(manager.get_key(model), id(model))
+
+    def test_lock_order(self):
+        manager = StripedLockManager(stripes=8, order_timeout=.05)
+        low, high = Counter(pk=1), Counter(pk=2)
+        if manager.get_index(low) > manager.get_index(high):
+            low, high = high, low
+
+        # Out of order, but free
+        with manager.lock(high), manager.lock(low), manager.lock(high):
+            pass
+
+        holding = threading.Event()
+        waiting = []
+
+        def reverse():
+            with manager.lock(low):
+                holding.set()
+                with manager.lock(high):
+                    waiting.append(True)
+
+        worker = threading.Thread(target=reverse)
+        with manager.lock(high):
+            worker.start()
+            holding.wait(timeout=5)
+            # Would deadlock: the worker holds low and waits for high
+            with self.assertRaises(LockOrderError):
+                with manager.lock(low):
+                    pass
+        worker.join()
+
+        self.assertEqual(waiting, [True])
+        with manager.lock(low):
+            pass
+
+    def test_nested_transition_order(self):
+        manager = CounterWorkflow.lock_manager
+        low, high = Counter(pk=1), Counter(pk=2)
+        if manager.get_index(low) > manager.get_index(high):
+            low, high = high, low
+
+        class NestedWorkflow(CounterWorkflow):
+            def after_increment(self, result):
+                if self.model is high:
+                    # Lower stripe than the one held
+                    NestedWorkflow(model=low).increment()
+
+        NestedWorkflow(model=high).increment()
+        self.assertEqual((low.count, high.count), (1, 1))
+
+    def test_same_model(self):
+        model = Counter(pk=1)
+
+        def run():
+            workflow = CounterWorkflow(model=model)
+            for _ in range(100):
+                workflow.increment()
+
+        hammer(run)
+        self.assertEqual(model.count, 1600)
+        self.assertEqual(model.saves, 1600)
+
+    def test_shared_workflow(self):
+        models = [Counter(pk=pk) for pk in range(4)]
+        workflow = CounterWorkflow.shared()
+
+        def run():
+            bound = [BoundWorkflow(workflow, model) for model in models]
+            for _ in range(50):
+                for proxy in bound:
+                    proxy.increment()
+
+        hammer(run)
+        self.assertEqual([model.count for model in models], [800] * 4)
+
+    def test_different_models(self):
+        manager = CounterWorkflow.lock_manager
+        first = Counter(pk=1)
+        second = next(
+            Counter(pk=pk) for pk in range(2, 100)
+            if manager.lock(Counter(pk=pk)) is not manager.lock(first))
+        entered = threading.Event()
+        results = []
+
+        class BlockingWorkflow(CounterWorkflow):
+            def before_increment(self):
+                if self.model is first:
+                    # Wait for the transition of the other model
+                    results.append(entered.wait(timeout=5))
+                else:
+                    entered.set()
+
+        worker = threading.Thread(
+            target=BlockingWorkflow(model=first).increment)
+        worker.start()
+        BlockingWorkflow(model=second).increment()
+        worker.join()
+
+        self.assertEqual(results, [True])
@@ -0,0 +1,101 @@
+from unittest import TestCase, skipUnless
+
+from pieuvre import ForbiddenTransition
+from pieuvre.metrics import (
+    STAGES, Histogram, HistogramCollector, get_workflow_name, to_prometheus
+)
+from pieuvre.utils import ContextVar
+
+from .test_aio import MyAsyncOrder, MyAsyncWorkflow, run
+from .test_workflow import MyOrder, MyWorkflow
+
+
+class TestHistogram(TestCase):
+    def test_observe(self):
+        histogram = Histogram(buckets=(.1, 1.))
+        for value in (.05, .1, .5, 2.):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(histogram.count, 4)
+        self.assertAlmostEqual(histogram.sum, 2.65)
+        self.assertEqual(histogram.quantile(.5), .1)
+        self.assertEqual(histogram.quantile(1), float("inf"))
+
+        histogram.merge(histogram)
+        self.assertEqual(histogram.counts, [4, 2, 2])
+
+        with self.assertRaises(ValueError):
+            histogram.merge(Histogram(buckets=(1., )))
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        self.collector = HistogramCollector()
+
+        class MeasuredWorkflow(MyWorkflow):
+            metrics_collector = self.collector
+
+        self.workflow_class = MeasuredWorkflow
+
+    def test_stages(self):
+        self.workflow_class(model=MyOrder()).submit()
+        self.workflow_class(model=MyOrder()).reject()
+
+        for stage in STAGES:
+            histogram = self.collector.get(self.workflow_class, "submit", stage)
+            self.assertEqual(histogram.count, 1, stage)
+
+        self.assertIsNone(self.collector.get(self.workflow_class, "reject", "body"))
+        self.assertEqual(
+            self.collector.get(self.workflow_class, "reject", "save").count, 1)
+
+    def test_failed_transition(self):
+        model = MyOrder()
+        model.allow_submit = False
+        with self.assertRaises(ForbiddenTransition):
+            self.workflow_class(model=model).submit()
+
+        self.assertEqual(
+            self.collector.get(self.workflow_class, "submit", "check").count, 1)
+        self.assertIsNone(self.collector.get(self.workflow_class, "submit", "save"))
+
+    @skipUnless(ContextVar, "contextvars is not available")
+    def test_async_stages(self):
+        class MeasuredAsyncWorkflow(MyAsyncWorkflow):
+            metrics_collector = self.collector
+
+        run(MeasuredAsyncWorkflow(model=MyAsyncOrder()).submit())
+        for stage in STAGES:
+            histogram = self.collector.get(MeasuredAsyncWorkflow, "submit", stage)
+            self.assertEqual(histogram.count, 1, stage)
+
+    def test_disabled(self):
+        MyWorkflow(model=MyOrder()).submit()
+        self.assertEqual(self.collector.items(), [])
+
+    def test_to_prometheus(self):
+        self.collector.observe(self.workflow_class, "submit", "save", .003)
+        self.collector.observe(self.workflow_class, "submit", "save", 20.)
+
+        text = to_prometheus(self.collector, name="duration")
+        labels = 'workflow="{}",transition="submit",stage="save"'.format(
+            get_workflow_name(self.workflow_class))
+        self.assertIn("# TYPE duration histogram\n", text)
+        self.assertIn('duration_bucket{%s,le="0.0025"} 0\n' % labels, text)
+        self.assertIn('duration_bucket{%s,le="0.005"} 1\n' % labels, text)
+        self.assertIn('duration_bucket{%s,le="10.0"} 1\n' % labels, text)
+        self.assertIn('duration_bucket{%s,le="+Inf"} 2\n' % labels, text)
+        self.assertIn('duration_sum{%s} 20.003\n' % labels, text)
+        self.assertIn('duration_count{%s} 2\n' % labels, text)
+
+    def test_same_name(self):
+        class MeasuredWorkflow(MyWorkflow):
+            metrics_collector = self.collector
+
+        self.workflow_class(model=MyOrder()).submit()
+        self.assertIsNone(self.collector.get(MeasuredWorkflow, "submit", "save"))
+        self.assertEqual(
+            get_workflow_name(MeasuredWorkflow),
+            "tests.test_metrics.TestMetrics.test_same_name.<locals>."
+            "MeasuredWorkflow")
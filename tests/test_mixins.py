@@ -0,0 +1,114 @@
+from unittest import TestCase, skipUnless
+
+from pieuvre import (
+    BoundWorkflow, TransitionDoesNotExist, WorkflowEnabled,
+    WorkflowQuerySetMixin
+)
+from pieuvre.mixins import BooleanField, Case, CharField, Q, Value, When
+
+from .test_workflow import MyOrder, MyWorkflow
+
+
+class MyEnabledOrder(WorkflowEnabled, MyOrder):
+    workflow_class = MyWorkflow
+
+
+class MySharedOrder(MyEnabledOrder):
+    shared_workflow = True
+
+
+class MyOrderQuerySet(WorkflowQuerySetMixin):
+    # The Django part of the queryset is replaced by the arguments of its
+    # methods, to compare the generated expressions
+    model = MyEnabledOrder
+
+    def all(self):
+        return "all"
+
+    def none(self):
+        return "none"
+
+    def filter(self, condition):
+        return condition
+
+    def annotate(self, **annotations):
+        return annotations
+
+
+class TestWorkflowEnabled(TestCase):
+    def test_workflow(self):
+        order = MyEnabledOrder()
+        self.assertIsInstance(order.workflow, MyWorkflow)
+        self.assertIs(order.workflow, order.workflow)
+        self.assertIs(order.workflow.model, order)
+
+        order.workflow.submit()
+        self.assertEqual(order.state, "submitted")
+
+    def test_shared_workflow(self):
+        orders = [MySharedOrder() for _ in range(3)]
+        for order in orders:
+            self.assertIsInstance(order.workflow, BoundWorkflow)
+            self.assertIs(order.workflow.workflow, MyWorkflow.shared())
+            order.workflow.submit()
+
+        self.assertEqual({order.state for order in orders}, {"submitted"})
+        self.assertTrue(all(order.submit_called for order in orders))
+        self.assertIs(orders[0].workflow, orders[0].workflow)
+
+
+class TestWorkflowQuerySetMixin(TestCase):
+    def test_get_source_states(self):
+        queryset = MyOrderQuerySet()
+        self.assertIs(queryset.get_workflow_class(), MyWorkflow)
+        self.assertEqual(queryset.get_source_states("submit"), ["draft"])
+        self.assertIsNone(queryset.get_source_states("reject"))
+        with self.assertRaises(TransitionDoesNotExist):
+            queryset.get_source_states("launch")
+
+    def test_get_states_by_transitions(self):
+        self.assertEqual(MyOrderQuerySet().get_states_by_transitions(), {
+            ("submit", "reject"): ["draft"],
+            ("complete", "reject"): ["submitted"],
+            ("reject", ): ["completed", "rejected"],
+        })
+
+    def test_split_transitions(self):
+        queryset = MyOrderQuerySet()
+        self.assertEqual(
+            queryset.split_transitions("submit,reject"), ["submit", "reject"])
+        self.assertEqual(queryset.split_transitions(""), [])
+
+    def test_available_for_without_names(self):
+        self.assertEqual(MyOrderQuerySet().available_for(), "none")
+
+    @skipUnless(Q, "Django is not installed")
+    def test_available_for(self):
+        queryset = MyOrderQuerySet()
+        self.assertEqual(
+            queryset.available_for("submit"), Q(state__in=["draft"]))
+        self.assertEqual(
+            queryset.available_for("submit", "complete"),
+            Q(state__in=["draft"]) | Q(state__in=["submitted"]))
+        self.assertEqual(queryset.available_for("submit", "reject"), "all")
+        with self.assertRaises(TransitionDoesNotExist):
+            queryset.available_for("launch")
+
+    @skipUnless(Q, "Django is not installed")
+    def test_annotate_transitions(self):
+        annotations = MyOrderQuerySet().annotate_transitions(
+            "submit", "reject", prefix="may_")
+        self.assertEqual(annotations, {
+            "may_submit": Case(
+                When(Q(state__in=["draft"]), then=Value(True)),
+                default=Value(False), output_field=BooleanField()),
+            "may_reject": Value(True, output_field=BooleanField()),
+        })
+
+    @skipUnless(Q, "Django is not installed")
+    def test_annotate_available_transitions(self):
+        annotations = MyOrderQuerySet().annotate_available_transitions()
+        self.assertEqual(annotations, {"available_transitions": Case(
+            When(Q(state__in=["draft"]), then=Value("submit,reject")),
+            When(Q(state__in=["submitted"]), then=Value("complete,reject")),
+            default=Value("reject"), output_field=CharField())})
@@ -0,0 +1,191 @@
+import os
+import sqlite3
+import tempfile
+
+from unittest import TestCase
+
+from pieuvre import Workflow
+from pieuvre.outbox import (
+    OutboxEventManager, OutboxWorker, SQLiteOutboxStore, main
+)
+from pieuvre.sinks import MemorySink, Sink
+
+from .test_workflow import MyOrder
+
+# Sink of the command line test
+cli_sink = MemorySink()
+
+
+def get_cli_sink():
+    return cli_sink
+
+
+class CountingStore(SQLiteOutboxStore):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.inserts = 0
+
+    def insert(self, events):
+        self.inserts += 1
+        super().insert(events)
+
+
+store = CountingStore(sqlite3.connect(":memory:", check_same_thread=False))
+store.create_table()
+
+
+class OrderOutboxManager(OutboxEventManager):
+
+    outbox_store = store
+
+    supported_transitions = {
+        "submit": {"event_type": "order-submitted", "data": lambda: {}},
+        "complete": {"event_type": "order-completed", "data": lambda: {}},
+    }
+
+
+class OutboxWorkflow(Workflow):
+
+    event_manager_classes = (OrderOutboxManager, )
+
+    transitions = [
+        {"name": "submit", "source": "draft", "destination": "submitted"},
+        {"name": "complete", "source": "submitted", "destination": "completed"},
+    ]
+
+    def after_submit(self, result):
+        if self.model.allow_submit == "fail":
+            raise ValueError()
+        self.complete()
+
+
+class FailingSink(Sink):
+    def publish(self, events):
+        raise ValueError()
+
+
+class TestOutbox(TestCase):
+    def setUp(self):
+        store.connection.execute("DELETE FROM pieuvre_outbox")
+        store.inserts = 0
+
+    def test_transition(self):
+        model = MyOrder()
+        OutboxWorkflow(model=model).submit()
+
+        self.assertEqual(model.state, "completed")
+        self.assertEqual(store.count(), 2)
+        # Events of nested transitions are inserted together
+        self.assertEqual(store.inserts, 1)
+
+        records = store.claim(batch_size=10)
+        self.assertEqual(
+            [record.event["type"] for record in records],
+            ["order-completed", "order-submitted"])
+        self.assertEqual(store.claim(batch_size=10), [])
+
+        store.release(records[:1])
+        claimed = store.claim(batch_size=10)
+        self.assertEqual(len(claimed), 1)
+
+        # The released event is held by another claim
+        store.release(records[:1])
+        self.assertEqual(store.ack(records), 1)
+        self.assertEqual(store.ack(claimed), 1)
+        self.assertEqual(store.count(), 0)
+
+    def test_failed_transition(self):
+        model = MyOrder()
+        model.allow_submit = "fail"
+        with self.assertRaises(ValueError):
+            OutboxWorkflow(model=model).submit()
+        self.assertEqual(store.count(), 0)
+
+    def test_bulk_run_transition(self):
+        models = [MyOrder(state="submitted") for _ in range(5)]
+        OutboxWorkflow.bulk_run_transition("complete", models, chunk_size=2)
+        self.assertEqual(store.count(), 5)
+        self.assertEqual(store.inserts, 3)
+
+    def test_worker(self):
+        for _ in range(3):
+            OutboxWorkflow(model=MyOrder()).submit()
+
+        sink = MemorySink()
+        worker = OutboxWorker(store, sink, batch_size=4)
+        self.assertEqual(worker.drain(), 6)
+        self.assertEqual(store.count(), 0)
+        self.assertEqual(len(sink.events), 6)
+        self.assertEqual(sink.events[0]["type"], "order-completed")
+        self.assertIn("outbox_id", sink.events[0])
+
+    def test_worker_failure(self):
+        OutboxWorkflow(model=MyOrder()).submit()
+
+        worker = OutboxWorker(store, FailingSink())
+        with self.assertLogs("pieuvre.outbox"):
+            self.assertEqual(worker.drain(), 0)
+        self.assertEqual(worker.failed, 2)
+        # Released events are published later
+        self.assertEqual(OutboxWorker(store, MemorySink()).drain(), 2)
+
+    def test_worker_store_failure(self):
+        class FailingStore(CountingStore):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.errors = 2
+
+            def claim(self, *args, **kwargs):
+                if self.errors:
+                    self.errors -= 1
+                    raise sqlite3.OperationalError("database is locked")
+                return super().claim(*args, **kwargs)
+
+        failing_store = FailingStore(store.connection)
+        OutboxWorkflow(model=MyOrder()).submit()
+
+        sink = MemorySink()
+        worker = OutboxWorker(
+            failing_store, sink, poll_interval=0.01, max_backoff=0.02)
+        with self.assertLogs("pieuvre.outbox") as logs:
+            worker.start()
+            for _ in range(500):
+                if worker.published == 2:
+                    break
+                worker._stop.wait(0.01)
+            worker.stop()
+
+        # The worker survives the errors of the store
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(len(sink.events), 2)
+
+    def test_thread(self):
+        OutboxWorkflow(model=MyOrder()).submit()
+
+        sink = MemorySink()
+        worker = OutboxWorker(store, sink, poll_interval=0.01)
+        worker.start()
+        OutboxWorkflow(model=MyOrder()).submit()
+        for _ in range(500):
+            if worker.published == 4:
+                break
+            worker._stop.wait(0.01)
+        worker.stop()
+        self.assertEqual(len(sink.events), 4)
+
+    def test_main(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+
+        file_store = SQLiteOutboxStore(path)
+        file_store.create_table()
+        file_store.insert([{"type": "order-submitted", "data": {}}])
+
+        status = main([
+            "--sqlite", path, "--sink", "tests.test_outbox:get_cli_sink",
+            "--once"])
+        self.assertEqual(status, 0)
+        self.assertEqual(cli_sink.events[-1]["type"], "order-submitted")
+        self.assertEqual(file_store.count(), 0)
@@ -0,0 +1,92 @@
+from unittest import TestCase
+
+from pieuvre.replay import MemoryStateStore, StateReplayer
+
+from .test_workflow import MyWorkflow
+
+
+def record(model, transition, from_state, to_state, timestamp=0):
+    return {
+        "model": model, "transition": transition, "from_state": from_state,
+        "to_state": to_state, "timestamp": timestamp,
+    }
+
+
+LOG = [
+    record(1, "submit", "draft", "submitted"),
+    record(1, "complete", "submitted", "completed"),
+    record(2, "submit", "draft", "submitted"),
+    record(3, "submit", "draft", "submitted"),
+    record(3, "reject", "submitted", "rejected"),
+    # Not in the workflow
+    record(3, "archive", "rejected", "archived"),
+    # From an invalid state
+    record(3, "complete", "rejected", "completed"),
+]
+
+
+class TestStateReplayer(TestCase):
+    def setUp(self):
+        self.store = MemoryStateStore({
+            1: "completed", 2: "completed", 3: "draft", 4: "draft"})
+
+    def test_fold(self):
+        replayer = StateReplayer(MyWorkflow, self.store)
+        self.assertEqual(
+            dict(replayer.fold(LOG)),
+            {1: "completed", 2: "submitted", 3: "rejected"})
+
+    def test_replay(self):
+        replayer = StateReplayer(MyWorkflow, self.store, batch_size=2)
+        result = replayer.replay(iter(LOG))
+
+        self.assertEqual(self.store.states, {
+            1: "completed", 2: "submitted", 3: "rejected", 4: "draft"})
+        self.assertEqual(result.records, 7)
+        self.assertEqual(result.models, 3)
+        self.assertEqual(result.changed, 2)
+        self.assertEqual(result.written, 2)
+        self.assertEqual(
+            result.diff,
+            [(2, "completed", "submitted"), (3, "draft", "rejected")])
+        self.assertEqual(
+            [(anomaly.transition, anomaly.state, anomaly.reason)
+             for anomaly in result.anomalies],
+            [("archive", "rejected", "unknown transition"),
+             ("complete", "rejected", "invalid source")])
+
+    def test_dry_run(self):
+        replayer = StateReplayer(
+            MyWorkflow, self.store, dry_run=True, max_report=1)
+        result = replayer.replay(LOG)
+
+        self.assertEqual(self.store.states[2], "completed")
+        self.assertEqual(result.changed, 2)
+        self.assertEqual(result.written, 0)
+        self.assertEqual(result.diff, [(2, "completed", "submitted")])
+        self.assertEqual(len(result.anomalies), 1)
+        self.assertEqual(result.anomalies_count, 2)
+
+    def test_destination_mismatch(self):
+        replayer = StateReplayer(MyWorkflow, self.store)
+        result = replayer.replay([record(4, "submit", "draft", "completed")])
+        self.assertEqual(self.store.states[4], "submitted")
+        self.assertEqual(result.anomalies[0].reason, "destination mismatch")
+
+        replayer = StateReplayer(MyWorkflow, self.store, trust_log=True)
+        result = replayer.replay([record(4, "submit", "draft", "completed")])
+        self.assertEqual(self.store.states[4], "completed")
+        self.assertEqual(result.anomalies[0].reason, "destination mismatch")
+
+    def test_replay_sharded(self):
+        def get_records(shard, shards):
+            return [rec for rec in LOG if rec["model"] % shards == shard]
+
+        replayer = StateReplayer(MyWorkflow, self.store)
+        result = replayer.replay_sharded(get_records, shards=2)
+
+        self.assertEqual(self.store.states, {
+            1: "completed", 2: "submitted", 3: "rejected", 4: "draft"})
+        self.assertEqual(result.models, 3)
+        self.assertEqual(result.changed, 2)
+        self.assertEqual(result.anomalies_count, 2)
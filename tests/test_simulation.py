@@ -0,0 +1,92 @@
+from unittest import TestCase, skipUnless
+
+from pieuvre import Workflow
+from pieuvre.simulation import (
+    WorkflowSimulator, constant, exponential, np, uniform
+)
+
+
+class OrderWorkflow(Workflow):
+
+    transitions = [
+        {"name": "submit", "source": "draft", "destination": "submitted"},
+        {"name": "pay", "source": "submitted", "destination": "paid"},
+        {"name": "abandon", "source": ["draft", "submitted"],
+         "destination": "abandoned"},
+        {"name": "retry", "source": "abandoned", "destination": "draft"},
+    ]
+
+
+@skipUnless(np, "NumPy is not installed")
+class TestWorkflowSimulator(TestCase):
+    def test_compile(self):
+        simulator = WorkflowSimulator(
+            OrderWorkflow, probabilities={"submit": 3, "abandon": 1, "pay": 1})
+        self.assertEqual(
+            set(simulator.states), {"draft", "submitted", "paid", "abandoned"})
+
+        draft = simulator.states.index("draft")
+        self.assertEqual(
+            simulator._cumulative[draft, :2].tolist(), [0.75, 1.])
+        self.assertEqual(
+            [state for state, final in zip(simulator.states, simulator._final)
+             if final],
+            ["paid", "abandoned"])
+
+    def test_run(self):
+        simulator = WorkflowSimulator(
+            OrderWorkflow,
+            probabilities={"submit": 0.75, "pay": 0.8, "abandon": 0.25},
+            delays={"submit": 1, "pay": uniform(0.5, 1.5),
+                    "abandon": constant(2)})
+        result = simulator.run(10000, "draft", horizon=5, seed=1)
+
+        self.assertEqual(result.times.tolist(), [0., 1., 2., 3., 4., 5.])
+        queues = result.expected_queue_sizes()
+        self.assertEqual(queues["draft"][0], 10000)
+        # Abandoned drafts leave after 2 steps
+        self.assertAlmostEqual(queues["draft"][1], 2500, delta=150)
+        self.assertEqual(queues["draft"][2:].tolist(), [0, 0, 0, 0])
+        # Instances are conserved
+        self.assertTrue((result.queue_sizes.sum(axis=1) == 10000).all())
+
+        final = result.final_distribution()
+        # Weights are normalized per source state
+        self.assertAlmostEqual(
+            final["paid"], 10000 * 0.75 * 0.8 / 1.05, delta=150)
+        self.assertEqual(final["paid"] + final["abandoned"], 10000)
+        self.assertEqual(result.transition_counts["pay"], final["paid"])
+        self.assertEqual(
+            result.transition_counts["abandon"], final["abandoned"])
+
+    def test_runs_and_arrivals(self):
+        simulator = WorkflowSimulator(
+            OrderWorkflow,
+            probabilities={"submit": 1, "pay": 1},
+            delays={"submit": exponential(2.), "pay": exponential(1.)})
+        result = simulator.run(
+            0, "draft", horizon=200, runs=4, arrival_rate=50, seed=2)
+
+        # Little's law: the queues converge to rate * mean delay
+        queues = result.expected_queue_sizes()
+        self.assertAlmostEqual(queues["draft"][-50:].mean(), 100, delta=10)
+        self.assertAlmostEqual(queues["submitted"][-50:].mean(), 50, delta=7)
+        self.assertAlmostEqual(
+            result.transition_counts["submit"], 50 * 200, delta=500)
+
+    def test_zero_delay_loop(self):
+        simulator = WorkflowSimulator(
+            OrderWorkflow, probabilities={"abandon": 1, "retry": 1},
+            delays={"abandon": 0, "retry": 0})
+        with self.assertRaises(ValueError):
+            simulator.run(10, "draft", horizon=1)
+
+    def test_negative_weight(self):
+        with self.assertRaises(ValueError):
+            WorkflowSimulator(
+                OrderWorkflow, probabilities={"submit": 1, "pay": -0.5})
+
+    def test_unknown_state(self):
+        simulator = WorkflowSimulator(OrderWorkflow, probabilities={})
+        with self.assertRaises(ValueError):
+            simulator.run(10, "launched", horizon=1)
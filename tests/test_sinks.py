@@ -0,0 +1,205 @@
+import os
+import tempfile
+import time
+
+from unittest import TestCase, skipUnless
+
+from pieuvre import Workflow, utils
+from pieuvre.sinks import (
+    BatchingSink, JSONLinesFileSink, JSONEncoder, LengthPrefixedFileSink,
+    MemoryBatchSink, Sink, SinkEventManager, get_encoder, msgpack, orjson,
+    read_length_prefixed
+)
+
+from .test_workflow import MyOrder
+
+
+class CountingSink(MemoryBatchSink):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.published = 0
+
+    def publish(self, events):
+        self.published += 1
+        super().publish(events)
+
+
+sink = CountingSink(encoder=JSONEncoder(), max_delay=None)
+
+
+class OrderSinkManager(SinkEventManager):
+
+    sink = sink
+
+    supported_transitions = {
+        "submit": {"event_type": "order-submitted", "data": lambda: {}},
+        "complete": {"event_type": "order-completed", "data": lambda: {}},
+    }
+
+
+class SinkWorkflow(Workflow):
+
+    event_manager_classes = (OrderSinkManager, )
+
+    transitions = [
+        {"name": "submit", "source": "draft", "destination": "submitted"},
+        {"name": "complete", "source": "submitted", "destination": "completed"},
+    ]
+
+    def after_submit(self, result):
+        if self.model.allow_submit == "fail":
+            raise ValueError()
+        self.complete()
+
+
+def make_path(test):
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    test.addCleanup(os.remove, path)
+    return path
+
+
+class TestBatchingSink(TestCase):
+    def test_max_events(self):
+        sink = MemoryBatchSink(encoder=JSONEncoder(), max_events=3,
+                               max_delay=None)
+        sink.publish([{"n": 1}, {"n": 2}])
+        self.assertEqual(sink.payloads, [])
+        sink.publish([{"n": 3}, {"n": 4}])
+        self.assertEqual(len(sink.payloads), 1)
+        self.assertEqual(sink.written, 4)
+
+        sink.close()
+        self.assertEqual(
+            [event["n"] for event in sink.get_events()], [1, 2, 3, 4])
+        self.assertEqual(sink.batches, 1)
+
+    def test_max_bytes(self):
+        sink = MemoryBatchSink(encoder=JSONEncoder(), max_bytes=20,
+                               max_delay=None)
+        sink.publish([{"data": "x" * 5}])
+        self.assertEqual(sink.payloads, [])
+        sink.publish([{"data": "x" * 5}])
+        self.assertEqual(sink.written, 2)
+
+    def test_max_delay(self):
+        sink = MemoryBatchSink(encoder=JSONEncoder(), max_delay=0.01)
+        sink.publish([{"n": 1}])
+        for _ in range(500):
+            if sink.written:
+                break
+            time.sleep(0.01)
+        self.assertEqual(sink.written, 1)
+        self.assertIsNone(sink._timer)
+
+    def test_json_lines(self):
+        path = make_path(self)
+        sink = JSONLinesFileSink(path, encoder=get_encoder("json"))
+        sink.publish([{"n": 1, "data": "a\nb"}, {"n": 2}])
+        sink.publish([{"n": 3}])
+        sink.close()
+
+        with open(path) as events_file:
+            lines = events_file.read().splitlines()
+        self.assertEqual(
+            lines, ['{"n":1,"data":"a\\nb"}', '{"n":2}', '{"n":3}'])
+
+    def test_close_at_exit(self):
+        path = make_path(self)
+        sink = JSONLinesFileSink(path, encoder=JSONEncoder(), max_delay=None)
+        sink.publish([{"n": 1}])
+        utils._call_exit_methods()
+
+        with open(path) as events_file:
+            self.assertEqual(events_file.read().splitlines(), ['{"n":1}'])
+        sink.close()
+
+    def test_length_prefixed(self):
+        path = make_path(self)
+        sink = LengthPrefixedFileSink(path, encoder=JSONEncoder())
+        sink.publish([{"n": 1}, {"n": 2}])
+        sink.flush()
+        sink.publish([{"n": 3}])
+        sink.close()
+
+        self.assertEqual(
+            list(read_length_prefixed(path, JSONEncoder())),
+            [{"n": 1}, {"n": 2}, {"n": 3}])
+
+    @skipUnless(orjson, "orjson is not installed")
+    def test_orjson(self):
+        encoder = get_encoder("orjson")
+        self.assertEqual(encoder.decode(encoder.encode({"n": 1})), {"n": 1})
+        self.assertEqual(
+            encoder.encode({"n": 1}), JSONEncoder().encode({"n": 1}))
+
+    @skipUnless(msgpack, "msgpack is not installed")
+    def test_msgpack(self):
+        path = make_path(self)
+        encoder = get_encoder("msgpack")
+        with self.assertRaises(ValueError):
+            JSONLinesFileSink(path, encoder=encoder)
+
+        sink = LengthPrefixedFileSink(path, encoder=encoder)
+        sink.publish([{"n": 1}, {"n": 2}])
+        sink.close()
+        self.assertEqual(
+            list(read_length_prefixed(path, encoder)), [{"n": 1}, {"n": 2}])
+
+    @skipUnless(msgpack is None, "msgpack is installed")
+    def test_abstract_methods(self):
+        class IncompleteSink(Sink):
+            pass
+
+        class IncompleteBatchingSink(BatchingSink):
+            pass
+
+        with self.assertRaises(TypeError):
+            IncompleteSink()
+        with self.assertRaises(TypeError):
+            IncompleteBatchingSink(encoder=JSONEncoder())
+
+    def test_missing_encoder(self):
+        with self.assertRaises(ImportError):
+            get_encoder("msgpack")
+
+
+class TestSinkEventManager(TestCase):
+    def setUp(self):
+        sink.flush()
+        sink.payloads = []
+        sink.published = 0
+
+    def test_transition(self):
+        SinkWorkflow(model=MyOrder()).submit()
+        sink.flush()
+        self.assertEqual(sink.published, 1)
+        self.assertEqual(
+            [event["type"] for event in sink.get_events()],
+            ["order-completed", "order-submitted"])
+
+    def test_failed_transition(self):
+        model = MyOrder()
+        model.allow_submit = "fail"
+        with self.assertRaises(ValueError):
+            SinkWorkflow(model=model).submit()
+        sink.flush()
+        self.assertEqual(sink.get_events(), [])
+
+    def test_bulk_run_transition(self):
+        models = [MyOrder(state="submitted") for _ in range(5)]
+        SinkWorkflow.bulk_run_transition("complete", models, chunk_size=2)
+        sink.flush()
+        self.assertEqual(sink.published, 3)
+        self.assertEqual(len(sink.get_events()), 5)
+
+    def test_push_events(self):
+        manager = OrderSinkManager(MyOrder())
+        manager.push_events([
+            {"name": "submit"}, {"name": "cancel"}, {"name": "complete"}])
+        sink.flush()
+        self.assertEqual(sink.published, 1)
+        self.assertEqual(
+            [event["type"] for event in sink.get_events()],
+            ["order-submitted", "order-completed"])
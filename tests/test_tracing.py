@@ -0,0 +1,128 @@
+import json
+import os
+import tempfile
+
+from io import StringIO
+from unittest import TestCase, skipUnless
+
+from pieuvre import ForbiddenTransition
+from pieuvre.tracing import (
+    ConsoleSpanExporter, FileSpanExporter, InMemorySpanExporter, Tracer
+)
+from pieuvre.utils import ContextVar
+
+from .test_aio import MyAsyncOrder, MyAsyncWorkflow, run
+from .test_workflow import MyOrder, MyWorkflow
+
+
+class TestTracer(TestCase):
+    def test_nesting(self):
+        exporter = InMemorySpanExporter()
+        tracer = Tracer(exporter)
+
+        with tracer.start_span("root", {"key": "value"}) as root:
+            with tracer.start_span("child") as child:
+                self.assertIs(tracer.get_current_span(), child)
+            self.assertIs(tracer.get_current_span(), root)
+        self.assertIsNone(tracer.get_current_span())
+
+        self.assertEqual(exporter.spans, [child, root])
+        self.assertIs(child.parent, root)
+        self.assertEqual(child.trace_id, root.trace_id)
+        self.assertEqual(child.depth, 1)
+        self.assertEqual(root.to_dict()["attributes"], {"key": "value"})
+        self.assertEqual(child.to_dict()["parent_id"], root.span_id)
+
+    def test_exception(self):
+        exporter = InMemorySpanExporter()
+        with self.assertRaises(ValueError):
+            with Tracer(exporter).start_span("root"):
+                raise ValueError("boom")
+
+        self.assertEqual(exporter.spans[0].error, "ValueError: boom")
+
+    def test_console_exporter(self):
+        stream = StringIO()
+        tracer = Tracer(ConsoleSpanExporter(stream))
+        with tracer.start_span("root", {"pk": 1}):
+            with tracer.start_span("child"):
+                pass
+
+        child, root = stream.getvalue().splitlines()
+        self.assertTrue(child.startswith("  child "))
+        self.assertTrue(root.startswith("root "))
+        self.assertTrue(root.endswith(" pk=1"))
+
+    def test_file_exporter(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+
+        tracer = Tracer(FileSpanExporter(path))
+        with tracer.start_span("root", {"pk": 1}):
+            pass
+
+        with open(path) as spans_file:
+            span = json.loads(spans_file.readline())
+        self.assertEqual(span["name"], "root")
+        self.assertEqual(span["attributes"], {"pk": 1})
+        self.assertIsNone(span["parent_id"])
+
+
+class TestWorkflowTracing(TestCase):
+    def setUp(self):
+        self.exporter = InMemorySpanExporter()
+
+        class TracedWorkflow(MyWorkflow):
+            tracer = Tracer(self.exporter)
+
+        self.workflow_class = TracedWorkflow
+
+    def test_spans(self):
+        self.workflow_class(model=MyOrder()).submit()
+
+        spans = {span.name: span for span in self.exporter.spans}
+        root = spans["transition"]
+        self.assertIsNone(root.parent)
+        self.assertEqual(root.attributes, {
+            "workflow": "TracedWorkflow",
+            "transition": "submit",
+            "model": None,
+            "source": "draft",
+            "destination": "submitted",
+        })
+        self.assertEqual(self.exporter.spans[-1], root)
+
+        for stage in ("check", "before", "exit_hooks", "body", "enter_hooks",
+                      "after", "save", "log", "events"):
+            self.assertIs(spans[stage].parent, root, stage)
+            self.assertEqual(spans[stage].attributes["transition"], "submit")
+
+    def test_failed_transition(self):
+        model = MyOrder()
+        model.allow_submit = False
+        with self.assertRaises(ForbiddenTransition):
+            self.workflow_class(model=model).submit()
+
+        names = [span.name for span in self.exporter.spans]
+        self.assertEqual(names, ["check", "transition"])
+        self.assertTrue(self.exporter.spans[0].error.startswith(
+            "ForbiddenTransition"))
+        self.assertIsNotNone(self.exporter.spans[1].error)
+
+    @skipUnless(ContextVar, "contextvars is not available")
+    def test_async_spans(self):
+        class TracedAsyncWorkflow(MyAsyncWorkflow):
+            tracer = Tracer(self.exporter)
+
+        run(TracedAsyncWorkflow(model=MyAsyncOrder()).submit())
+
+        root = self.exporter.spans[-1]
+        self.assertEqual(root.name, "transition")
+        self.assertEqual(len(self.exporter.spans), 10)
+        for span in self.exporter.spans[:-1]:
+            self.assertIs(span.parent, root)
+
+    def test_disabled(self):
+        MyWorkflow(model=MyOrder()).submit()
+        self.assertEqual(self.exporter.spans, [])
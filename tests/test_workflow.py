@@ -1,8 +1,10 @@
 import uuid
 
-from unittest import TestCase
+from unittest import TestCase, mock
 
 from pieuvre import (
+    BoundWorkflow,
+    ConcurrentTransition,
     Workflow,
     InvalidTransition,
     TransitionDoesNotExist,
@@ -13,6 +15,11 @@ from pieuvre import (
     on_exit_state_check,
 )
 
+from pieuvre import cas
+from pieuvre.unit_of_work import UnitOfWork
+
+from .test_events import MyEventManager
+
 
 class MyOrder(object):
     """
@@ -44,6 +51,49 @@ class MyOrder(object):
         self.is_saved = True
 
 
+class Field(object):
+    def __init__(self, attname, primary_key=False):
+        self.attname = attname
+        self.primary_key = primary_key
+
+    def pre_save(self, model, add):
+        return getattr(model, self.attname)
+
+
+class MyTrackedOrder(MyOrder):
+    """
+    Mock a django model with its ``_meta`` fields, recording the
+    ``update_fields`` passed to save.
+    """
+
+    class _meta:
+        concrete_fields = [
+            Field("id", primary_key=True),
+            Field("comment"),
+            Field("allow_submit"),
+            Field("data"),
+        ]
+
+        @classmethod
+        def get_field(cls, name):
+            for field in cls.concrete_fields:
+                if field.attname == name:
+                    return field
+            # The state of the mock is not a concrete field
+            return Field(name)
+
+    def __init__(self, state="draft"):
+        super().__init__(state=state)
+        self.id = 1
+        self.comment = ""
+        self.data = {}
+        self.update_fields = None
+
+    def save(self, update_fields=None):
+        super().save()
+        self.update_fields = update_fields
+
+
 class LoggingModel(object):
 
     logs = {}
@@ -246,6 +296,60 @@ class TestWorkflow(TestCase):
         self.assertEqual(e.kwargs["current_state"], "draft")
         self.assertEqual(e.kwargs["to_state"], transition_with_check["destination"])
 
+    def test_overridden_stages(self):
+        calls = []
+
+        class OverridingWorkflow(MyWorkflow):
+            def check_transition_condition(self, transition, *args, **kwargs):
+                calls.append("check")
+                if transition["name"] == "submit":
+                    raise ForbiddenTransition(
+                        transition=transition["name"],
+                        current_state=self.state,
+                        to_state=transition["destination"])
+                super().check_transition_condition(transition, *args, **kwargs)
+
+            def _on_enter_state(self, transition):
+                calls.append("enter")
+                super()._on_enter_state(transition)
+
+        self.assertEqual(MyWorkflow._overridden_stages, frozenset())
+        self.assertEqual(
+            OverridingWorkflow._overridden_stages,
+            {"check_transition_condition", "_on_enter_state"})
+
+        workflow = OverridingWorkflow(model=self.model)
+        with self.assertRaises(ForbiddenTransition):
+            workflow.submit()
+        self.assertEqual(self.model.state, "draft")
+        self.assertFalse(hasattr(self.model, "submit_called"))
+
+        workflow.reject()
+        self.assertEqual(calls, ["check", "check", "enter"])
+        self.assertEqual(self.model.state, "rejected")
+        self.assertTrue(self.model.is_saved)
+
+    def test_instance_hooks(self):
+        with mock.patch.object(self.workflow, "after_submit") as after_submit:
+            self.workflow.on_enter_submitted = mock.Mock()
+            self.workflow.check_submit = lambda: True
+            self.model.allow_submit = False
+            self.workflow.submit()
+
+            after_submit.assert_called_once_with(None)
+            self.workflow.on_enter_submitted.assert_called_once()
+            self.assertFalse(hasattr(self.model, "after_submit_called"))
+            # Same series as the workflow class
+            self.assertTrue(isinstance(self.workflow, MyWorkflow))
+            self.assertEqual(type(self.workflow).__qualname__, "MyWorkflow")
+
+        del self.workflow.on_enter_submitted
+        del self.workflow.check_submit
+        self.assertIs(type(self.workflow), MyWorkflow)
+
+        self.workflow.complete()
+        self.assertEqual(self.model.state, "completed")
+
     def test_execute_transition(self):
         self.model.is_saved = False
 
@@ -295,3 +399,743 @@ class TestWorkflow(TestCase):
             self.workflow.get_next_available_states("completed"),
             [{"state": "rejected", "label": None}],
         )
+
+    def test_transition_index_per_subclass(self):
+        class OtherWorkflow(MyWorkflow):
+            transitions = [
+                {"name": "archive", "source": "*", "destination": "archived"},
+            ]
+
+        self.assertTrue(OtherWorkflow.is_transition("archive"))
+        self.assertFalse(OtherWorkflow.is_transition("submit"))
+        self.assertFalse(MyWorkflow.is_transition("archive"))
+
+        OtherWorkflow.transitions = MyWorkflow.transitions
+        self.assertTrue(OtherWorkflow.is_transition("submit"))
+        self.assertFalse(OtherWorkflow.is_transition("archive"))
+
+    def test_transitions_list(self):
+        transitions = [
+            {"name": "archive", "source": "*", "destination": "archived"},
+        ]
+
+        class OtherWorkflow(MyWorkflow):
+            pass
+
+        OtherWorkflow.transitions = transitions
+        self.assertIs(OtherWorkflow.transitions, transitions)
+        self.assertEqual(
+            OtherWorkflow(model=MyOrder()).get_all_transitions(), transitions)
+
+        # In-place changes are indexed once the list is assigned again
+        OtherWorkflow.transitions.append(
+            {"name": "submit", "source": "draft", "destination": "submitted"})
+        OtherWorkflow.transitions = OtherWorkflow.transitions
+        self.assertTrue(OtherWorkflow.is_transition("submit"))
+
+    def test_recompile_subclasses(self):
+        class ParentWorkflow(MyWorkflow):
+            pass
+
+        class ChildWorkflow(ParentWorkflow):
+            pass
+
+        ParentWorkflow.transitions = [
+            {"name": "archive", "source": "*", "destination": "archived"},
+        ]
+        self.assertTrue(ChildWorkflow.is_transition("archive"))
+        self.assertFalse(ChildWorkflow.is_transition("submit"))
+
+        ParentWorkflow.check_archive = lambda workflow: False
+        self.assertIsNotNone(ChildWorkflow._compiled_transitions["archive"].check)
+
+        del ParentWorkflow.check_archive
+        self.assertIsNone(ChildWorkflow._compiled_transitions["archive"].check)
+        del ParentWorkflow.transitions
+        self.assertTrue(ChildWorkflow.is_transition("submit"))
+        self.assertFalse(ParentWorkflow.is_transition("archive"))
+
+    def test_hook_registry(self):
+        registry = MyWorkflow._hook_registry
+        self.assertEqual(
+            [func.__name__ for func in registry["_on_enter_state_check"]["submitted"]],
+            ["another_submitted_check", "check_entering_submitted"],
+        )
+        self.assertEqual(
+            [func.__name__ for func in registry["_on_exit_state_check"]["draft"]],
+            ["check_leaving_draft"],
+        )
+        # Hooks are class-level
+        checks = self.workflow._on_exit_state_check["draft"]
+        self.assertIs(
+            self.workflow._on_exit_state_check,
+            registry["_on_exit_state_check"])
+        self.assertIs(checks[0], MyWorkflow.check_leaving_draft)
+        self.assertNotIn("_on_exit_state_check", self.workflow.__dict__)
+
+        # Registries are immutable
+        with self.assertRaises(TypeError):
+            self.workflow._on_exit_state_check["submitted"] = checks
+        with self.assertRaises(AttributeError):
+            checks.append(None)
+
+    def test_core_names(self):
+        from pieuvre import core, decorators
+
+        self.assertIs(core.Transition, transition)
+        self.assertIs(core.OnEnterState, decorators.OnEnterState)
+        self.assertIs(core.OnExitState, decorators.OnExitState)
+        self.assertIs(core.OnEnterStateCheck, on_enter_state_check)
+        self.assertIs(core.OnExitStateCheck, on_exit_state_check)
+        self.assertEqual(core.ON_ENTER_STATE_PREFIX, "on_enter_")
+        self.assertEqual(core.CHECK_TRANSITION_PREFIX, "check_")
+
+    def test_compiled_transition(self):
+        compiled = MyWorkflow._compiled_transitions["submit"]
+        self.assertEqual(compiled.destination, "submitted")
+        self.assertIs(compiled.check, MyWorkflow.check_submit)
+        self.assertIs(compiled.before, MyWorkflow.before_submit)
+        self.assertIs(compiled.after, MyWorkflow.after_submit)
+        self.assertIsNotNone(compiled.body)
+        self.assertEqual(compiled.enter_hooks, (MyWorkflow.on_enter_submitted,))
+        self.assertEqual(MyWorkflow._exit_hooks["draft"], (MyWorkflow.on_exit_draft,))
+
+        compiled = MyWorkflow._compiled_transitions["reject"]
+        self.assertIsNone(compiled.body)
+        self.assertIsNone(compiled.method)
+        self.assertEqual(compiled.enter_hooks, ())
+
+    def test_state_hooks_do_not_accumulate(self):
+        calls = []
+
+        class CountingWorkflow(MyWorkflow):
+            def on_enter_rejected(self, transition):
+                calls.append(transition["name"])
+
+        workflow = CountingWorkflow(model=self.model)
+        for _ in range(3):
+            workflow._on_enter_state(
+                {"name": "reject", "source": "*", "destination": "rejected"}
+            )
+        self.assertEqual(calls, ["reject"] * 3)
+        self.assertEqual(len(CountingWorkflow._enter_hooks["rejected"]), 1)
+
+    def test_get_available_transitions(self):
+        available = self.workflow.get_available_transitions()
+        self.assertEqual(
+            [trans["name"] for trans in available], ["submit", "reject"]
+        )
+        # Served from the class index
+        self.assertIs(available, self.workflow.get_available_transitions("draft"))
+        self.assertEqual(
+            [trans["name"] for trans in self.workflow.get_available_transitions("unknown")],
+            ["reject"],
+        )
+
+    def test_state_indexes_multiple_sources(self):
+        class OtherWorkflow(MyWorkflow):
+            transitions = MyWorkflow.transitions + [
+                {"name": "reopen", "source": ["completed", "rejected"],
+                 "destination": "draft"},
+            ]
+
+        self.assertEqual(
+            [trans["name"] for trans in OtherWorkflow._transitions_by_source["rejected"]],
+            ["reject", "reopen"],
+        )
+        self.assertEqual(
+            [trans["name"] for trans in OtherWorkflow._transitions_by_destination["draft"]],
+            ["reopen"],
+        )
+        self.model.state = "completed"
+        workflow = OtherWorkflow(model=self.model)
+        self.assertEqual(workflow.get_transition("draft").args, ("reopen",))
+
+    def test_bulk_run_transition(self):
+        models = [MyOrder(), MyOrder(state="submitted"), MyOrder()]
+        models[2].allow_submit = False
+        for model in models:
+            model.is_saved = False
+
+        results = MyWorkflow.bulk_run_transition("submit", models, chunk_size=2)
+
+        self.assertEqual([res.model for res in results], models)
+        self.assertEqual([res.success for res in results], [True, False, False])
+        self.assertIsInstance(results[1].error, InvalidTransition)
+        self.assertIsInstance(results[2].error, ForbiddenTransition)
+
+        self.assertEqual(models[0].state, "submitted")
+        self.assertTrue(models[0].submit_called)
+        self.assertTrue(models[0].after_submit_called)
+        self.assertTrue(models[0].is_saved)
+        self.assertEqual(LoggingModel.logs["model"], models[0])
+
+        self.assertEqual(models[2].state, "draft")
+        self.assertFalse(hasattr(models[2], "submit_called"))
+
+        with self.assertRaises(TransitionDoesNotExist):
+            MyWorkflow.bulk_run_transition("does_not_exist", models)
+
+    def test_bulk_run_transition_error(self):
+        class FailingWorkflow(MyWorkflow):
+            def after_submit(self, res):
+                if self.model.allow_submit == "fail":
+                    raise ValueError()
+                super().after_submit(res)
+
+        models = [MyOrder() for _ in range(5)]
+        models[2].allow_submit = "fail"
+
+        results = FailingWorkflow.bulk_run_transition(
+            "submit", models, chunk_size=2)
+
+        # The chunk of the failed model is rolled back
+        self.assertEqual(
+            [res.success for res in results], [True, True, False, False, True])
+        self.assertIsInstance(results[2].error, ValueError)
+        self.assertIs(results[3].error, results[2].error)
+        self.assertEqual(
+            [model.state for model in models],
+            ["submitted", "submitted", "draft", "draft", "submitted"])
+
+        models = [MyOrder() for _ in range(3)]
+        models[1].allow_submit = "fail"
+        results = FailingWorkflow.bulk_run_transition(
+            "submit", models, savepoints=True)
+        self.assertEqual([res.success for res in results], [True, False, True])
+        self.assertEqual(
+            [model.state for model in models],
+            ["submitted", "draft", "submitted"])
+
+    def test_bulk_run_transition_events_after_commit(self):
+        class FailingLog(object):
+            calls = 0
+
+            @classmethod
+            def log(cls, **kwargs):
+                cls.calls += 1
+                if cls.calls == 2:
+                    raise ValueError()
+
+        class EventWorkflow(MyWorkflow):
+            event_manager_classes = (MyEventManager, )
+            db_logging_class = FailingLog
+
+        pushed = []
+        with mock.patch.object(
+                MyEventManager, "_push_event", side_effect=pushed.append):
+            results = EventWorkflow.bulk_run_transition(
+                "submit", [MyOrder(), MyOrder()])
+            # The chunk was rolled back: no event for the first model
+            self.assertEqual([res.success for res in results], [False, False])
+            self.assertEqual(pushed, [])
+
+            EventWorkflow.bulk_run_transition("submit", [MyOrder()])
+            self.assertEqual(len(pushed), 1)
+
+    def test_bulk_run_transition_tracked_fields(self):
+        class TrackedWorkflow(MyWorkflow):
+            track_changes = True
+
+            def after_submit(self, res):
+                self.model.comment = "submitted"
+
+        models = [MyTrackedOrder(), MyTrackedOrder()]
+        TrackedWorkflow.bulk_run_transition("submit", models)
+        self.assertEqual(models[0].update_fields, ["state", "comment"])
+        self.assertEqual(models[1].comment, "submitted")
+
+    def test_bulk_run_transition_savepoints(self):
+        from pieuvre import bulk
+
+        class HooklessWorkflow(Workflow):
+            transitions = MyWorkflow.transitions
+
+        atomic = mock.Mock(wraps=bulk.transaction.atomic)
+        with mock.patch.object(bulk.transaction, "atomic", atomic):
+            HooklessWorkflow.bulk_run_transition(
+                "submit", [MyOrder(), MyOrder()])
+            # The transaction of the chunk only
+            self.assertEqual(atomic.call_count, 1)
+
+            atomic.reset_mock()
+            MyWorkflow.bulk_run_transition("submit", [MyOrder(), MyOrder()])
+            # A savepoint per model running hooks
+            self.assertEqual(atomic.call_count, 3)
+
+    def test_bulk_run_transition_method(self):
+        class CustomWorkflow(MyWorkflow):
+            def submit(self):
+                if self.model.allow_submit == "skip":
+                    return None
+                self.model.custom_submit_called = True
+                return super().submit()
+
+            def complete(self):
+                self.model.custom_complete_called = True
+                return self.default_transition("complete")
+
+        models = [MyOrder(), MyOrder()]
+        models[1].allow_submit = "skip"
+        results = CustomWorkflow.bulk_run_transition("submit", models)
+
+        self.assertTrue(results[0].success)
+        self.assertTrue(models[0].custom_submit_called)
+        self.assertTrue(models[0].submit_called)
+        self.assertEqual(models[0].state, "submitted")
+
+        # The method did not run the transition
+        self.assertIsInstance(results[1].error, ForbiddenTransition)
+        self.assertEqual(models[1].state, "draft")
+
+        results = CustomWorkflow.bulk_run_transition("complete", models[:1])
+        self.assertTrue(results[0].success)
+        self.assertTrue(models[0].custom_complete_called)
+        self.assertEqual(models[0].state, "completed")
+
+    def test_track_changes(self):
+        class TrackedWorkflow(MyWorkflow):
+            track_changes = True
+
+            def before_submit(self):
+                self.model.comment = "submitted"
+
+        model = MyTrackedOrder()
+        TrackedWorkflow(model=model).submit()
+        self.assertEqual(model.update_fields, ["state", "comment"])
+
+        # Changes are not tracked by default
+        model = MyTrackedOrder()
+        MyWorkflow(model=model).submit()
+        self.assertIsNone(model.update_fields)
+
+    def test_track_changes_in_place(self):
+        class TrackedWorkflow(MyWorkflow):
+            track_changes = True
+
+            def after_submit(self, res):
+                self.model.data["submitted"] = True
+
+        model = MyTrackedOrder()
+        TrackedWorkflow(model=model).submit()
+        self.assertEqual(model.update_fields, ["state", "data"])
+
+    def test_track_changes_failure(self):
+        class TrackedWorkflow(MyWorkflow):
+            track_changes = True
+
+            def before_submit(self):
+                self.model.comment = "submitted"
+                if self.model.allow_submit == "fail":
+                    raise ValueError()
+
+        model = MyTrackedOrder()
+        model.allow_submit = "fail"
+        workflow = TrackedWorkflow(model=model)
+        with self.assertRaises(ValueError):
+            workflow.submit()
+        self.assertEqual(workflow._change_snapshots, [])
+
+        # The next transition saves its own changes only
+        model.comment = ""
+        workflow.reject()
+        self.assertEqual(model.update_fields, ["state"])
+        self.assertEqual(workflow._change_snapshots, [])
+
+    def test_path_to(self):
+        self.assertEqual(self.workflow.path_to("draft"), [])
+        self.assertEqual(
+            [trans["name"] for trans in self.workflow.path_to("completed")],
+            ["submit", "complete"])
+        self.assertEqual(
+            [trans["name"] for trans in self.workflow.path_to("rejected")],
+            ["reject"])
+
+        self.model.state = "rejected"
+        with self.assertRaises(TransitionNotFound):
+            self.workflow.path_to("completed")
+
+    def test_advance_to(self):
+        class TrackedWorkflow(MyWorkflow):
+            track_changes = True
+
+            def before_complete(self):
+                self.model.comment = "completed"
+
+        saves = []
+        model = MyTrackedOrder()
+        model.save = lambda update_fields=None: saves.append(update_fields)
+        LoggingModel.logs = {}
+
+        done = TrackedWorkflow(model=model).advance_to("completed")
+
+        self.assertEqual([trans["source"] for trans in done], ["draft", "submitted"])
+        self.assertEqual(model.state, "completed")
+        self.assertTrue(model.submit_called)
+        self.assertTrue(model.on_enter_submitted_called)
+        self.assertEqual(saves, [["state", "comment"]])
+        self.assertEqual(LoggingModel.logs["transition"], "complete")
+
+    def test_advance_to_failure(self):
+        class FailingWorkflow(MyWorkflow):
+            def check_complete(self):
+                return False
+
+        with self.assertRaises(ForbiddenTransition):
+            FailingWorkflow(model=self.model).advance_to("completed")
+
+        self.assertEqual(self.model.state, "draft")
+        self.assertTrue(self.model.submit_called)
+        self.assertFalse(self.model.is_saved)
+
+    def test_coalesce_saves(self):
+        logs = []
+
+        class ListLoggingModel(object):
+            @classmethod
+            def log(cls, **kwargs):
+                logs.append(kwargs["transition"])
+
+        class ChainedWorkflow(MyWorkflow):
+            db_logging_class = ListLoggingModel
+            coalesce_saves = True
+            track_changes = True
+
+            def after_submit(self, res):
+                # Not saved yet
+                logs.append(saves[:])
+                self.complete()
+
+            def after_complete(self, res):
+                self.model.comment = "completed"
+
+        saves = []
+        model = MyTrackedOrder()
+        model.save = lambda update_fields=None: saves.append(update_fields)
+
+        ChainedWorkflow(model=model).submit()
+
+        self.assertEqual(model.state, "completed")
+        self.assertEqual(saves, [["state", "comment"]])
+        self.assertEqual(logs, [[], "complete", "submit"])
+
+        # Saves are not deferred by default
+        class NestedWorkflow(MyWorkflow):
+            def after_submit(self, res):
+                self.complete()
+
+        saves = []
+        model = MyTrackedOrder()
+        model.save = lambda update_fields=None: saves.append(update_fields)
+        NestedWorkflow(model=model).submit()
+        self.assertEqual(saves, [None, None])
+
+    def test_coalesce_saves_failure(self):
+        class FailingWorkflow(MyWorkflow):
+            coalesce_saves = True
+
+            def after_submit(self, res):
+                self.complete()
+
+            def after_complete(self, res):
+                raise ValueError()
+
+        saves = []
+        self.model.save = lambda: saves.append(None)
+        with self.assertRaises(ValueError):
+            FailingWorkflow(model=self.model).submit()
+        self.assertEqual(saves, [])
+
+    def test_unit_of_work(self):
+        saves = []
+
+        class SavedOrder(MyTrackedOrder):
+            def save(self, update_fields=None):
+                saves.append((self, update_fields))
+
+        first, second = SavedOrder(), SavedOrder()
+        with UnitOfWork() as unit:
+            unit.save(first, ["state"])
+            unit.save(second, ["state"])
+            mark = unit.mark()
+            unit.save(first, ["comment"])
+            unit.rollback(mark)
+            unit.save(first, ["state", "date"])
+
+        self.assertEqual(
+            saves, [(first, ["state", "date"]), (second, ["state"])])
+
+        saves = []
+        with self.assertRaises(ValueError):
+            with UnitOfWork() as unit:
+                unit.save(first, None)
+                raise ValueError()
+        self.assertEqual(saves, [])
+
+    def test_cas_writes(self):
+        database = {1: {"state": "draft", "comment": ""}}
+
+        class Manager(object):
+            def filter(self, pk, state):
+                return QuerySet(pk, state)
+
+        class QuerySet(object):
+            def __init__(self, pk, state):
+                self.pk, self.state = pk, state
+
+            def update(self, **values):
+                if database[self.pk]["state"] != self.state:
+                    return 0
+                database[self.pk].update(values)
+                return 1
+
+        class AutoNowField(Field):
+            def pre_save(self, model, add):
+                model.updated += 1
+                return model.updated
+
+        class CASOrder(MyTrackedOrder):
+            _default_manager = Manager()
+
+            class _meta(MyTrackedOrder._meta):
+                concrete_fields = MyTrackedOrder._meta.concrete_fields + [
+                    AutoNowField("updated")]
+
+            def __init__(self, state="draft"):
+                super().__init__(state=state)
+                self.updated = 0
+
+            @property
+            def pk(self):
+                return self.id
+
+            def refresh_from_db(self):
+                self.state = database[self.id]["state"]
+                self.comment = database[self.id]["comment"]
+
+        class CASWorkflow(MyWorkflow):
+            cas_writes = True
+            track_changes = True
+
+            def after_submit(self, res):
+                self.model.comment = "submitted"
+
+        model = CASOrder()
+        CASWorkflow(model=model).submit()
+        self.assertEqual(database[1], {"state": "submitted", "comment": "submitted"})
+
+        # All the fields are saved without ``track_changes``, their values
+        # prepared with ``pre_save`` as by ``save``
+        database[2] = {"state": "draft"}
+        model = CASOrder()
+        model.id = 2
+
+        class FullCASWorkflow(MyWorkflow):
+            cas_writes = True
+
+        FullCASWorkflow(model=model).submit()
+        self.assertEqual(database[2]["updated"], 1)
+        self.assertEqual(model.updated, 1)
+        self.assertNotIn("id", database[2])
+
+        # Concurrent transition
+        stale = CASOrder()
+        with self.assertRaises(ConcurrentTransition) as context:
+            CASWorkflow(model=stale).reject()
+        self.assertEqual(context.exception.kwargs["current_state"], "draft")
+        self.assertEqual(database[1]["state"], "submitted")
+
+        # Retried after reloading the model
+        class RetriedWorkflow(CASWorkflow):
+            cas_retries = 1
+
+        stale = CASOrder()
+        RetriedWorkflow(model=stale).reject()
+        self.assertEqual(database[1]["state"], "rejected")
+
+        stale = CASOrder()
+        with self.assertRaises(InvalidTransition):
+            RetriedWorkflow(model=stale).submit()
+        self.assertEqual(stale.state, "rejected")
+
+        # Not retried in an atomic block of the caller
+        database[1]["state"] = "draft"
+        stale = CASOrder()
+        database[1]["state"] = "submitted"
+        with mock.patch.object(cas, "in_atomic_block", lambda model: True):
+            with self.assertRaises(ConcurrentTransition):
+                RetriedWorkflow(model=stale).reject()
+        self.assertEqual(database[1]["state"], "submitted")
+
+    def test_transition_attribute_cached(self):
+        class CachedWorkflow(Workflow):
+            transitions = [
+                {"name": "complete", "source": "draft",
+                 "destination": "completed"},
+            ]
+
+        # Set when the class is compiled, not on first access
+        descriptor = CachedWorkflow.__dict__["complete"]
+        self.assertIs(CachedWorkflow.complete, descriptor)
+
+        workflow = CachedWorkflow(model=self.model)
+        self.assertEqual(workflow.complete.args, ("complete", ))
+        self.assertIs(workflow.complete, workflow.complete)
+        self.assertIs(CachedWorkflow.__dict__["complete"], descriptor)
+
+        class RemovedWorkflow(CachedWorkflow):
+            transitions = []
+
+        with self.assertRaises(AttributeError):
+            RemovedWorkflow(model=self.model).complete
+
+        CachedWorkflow.transitions = []
+        self.assertNotIn("complete", CachedWorkflow.__dict__)
+
+    def test_get_allowed_transitions(self):
+        calls = []
+
+        class CountingWorkflow(MyWorkflow):
+            transitions = MyWorkflow.transitions + [
+                {"name": "submit_urgent", "source": "draft",
+                 "destination": "submitted"},
+            ]
+
+            @on_exit_state_check("draft")
+            def check_leaving_draft(self):
+                calls.append("leaving_draft")
+                return self.model.allow_leaving_draft_state
+
+            @on_enter_state_check("submitted")
+            def check_entering_submitted(self):
+                calls.append("entering_submitted")
+                return self.model.allow_entering_submitted_state
+
+        workflow = CountingWorkflow(model=self.model)
+        allowed = workflow.get_allowed_transitions()
+        self.assertEqual(allowed.state, "draft")
+        self.assertEqual(allowed.names, ["submit", "reject", "submit_urgent"])
+        self.assertEqual(allowed.forbidden, {})
+        self.assertTrue(allowed.is_allowed("submit"))
+        # Checks shared by the transitions are called once
+        self.assertEqual(calls, ["leaving_draft", "entering_submitted"])
+
+        del calls[:]
+        self.model.allow_submit = False
+        self.model.allow_entering_submitted_state = False
+        allowed = workflow.get_allowed_transitions()
+        self.assertEqual(allowed.names, ["reject"])
+        self.assertEqual(allowed.forbidden, {
+            "submit": "check_entering_submitted",
+            "submit_urgent": "check_entering_submitted",
+        })
+        self.assertEqual(calls, ["leaving_draft", "entering_submitted"])
+
+        del calls[:]
+        self.model.allow_leaving_draft_state = False
+        allowed = workflow.get_allowed_transitions()
+        self.assertEqual(allowed.names, [])
+        self.assertEqual(set(allowed.forbidden.values()), {"check_leaving_draft"})
+        # Failed exit checks short-circuit the other checks
+        self.assertEqual(calls, ["leaving_draft"])
+
+        self.model.allow_entering_submitted_state = True
+        allowed = workflow.get_allowed_transitions("submitted")
+        self.assertEqual(allowed.names, ["complete", "reject"])
+
+    def test_get_allowed_transitions_overridden_condition(self):
+        class OverridingWorkflow(MyWorkflow):
+            def check_transition_condition(self, transition, *args, **kwargs):
+                if transition["name"] == "submit":
+                    raise ForbiddenTransition(
+                        transition=transition["name"],
+                        current_state=self.state,
+                        to_state=transition["destination"])
+
+        # The checks are replaced by the override
+        self.model.allow_leaving_draft_state = False
+        allowed = OverridingWorkflow(model=self.model).get_allowed_transitions()
+        self.assertEqual(allowed.names, ["reject"])
+        self.assertEqual(
+            allowed.forbidden, {"submit": "check_transition_condition"})
+
+    def test_bulk_get_allowed_transitions(self):
+        models = [MyOrder(), MyOrder(), MyOrder(state="submitted")]
+        models[1].allow_submit = False
+        results = MyWorkflow.bulk_get_allowed_transitions(models)
+        self.assertEqual(
+            [result.names for result in results],
+            [["submit", "reject"], ["reject"], ["complete", "reject"]])
+        self.assertEqual(results[1].forbidden, {"submit": "check_submit"})
+        self.assertIs(results[2].model, models[2])
+
+
+class MySharedWorkflow(MyWorkflow):
+    event_manager_classes = (MyEventManager, )
+    track_changes = True
+
+    def after_submit(self, res):
+        super().after_submit(res)
+        # Nested transition on another model
+        if getattr(self.model, "other", None) is not None:
+            BoundWorkflow(self.shared(), self.model.other).reject()
+
+
+class TestSharedWorkflow(TestCase):
+    def setUp(self):
+        self.workflow = MySharedWorkflow.shared()
+
+    def test_shared(self):
+        self.assertIs(MySharedWorkflow.shared(), self.workflow)
+        self.assertIs(type(self.workflow).shared(), self.workflow)
+        self.assertIsInstance(self.workflow, MySharedWorkflow)
+        self.assertIsNot(MyWorkflow.shared(), self.workflow)
+
+    def test_bind(self):
+        model = MyOrder()
+        with self.workflow.bind(model) as workflow:
+            self.assertEqual(workflow.state, "draft")
+            workflow.submit()
+
+        self.assertEqual(model.state, "submitted")
+        self.assertTrue(model.on_enter_submitted_called)
+        self.assertEqual(LoggingModel.logs["model"], model)
+
+        with self.assertRaises(AttributeError):
+            self.workflow.model
+
+    def test_immutable(self):
+        with self.assertRaises(AttributeError):
+            self.workflow.model = MyOrder()
+        with self.assertRaises(AttributeError):
+            self.workflow.flag = True
+
+        model = MyOrder(state="submitted")
+        with self.workflow.bind(model) as workflow:
+            workflow.complete()
+        self.assertIs(self.workflow.complete, self.workflow.complete)
+        self.assertEqual(model.state, "completed")
+
+    def test_bound_workflow(self):
+        model, other = MyTrackedOrder(), MyTrackedOrder()
+        model.other = other
+        bound = BoundWorkflow(self.workflow, model)
+
+        self.assertEqual(bound.state, "draft")
+        self.assertIs(bound.submit, bound.submit)
+        bound.submit()
+
+        self.assertEqual(model.state, "submitted")
+        self.assertEqual(model.update_fields, ["state"])
+        self.assertEqual(other.state, "rejected")
+        self.assertEqual(bound.event_managers[0].model, model)
+
+        forbidden = MyOrder()
+        forbidden.allow_submit = False
+        with self.assertRaises(ForbiddenTransition):
+            BoundWorkflow(self.workflow, forbidden).submit()
+        with self.assertRaises(InvalidTransition):
+            bound.submit()
+
+        bound.get_transition("completed")()
+        self.assertEqual(model.state, "completed")